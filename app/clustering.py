@@ -0,0 +1,31 @@
+from collections import Counter, defaultdict
+from typing import Dict, Iterable, Optional
+
+from Levenshtein import distance
+
+
+def cluster_words(words: Iterable[str], max_distance: int, min_length: int = 0) -> Dict[str, str]:
+    # maps every non empty word to the leader of its cluster, the most common spelling wins the leadership
+    counts = Counter(word for word in words if word)
+    leaders_by_length = defaultdict(list)
+    clusters = {}
+    for word in sorted(counts, key=lambda w: -counts[w]):
+        leader = word
+        if max_distance > 0 and len(word) >= min_length:
+            found = find_leader(word, leaders_by_length, max_distance)
+            if found is None:
+                leaders_by_length[len(word)].append(word)
+            else:
+                leader = found
+        clusters[word] = leader
+    return clusters
+
+
+def find_leader(word: str, leaders_by_length: dict, max_distance: int) -> Optional[str]:
+    # only leaders whose length is within max_distance can be within max_distance edits
+    for length_difference in range(max_distance + 1):
+        for length in {len(word) - length_difference, len(word) + length_difference}:
+            for leader in leaders_by_length.get(length, ()):
+                if distance(word, leader) <= max_distance:
+                    return leader
+    return None
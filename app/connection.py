@@ -1,9 +1,142 @@
+import asyncio
+import logging
+import os
+import time
+from typing import Awaitable, Callable, Optional
+
 from starlette.websockets import WebSocket
 
 from app.player import Player
+from app.protocol import Codec, Frame, json_codec
+from app.rate_limit import MESSAGE_BURST, MESSAGE_RATE, TokenBucket
+from app.spans import NO_SPAN, current_span, tracer
+
+# a connection whose queue is still full after this many frames in a row is not catching up
+MAX_OVERFLOWS = int(os.getenv('SEND_MAX_OVERFLOWS', 3))
+POLICY_VIOLATION_CLOSE_CODE = 1008
+
+log = logging.getLogger(__name__)
 
 
 class Connection:
-    def __init__(self, ws: WebSocket, player: Player):
+    __slots__ = ('ws', 'player', 'codec', 'max_queue', 'outbox', 'writer', 'on_send_failure', 'failure_task',
+                 'sent', 'dropped', 'last_send_latency', 'max_send_latency', 'total_send_latency', 'message_bucket',
+                 'rejected', 'max_overflows', 'overflows')
+
+    def __init__(self, ws: Optional[WebSocket], player: Player, max_queue: int = 32, codec: Codec = json_codec,
+                 max_overflows: int = MAX_OVERFLOWS):
         self.ws = ws
         self.player = player
+        self.codec = codec
+        self.max_queue = max_queue
+        self.outbox: Optional[asyncio.Queue] = None
+        self.writer: Optional[asyncio.Task] = None
+        self.on_send_failure: Optional[Callable[['Connection'], Awaitable]] = None
+        self.failure_task: Optional[asyncio.Task] = None
+        self.sent = 0
+        self.dropped = 0
+        self.last_send_latency = 0.0
+        self.max_send_latency = 0.0
+        self.total_send_latency = 0.0
+        self.message_bucket = TokenBucket(MESSAGE_RATE, MESSAGE_BURST)
+        self.rejected = 0
+        self.max_overflows = max_overflows
+        self.overflows = 0
+
+    def enqueue(self, frame: Frame) -> bool:
+        if self.ws is None:
+            return True  # suspended, the current state is sent again on resume
+        if self.writer is not None and self.writer.done():
+            self.dropped += 1
+            # after a failed send the connection is on_send_failure's to handle, not the caller's
+            return self.failure_task is not None
+        if self.writer is None:
+            self.outbox = asyncio.Queue(self.max_queue)
+            self.writer = asyncio.get_running_loop().create_task(self.run_writer())
+        item = (time.perf_counter(), frame, current_span.get())
+        try:
+            self.outbox.put_nowait(item)
+            self.overflows = 0
+        except asyncio.QueueFull:
+            self.dropped += 1
+            self.overflows += 1
+            if self.overflows >= self.max_overflows:
+                return False
+            # every frame carries the whole state, so the oldest queued one is the one to lose
+            self.outbox.get_nowait()
+            self.outbox.task_done()
+            self.outbox.put_nowait(item)
+        return True
+
+    async def run_writer(self):
+        while True:
+            enqueued_at, frame, parent = await self.outbox.get()
+            try:
+                with self.send_span(parent, len(frame)):
+                    if isinstance(frame, bytes):
+                        await self.ws.send_bytes(frame)
+                    else:
+                        await self.ws.send_text(frame)
+            except Exception as e:
+                log.log(30, "send to %s failed: %s %s", self.player.id, e.__class__.__name__, e)
+                self.discard_outbox()
+                if self.on_send_failure is not None:
+                    self.failure_task = asyncio.get_running_loop().create_task(self.on_send_failure(self))
+                return
+            latency = time.perf_counter() - enqueued_at
+            self.sent += 1
+            self.last_send_latency = latency
+            self.total_send_latency += latency
+            self.max_send_latency = max(self.max_send_latency, latency)
+            self.outbox.task_done()
+
+    def send_span(self, parent, size: int):
+        # only frames queued inside a span, a traced broadcast, are sent in a span of their own
+        if parent is None:
+            return NO_SPAN
+        return tracer.span("send", parent=parent, player_id=self.player.id, size=size)
+
+    def discard_outbox(self):
+        self.outbox.task_done()
+        while not self.outbox.empty():
+            self.outbox.get_nowait()
+            self.dropped += 1
+            self.outbox.task_done()
+
+    async def drain(self):
+        if self.writer is not None and not self.writer.done():
+            await self.outbox.join()
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.cancel()
+
+    def suspend(self):
+        self.close()
+        if self.outbox is not None:
+            self.dropped += self.outbox.qsize()
+        self.ws = None
+        self.outbox = None
+        self.writer = None
+
+    def resume(self, ws: WebSocket):
+        self.ws = ws
+
+    @property
+    def suspended(self) -> bool:
+        return self.ws is None
+
+    @property
+    def queue_depth(self) -> int:
+        return self.outbox.qsize() if self.outbox is not None else 0
+
+    def get_stats(self) -> dict:
+        return {"player_id": self.player.id,
+                "queue_depth": self.queue_depth,
+                "sent": self.sent,
+                "dropped": self.dropped,
+                "rejected": self.rejected,
+                "overflows": self.overflows,
+                "last_send_latency": self.last_send_latency,
+                "max_send_latency": self.max_send_latency,
+                "avg_send_latency": self.total_send_latency / self.sent if self.sent else 0.0}
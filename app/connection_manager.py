@@ -1,23 +1,114 @@
-import json
+import asyncio
 import logging
+import os
+import time
+from collections import Counter
+from typing import Dict, List, Tuple
 
 from starlette.websockets import WebSocket
 
-from app.connection import Connection
+from app.connection import Connection, POLICY_VIOLATION_CLOSE_CODE
+from app.exporter import exporter
+from app.game_state import GameState
+from app.metrics import Sample, ws_message_seconds, ws_messages
+from app.phase_batch import phase_batcher
 from app.player import Player
+from app.protocol import Codec, Frame, decode_move, json_codec
+from app.rate_limit import MAX_FRAME_SIZE, MAX_VIOLATIONS
 from app.room import Room
-from app.server_errors import PlayerIdAlreadyInUse, NoRoomWithThisId, RoomIdAlreadyInUse
+from app.room_registry import RoomRegistry
+from app.room_store import RoomStore, restore_room, room_store, snapshot_room
+from app.scheduler import scheduler
+from app.server_errors import PlayerIdAlreadyInUse, NoRoomWithThisId, ServerIsDraining, InvalidMove
+
+PINNED_ROOM_ID = "1"
+# 1012 (service restart) tells the clients to reconnect with the same client id
+DRAIN_CLOSE_CODE = 1012
+DRAIN_SEND_TIMEOUT = 5
+
+log = logging.getLogger(__name__)
+ROUND_PHASES = (GameState.completing, GameState.voting)
 
 
 class ConnectionManager:
-    def __init__(self):
-        self.rooms = [Room(room_id="1")]
+    def __init__(self, store: RoomStore = room_store):
+        self.store = store
+        self.rooms = RoomRegistry(max_rooms=int(os.getenv('MAX_ROOMS', 0)),
+                                  idle_timeout=float(os.getenv('ROOM_IDLE_TIMEOUT', 0)))
+        self.connections_by_ws: Dict[int, Tuple[Room, Connection]] = {}
+        self.connections_by_player: Dict[Tuple[str, str], Connection] = {}
+        self.rooms.on_create.append(self.on_room_created)
+        self.rooms.on_delete.append(self.on_room_deleted)
+        self.draining = False
+        self.rejected = Counter()
+        # read before the event loop runs, at startup
+        if not self.store.durable or PINNED_ROOM_ID not in self.store.room_ids():
+            self.rooms.add(Room(room_id=PINNED_ROOM_ID), pinned=True)
+        # otherwise the room was handed over by a drained server and is restored on the first connection
 
     def get_room(self, room_id):
+        return self.rooms.get(room_id)
+
+    async def get_or_restore_room(self, room_id):
         try:
-            return next(r for r in self.rooms if r.id == room_id)
-        except StopIteration:
-            raise NoRoomWithThisId
+            return self.rooms.get(room_id)
+        except NoRoomWithThisId:
+            snapshot = await self.store.load(room_id)
+            if snapshot is None:
+                raise
+        if room_id in self.rooms:
+            return self.rooms.get(room_id)  # restored by another player while the snapshot was read
+        # restoring schedules the room's timers, a room that does not fit must not leave them behind
+        self.rooms.ensure_capacity()
+        room = restore_room(snapshot)
+        log.info("restored room %s in %s", room_id, room.game.game_state)
+        return self.rooms.add(room, pinned=room_id == PINNED_ROOM_ID)
+
+    def save_room(self, room: Room):
+        if self.store.durable:
+            self.store.save(room.id, snapshot_room(room))
+
+    def on_room_created(self, room: Room):
+        room.on_connection_added.append(self.index_connection)
+        room.on_connection_removed.append(self.unindex_connection)
+        room.on_connection_suspended.append(self.unindex_websocket)
+        room.on_connection_resumed.append(self.index_websocket)
+        room.on_phase_change.append(self.save_room)
+        for connection in room.active_connections:
+            self.index_connection(room, connection)
+        self.save_room(room)
+
+    def on_room_deleted(self, room: Room):
+        room.scheduler.cancel(room.id)
+        self.store.delete(room.id)
+        for connection in room.active_connections:
+            room.scheduler.cancel(room.reconnect_key(connection.player.id))
+            self.unindex_connection(room, connection)
+
+    def index_connection(self, room: Room, connection: Connection):
+        self.index_websocket(room, connection)
+        self.connections_by_player[(room.id, connection.player.id)] = connection
+
+    def unindex_connection(self, room: Room, connection: Connection):
+        self.unindex_websocket(room, connection)
+        if self.connections_by_player.get((room.id, connection.player.id)) is connection:
+            del self.connections_by_player[(room.id, connection.player.id)]
+
+    def index_websocket(self, room: Room, connection: Connection):
+        if not connection.suspended:
+            self.connections_by_ws[id(connection.ws)] = (room, connection)
+
+    def unindex_websocket(self, room: Room, connection: Connection):
+        if not connection.suspended:
+            self.connections_by_ws.pop(id(connection.ws), None)
+
+    async def evict_idle_rooms(self):
+        if self.rooms.idle_timeout <= 0:
+            return
+        evicted = self.rooms.evict_idle()
+        if evicted:
+            log.info("evicted idle rooms: %s", evicted)
+        scheduler.schedule(("evict-idle-rooms",), self.rooms.idle_timeout / 2, self.evict_idle_rooms)
 
     async def restart_game(self, room_id: str):
         room = self.get_room(room_id)
@@ -35,19 +126,40 @@ class ConnectionManager:
         for room in self.rooms:
             await room.end_game()
 
-    async def connect(self, websocket: WebSocket, room_id: str, client_id: str, nick: str):
+    async def connect(self, websocket: WebSocket, room_id: str, client_id: str, nick: str,
+                      codec: Codec = json_codec):
+        if self.draining:
+            raise ServerIsDraining
+        room = await self.get_or_restore_room(room_id)
+        connection = self.get_connection(room_id, client_id)
+        if connection is not None and connection.suspended:
+            await self.accept(websocket, codec)
+            connection.codec = codec
+            await room.resume_connection(connection, websocket)
+            return
         self.validate_client_id_availability(room_id, client_id)
-        await websocket.accept()
-        connection = Connection(ws=websocket, player=Player(player_id=client_id, nick=nick, is_playing=False))
+        await self.accept(websocket, codec)
+        connection = Connection(ws=websocket, player=Player(player_id=client_id, nick=nick, is_playing=False),
+                                codec=codec)
         await self.append_connection(room_id, connection)
 
+    @staticmethod
+    async def accept(websocket: WebSocket, codec: Codec):
+        if codec.subprotocol is None:
+            await websocket.accept()
+        else:
+            await websocket.accept(subprotocol=codec.subprotocol)
+
     async def append_connection(self, room_id, connection):
         room = self.get_room(room_id)
         await room.append_connection(connection)
 
     async def disconnect(self, websocket: WebSocket):
-        connection_with_given_ws, room = self.get_active_connection(websocket)
-        await room.remove_connection(connection_with_given_ws)
+        active_connection = self.get_active_connection(websocket)
+        if active_connection is None:
+            return  # already removed, e.g. kicked before the socket error surfaced
+        connection_with_given_ws, room = active_connection
+        await room.suspend_connection(connection_with_given_ws)
 
     # async def broadcast(self, room_id):
     #     room = self.get_room(room_id)
@@ -61,40 +173,156 @@ class ConnectionManager:
         room = self.get_room(room_id)
         await room.kick_player(player_id)
 
-    async def handle_ws_message(self, text_message, room_id, client_id):
+    async def handle_ws_message(self, message: Frame, room_id, client_id):
+        started = time.perf_counter()
+        ws_messages.inc()
         try:
-            room = self.get_room(room_id)
-            json_message = json.loads(text_message)
-            room.handle_players_move(client_id, json_message)
-        except KeyError:
-            print("handle message")
-            pass
+            await self.apply_ws_message(message, room_id, client_id)
+        finally:
+            ws_message_seconds.observe(time.perf_counter() - started)
+
+    async def apply_ws_message(self, message: Frame, room_id, client_id):
+        # cheapest checks first, a flooding client should cost as little as possible before it is kicked
+        room = self.get_room(room_id)
+        connection = self.get_connection(room_id, client_id)
+        if connection is None:
+            return
+        if len(message) > MAX_FRAME_SIZE:
+            return await self.reject_message(room, connection, "frame_too_large", kick=True)
+        if not connection.message_bucket.allow():
+            return await self.reject_message(room, connection, "rate_limited")
+        if not room.message_bucket.allow():
+            self.rejected["room_rate_limited"] += 1
+            return
+        if not connection.codec.looks_like_object(message):
+            return await self.reject_message(room, connection, "malformed")
+        try:
+            player_move = decode_move(connection.codec, message)
+        except InvalidMove as e:
+            log.log(30, "rejected move of %s in room %s: %s", client_id, room_id, e.message)
+            return await self.reject_message(room, connection, "malformed")
+        room.handle_players_move(client_id, player_move)
+
+    async def reject_message(self, room: Room, connection: Connection, reason: str, kick: bool = False):
+        self.rejected[reason] += 1
+        connection.rejected += 1
+        if not kick and connection.rejected < MAX_VIOLATIONS:
+            return
+        log.log(30, "kicking %s from room %s after %d rejected messages, last one %s",
+                connection.player.id, room.id, connection.rejected, reason)
+        self.rejected["kicked"] += 1
+        websocket = connection.ws
+        await self.kick_player(room.id, connection.player.id)
+        if websocket is not None:
+            try:
+                await websocket.close(code=POLICY_VIOLATION_CLOSE_CODE)
+            except Exception as e:
+                log.log(30, "closing %s in room %s failed: %s", connection.player.id, room.id, e)
 
     def get_active_connection(self, websocket: WebSocket):
-        for r in self.rooms:
-            for connection in r.active_connections:
-                if connection.ws == websocket:
-                    return connection, r
+        try:
+            room, connection = self.connections_by_ws[id(websocket)]
+        except KeyError:
+            return None
+        return connection, room
+
+    def get_connection(self, room_id: str, player_id: str):
+        return self.connections_by_player.get((room_id, player_id))
 
     def validate_client_id_availability(self, room_id: str, client_id: str):
-        room = self.get_room(room_id)
-        if client_id in [connection.player.id for connection in room.active_connections]:
+        self.get_room(room_id)
+        if (room_id, client_id) in self.connections_by_player:
             raise PlayerIdAlreadyInUse
 
+    def check_indexes(self) -> List[str]:
+        errors = []
+        expected_by_ws = {}
+        expected_by_player = {}
+        for room in self.rooms:
+            for connection in room.active_connections:
+                if not connection.suspended:
+                    expected_by_ws[id(connection.ws)] = (room, connection)
+                expected_by_player[(room.id, connection.player.id)] = connection
+        for key in expected_by_ws.keys() | self.connections_by_ws.keys():
+            expected, indexed = expected_by_ws.get(key), self.connections_by_ws.get(key)
+            if expected is None or indexed is None or expected[0] is not indexed[0] or expected[1] is not indexed[1]:
+                errors.append(f"websocket index mismatch: expected {expected}, indexed {indexed}")
+        for key in expected_by_player.keys() | self.connections_by_player.keys():
+            if expected_by_player.get(key) is not self.connections_by_player.get(key):
+                errors.append(f"player index mismatch for {key}")
+        return errors
+
+    def collect_metrics(self) -> List[Sample]:
+        rooms_by_phase = Counter({state.value: 0 for state in GameState})
+        players = suspended = 0
+        for room in self.rooms:
+            rooms_by_phase[room.game.game_state.value] += 1
+            for connection in room.active_connections:
+                if connection.suspended:
+                    suspended += 1
+                else:
+                    players += 1
+        return [
+            ('panstwa_rooms', 'gauge', 'Rooms by game phase',
+             [({'phase': phase}, count) for phase, count in rooms_by_phase.items()]),
+            ('panstwa_players', 'gauge', 'Players in rooms by connection state',
+             [({'state': 'connected'}, players), ({'state': 'suspended'}, suspended)]),
+            ('panstwa_ws_messages_rejected_total', 'counter', 'Player messages rejected at the edge',
+             [({'reason': reason}, count) for reason, count in sorted(self.rejected.items())]),
+        ]
+
     def get_room_stats(self, room_id):
         room = self.get_room(room_id)
         return room.get_stats
 
     def get_overall_stats(self):
-        return {'rooms_count': len(self.rooms),
-                'rooms_ids': [r.id for r in self.rooms]}
+        return {**self.rooms.get_stats(),
+                'rejected_messages': dict(self.rejected),
+                'scheduler': scheduler.get_stats(),
+                'phase_batch': phase_batcher.get_stats(),
+                'exporter': exporter.get_stats()}
 
     async def create_new_room(self, room_id):
-        if room_id not in [room.id for room in self.rooms]:
-            self.rooms.append(Room(room_id=room_id))
-        else:
-            raise RoomIdAlreadyInUse
+        if self.draining:
+            raise ServerIsDraining
+        self.rooms.add(Room(room_id=room_id))
+
+    async def drain(self, timeout: float) -> dict:
+        # stop taking rooms and players, let running rounds reach score display and hand the rooms over
+        # to the next server through the room store
+        started = time.monotonic()
+        self.draining = True
+        scheduler.cancel(("evict-idle-rooms",))
+        for room in self.rooms:
+            room.draining = True
+        while any(room.game.game_state in ROUND_PHASES for room in self.rooms) and \
+                time.monotonic() - started < timeout:
+            await asyncio.sleep(0.1)
+        rooms = list(self.rooms)
+        rounds_lost = [room.id for room in rooms if room.game.game_state in ROUND_PHASES]
+        for room in rooms:
+            room.scheduler.cancel(room.id)
+            self.save_room(room)
+        self.store.flush()
+        players = sum(len(room.active_connections) for room in rooms)
+        for room in rooms:
+            try:
+                await asyncio.wait_for(room.drain(), DRAIN_SEND_TIMEOUT)
+            except asyncio.TimeoutError:
+                log.log(30, "room %s did not flush its last messages before closing", room.id)
+            for connection in list(room.active_connections):
+                if connection.suspended:
+                    continue
+                try:
+                    await connection.ws.close(code=DRAIN_CLOSE_CODE)
+                except Exception as e:
+                    log.log(30, "closing %s in room %s failed: %s", connection.player.id, room.id, e)
+        report = {"drain_seconds": time.monotonic() - started,
+                  "rooms": len(rooms),
+                  "players": players,
+                  "rounds_lost": len(rounds_lost)}
+        log.log(20 if not rounds_lost else 30, "drained %s, rounds cut short in rooms %s", report, rounds_lost)
+        return report
 
     async def delete_room(self, room_id):
-        room = self.get_room(room_id)
-        self.rooms.remove(room)
+        self.rooms.remove(room_id)
@@ -0,0 +1,97 @@
+import logging
+import mmap
+import os
+import sys
+from array import array
+from typing import Dict, Iterable, Optional
+
+from app.normalization import normalize_answer
+
+MAGIC = b'PMWI'
+INDEX_SUFFIX = '.idx'
+HEADER_SIZE = len(MAGIC) + 4
+
+log = logging.getLogger(__name__)
+
+
+def dictionary_key(word) -> bytes:
+    return normalize_answer(word, fold_diacritics=True).encode()
+
+
+def build_index(words: Iterable[str], path: str):
+    # file layout: magic, word count, count + 1 native uint32 offsets, sorted utf-8 words
+    keys = sorted({dictionary_key(word) for word in words} - {b''})
+    offsets = array('I', [0])
+    for key in keys:
+        offsets.append(offsets[-1] + len(key))
+    with open(path, 'wb') as index_file:
+        index_file.write(MAGIC)
+        index_file.write(array('I', [len(keys)]).tobytes())
+        index_file.write(offsets.tobytes())
+        index_file.write(b''.join(keys))
+
+
+class WordIndex:
+    def __init__(self, path: str):
+        with open(path, 'rb') as index_file:
+            self.buffer = mmap.mmap(index_file.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.buffer[:len(MAGIC)] != MAGIC:
+            raise ValueError(f"{path} is not a word index")
+        self.count = memoryview(self.buffer)[len(MAGIC):HEADER_SIZE].cast('I')[0]
+        self.offsets = memoryview(self.buffer)[HEADER_SIZE:HEADER_SIZE + 4 * (self.count + 1)].cast('I')
+        self.data_start = HEADER_SIZE + 4 * (self.count + 1)
+
+    def __len__(self) -> int:
+        return self.count
+
+    def word_at(self, position: int) -> bytes:
+        return self.buffer[self.data_start + self.offsets[position]:self.data_start + self.offsets[position + 1]]
+
+    def __contains__(self, key: bytes) -> bool:
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            if self.word_at(middle) < key:
+                low = middle + 1
+            else:
+                high = middle
+        return low < self.count and self.word_at(low) == key
+
+
+class AnswerValidator:
+    def __init__(self, indexes: Optional[Dict[str, WordIndex]] = None):
+        self.indexes = {name.lower(): index for name, index in (indexes or {}).items()}
+
+    @classmethod
+    def from_directory(cls, path: Optional[str]) -> 'AnswerValidator':
+        indexes = {}
+        if path:
+            try:
+                for file_name in sorted(os.listdir(path)):
+                    if file_name.endswith(INDEX_SUFFIX):
+                        indexes[file_name[:-len(INDEX_SUFFIX)]] = WordIndex(os.path.join(path, file_name))
+            except (OSError, ValueError) as e:
+                log.log(40, "failed to load dictionaries from %s: %s", path, e)
+        return cls(indexes)
+
+    def check(self, category_name: str, word: str) -> Optional[bool]:
+        index = self.indexes.get(category_name.lower())
+        if index is None:
+            return None
+        return dictionary_key(word) in index
+
+
+def build_directory(source: str, destination: str):
+    # every <category>.txt word list (one word per line) becomes <category>.idx
+    os.makedirs(destination, exist_ok=True)
+    for file_name in sorted(os.listdir(source)):
+        if file_name.endswith('.txt'):
+            with open(os.path.join(source, file_name), encoding='utf-8') as word_list:
+                build_index(word_list.read().splitlines(), os.path.join(destination, file_name[:-4] + INDEX_SUFFIX))
+
+
+validator = AnswerValidator.from_directory(os.getenv('DICTIONARY_PATH'))
+
+
+if __name__ == "__main__":
+    build_directory(sys.argv[1], sys.argv[2])
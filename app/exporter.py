@@ -0,0 +1,228 @@
+import asyncio
+import contextvars
+import heapq
+import itertools
+import json
+import logging
+import os
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional
+
+import httpx
+
+from app.spans import current_span, tracer
+
+SCORES_PATH = "games/handle-results/panstwa-miasta"
+ROOM_STATUS_PATH = "rooms/update-room-status"
+
+log = logging.getLogger(__name__)
+
+
+class Exporter:
+    def __init__(self, base_url: Optional[str] = None, max_queue: int = 1000, batch_size: int = 20,
+                 max_retries: int = 4, backoff: float = 0.5, timeout: float = 5.0,
+                 spill_path: Optional[str] = None, transport: Optional[httpx.AsyncBaseTransport] = None):
+        self.base_url = base_url  # EXPORT_RESULTS_URL when not given, read whenever the worker starts
+        self.url: Optional[str] = None
+        self.max_queue = max_queue
+        self.batch_size = batch_size
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.spill_path = spill_path or os.getenv('EXPORT_SPILL_PATH', 'export_spill.jsonl')
+        self.transport = transport
+        self.room_statuses: OrderedDict = OrderedDict()
+        self.scores: deque = deque()
+        # failed posts waiting for their next attempt: (due, seq, attempt, path, payload, parent)
+        self.retries: list = []
+        self.retry_seq = itertools.count()
+        self.spill_writer: Optional[ThreadPoolExecutor] = None
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.wakeup: Optional[asyncio.Event] = None
+        self.worker: Optional[asyncio.Task] = None
+        self.client: Optional[httpx.AsyncClient] = None
+        self.in_flight = 0
+        self.sent = 0
+        self.failed = 0
+        self.retried = 0
+        self.coalesced = 0
+        self.spilled = 0
+
+    @property
+    def queue_depth(self) -> int:
+        return len(self.room_statuses) + len(self.scores) + len(self.retries)
+
+    def submit_room_status(self, room_id: str, active_players: List[str]):
+        payload = dict(roomId=room_id, activePlayers=active_players)
+        # queued with the span they were submitted in, the parent of the export's span
+        if room_id in self.room_statuses:
+            self.coalesced += 1
+            self.room_statuses[room_id] = (payload, current_span.get())
+        elif self.queue_depth >= self.max_queue:
+            self.spill(ROOM_STATUS_PATH, payload)
+        else:
+            self.room_statuses[room_id] = (payload, current_span.get())
+        self.wake()
+
+    def submit_score(self, room_id: str, results: list):
+        payload = dict(roomId=room_id, results=results)
+        if self.queue_depth >= self.max_queue:
+            self.spill(SCORES_PATH, payload)
+        else:
+            self.scores.append((payload, current_span.get()))
+        self.wake()
+
+    def wake(self):
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return  # picked up by the worker once there is a loop to run on
+        if self.loop is not loop or self.worker is None or self.worker.done():
+            self.start(loop)
+        self.wakeup.set()
+
+    def start(self, loop: asyncio.AbstractEventLoop):
+        self.loop = loop
+        self.wakeup = asyncio.Event()
+        self.url = self.base_url or os.getenv('EXPORT_RESULTS_URL')
+        self.client = httpx.AsyncClient(
+            base_url=self.url or "", transport=self.transport, timeout=self.timeout,
+            limits=httpx.Limits(max_connections=self.batch_size, max_keepalive_connections=self.batch_size))
+        # the worker is shared by all rooms, it must not keep the room and span of the one that started it
+        self.worker = contextvars.Context().run(loop.create_task, self.run())
+
+    async def run(self):
+        while True:
+            if not self.has_ready():
+                # sleeps until something is submitted or the next retry is due
+                delay = self.retries[0][0] - self.loop.time() if self.retries else None
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+            self.wakeup.clear()
+            while self.has_ready():
+                await self.send_batch()
+
+    def has_ready(self) -> bool:
+        return bool(self.room_statuses or self.scores or
+                    (self.retries and self.retries[0][0] <= self.loop.time()))
+
+    def take_batch(self) -> list:
+        batch = []
+        now = self.loop.time()
+        while self.retries and self.retries[0][0] <= now and len(batch) < self.batch_size:
+            _, _, attempt, path, payload, parent = heapq.heappop(self.retries)
+            batch.append((path, payload, parent, attempt))
+        while self.room_statuses and len(batch) < self.batch_size:
+            _, (payload, parent) = self.room_statuses.popitem(last=False)
+            batch.append((ROOM_STATUS_PATH, payload, parent, 0))
+        while self.scores and len(batch) < self.batch_size:
+            payload, parent = self.scores.popleft()
+            batch.append((SCORES_PATH, payload, parent, 0))
+        return batch
+
+    async def send_batch(self):
+        batch = self.take_batch()
+        self.in_flight += len(batch)
+        try:
+            await asyncio.gather(*(self.post(path, payload, parent, attempt)
+                                   for path, payload, parent, attempt in batch))
+        finally:
+            self.in_flight -= len(batch)
+
+    async def post(self, path: str, payload: dict, parent=None, attempt: int = 0):
+        if parent is None:
+            await self.deliver(path, payload, parent, attempt)
+            return
+        with tracer.span("export", parent=parent, path=path, room_id=payload["roomId"], attempt=attempt) as span:
+            if not await self.deliver(path, payload, parent, attempt) and span is not None:
+                span.status = 'ERROR'
+
+    async def deliver(self, path: str, payload: dict, parent=None, attempt: int = 0) -> bool:
+        # one attempt, a failed post is queued again with backoff so it does not hold up the rest of its batch
+        if not self.url:
+            log.log(30, "failed to get EXPORT_RESULTS_URL env var, dropping %s: %s", path, payload)
+            self.failed += 1
+            return False
+        if path == ROOM_STATUS_PATH and payload["roomId"] in self.room_statuses:
+            self.coalesced += 1
+            return True  # a newer status of this room is already queued
+        try:
+            result = await self.client.post(path, json=payload)
+            if result.status_code == 200:
+                self.sent += 1
+                return True
+            log.log(30, "export failed: %s, %s", result.text, result.status_code)
+        except Exception as e:
+            # anything raised here would end the worker and lose the whole batch
+            log.log(30, "export failed: %s %s", e.__class__.__name__, e)
+        if attempt < self.max_retries:
+            self.retried += 1
+            heapq.heappush(self.retries, (self.loop.time() + self.backoff * 2 ** attempt, next(self.retry_seq),
+                                          attempt + 1, path, payload, parent))
+            return False
+        self.failed += 1
+        self.spill(path, payload)
+        return False
+
+    def spill(self, path: str, payload: dict):
+        self.spilled += 1
+        line = json.dumps(dict(path=path, payload=payload)) + "\n"
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self.write_spill(line, path, payload)
+            return
+        # appended in order by one thread, the file is not touched on the event loop
+        if self.spill_writer is None:
+            self.spill_writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix='export-spill')
+        loop.run_in_executor(self.spill_writer, self.write_spill, line, path, payload)
+
+    def write_spill(self, line: str, path: str, payload: dict):
+        try:
+            with open(self.spill_path, "a") as spill_file:
+                spill_file.write(line)
+        except OSError as e:
+            log.log(40, "export spill failed: %s, lost %s: %s", e, path, payload)
+
+    async def flush(self):
+        while self.queue_depth or self.in_flight:
+            if self.worker is None or self.worker.done() or self.loop is not asyncio.get_running_loop():
+                self.start(asyncio.get_running_loop())
+            self.wakeup.set()
+            await asyncio.sleep(0.01)
+
+    async def close(self):
+        await self.flush()
+        if self.worker is not None:
+            self.worker.cancel()
+            self.worker = None
+        if self.client is not None:
+            await self.client.aclose()
+            self.client = None
+        if self.spill_writer is not None:
+            spill_writer, self.spill_writer = self.spill_writer, None
+            await asyncio.get_running_loop().run_in_executor(None, spill_writer.shutdown)
+
+    def collect_metrics(self) -> list:
+        return [
+            ('panstwa_export_queue_depth', 'gauge', 'Room statuses and scores waiting to be exported',
+             [({}, self.queue_depth)]),
+            ('panstwa_exports_total', 'counter', 'Export requests by outcome',
+             [({'outcome': 'sent'}, self.sent), ({'outcome': 'failed'}, self.failed),
+              ({'outcome': 'spilled'}, self.spilled)]),
+        ]
+
+    def get_stats(self) -> dict:
+        return {"queue_depth": self.queue_depth,
+                "in_flight": self.in_flight,
+                "sent": self.sent,
+                "failed": self.failed,
+                "retried": self.retried,
+                "coalesced": self.coalesced,
+                "spilled": self.spilled}
+
+
+exporter = Exporter()
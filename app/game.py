@@ -1,10 +1,18 @@
+import logging
+import os
 import random
 import string
-from collections import defaultdict
+from collections import Counter, defaultdict
 from dataclasses import dataclass
-from typing import List, Optional
+from typing import Dict, List, Optional
 
+from app.clustering import cluster_words
+from app.dictionary import AnswerValidator, validator as default_validator
 from app.game_state import GameState
+from app.logs import debug
+from app.normalization import normalize_answer, normalize_answers
+
+log = logging.getLogger(__name__)
 
 
 def count_overall_score(categories) -> int:
@@ -15,17 +23,41 @@ class Categories:
     def __init__(self):
         self.categories: List[Category] = []
 
+    @property
+    def categories(self) -> List['Category']:
+        return self._categories
+
+    @categories.setter
+    def categories(self, categories: List['Category']):
+        self._categories = categories
+        self.reindex()
+
+    def reindex(self):
+        self.by_name: Dict[str, List[Category]] = defaultdict(list)
+        self.by_player: Dict[Optional[str], List[Category]] = defaultdict(list)
+        self.by_name_and_word: Dict[str, Dict[str, List[Category]]] = defaultdict(dict)
+        for category in self._categories:
+            self.index(category)
+
+    def index(self, category: 'Category'):
+        self.by_name[category.category_name].append(category)
+        self.by_player[category.player_id].append(category)
+        self.by_name_and_word[category.category_name].setdefault(category.voting_word, []).append(category)
+
     def filter_by_category(self, name: str):
-        filtered = filter(lambda category: category.category_name == name, self.categories)
-        return list(filtered)
+        return list(self.by_name.get(name, ()))
 
     def filter_by_player(self, player_id: str):
-        filtered = filter(lambda category: category.player_id == player_id, self.categories)
-        return list(filtered)
+        return list(self.by_player.get(player_id, ()))
+
+    def filter_by_category_and_word(self, name: str, word: str):
+        words = self.by_name_and_word.get(name)
+        return words.get(word, ()) if words is not None else ()
 
     def append(self, category):
         if isinstance(category, Category):
-            self.categories.append(category)
+            self._categories.append(category)
+            self.index(category)
         else:
             raise TypeError
 
@@ -37,10 +69,17 @@ class Categories:
         groups = defaultdict(list)
 
         for category in self.categories:
-            groups[category.category_name].append(category.word) \
-                if category.word != '' and category.word not in groups[category.category_name] else ...
+            groups[category.category_name].append(category.voting_word) \
+                if category.word != '' and category.voting_word not in groups[category.category_name] else ...
         return dict(groups)
 
+    def fill_clusters(self, max_distance: int, min_length: int):
+        for name, same_name in self.by_name.items():
+            clusters = cluster_words([c.word for c in same_name], max_distance, min_length)
+            for category in same_name:
+                category.cluster = clusters.get(category.word)
+        self.reindex()
+
     def group_categories_by_name(self) -> dict:
         groups = defaultdict(list)
 
@@ -68,18 +107,30 @@ class Categories:
                 if first_letter != letter:
                     category.is_legit = False
 
-    def fill_is_unique(self):
+    def fill_dictionary_scores(self, validator: AnswerValidator, weight: int):
         for category in self.categories:
-            if category.word not in [c.word for c in self.categories if
-                                     c.category_name == category.category_name and c.player_id != category.player_id]:
-                category.is_unique = True
+            if category.word == '':
+                continue
+            verdict = validator.check(category.category_name, category.word)
+            if verdict is True:
+                category.legit_score += weight
+            elif verdict is False:
+                category.legit_score -= weight
+
+    def fill_is_unique(self):
+        for words in self.by_name_and_word.values():
+            for same_words in words.values():
+                if len({c.player_id for c in same_words}) == 1:
+                    for category in same_words:
+                        category.is_unique = True
 
     def fill_is_only_word_in_category(self):
-        for category in self.categories:
-            other_legit = [c.is_legit for c in self.categories if
-                           c.category_name == category.category_name and c.player_id != category.player_id]
-            if not any(other_legit):
-                category.is_only_word_in_category = True
+        for same_name in self.by_name.values():
+            legit_by_player = Counter(c.player_id for c in same_name if c.is_legit)
+            all_legit = sum(legit_by_player.values())
+            for category in same_name:
+                if all_legit == legit_by_player[category.player_id]:
+                    category.is_only_word_in_category = True
 
     def fill_scores(self):
         for category in self.categories:
@@ -95,14 +146,18 @@ class Categories:
                     category.score = 5
 
     def filter_empty(self):
-        self.categories = list(filter(lambda c: c.player_id, self.categories))
+        self.categories = list(filter(lambda c: c.player_id, self.categories))  # also rebuilds the indexes
 
 
 @dataclass
 class Category:
+    __slots__ = ('category_name', 'word', 'cluster', 'player_id', 'is_unique', 'legit_score', 'is_legit',
+                 'is_only_word_in_category', 'score')
+
     def __init__(self, category_name):
         self.category_name: str = category_name
         self.word: str = ''
+        self.cluster: Optional[str] = None
         self.player_id: Optional[str] = None
         self.is_unique: bool = False
         self.legit_score: int = 0
@@ -110,11 +165,22 @@ class Category:
         self.is_only_word_in_category: bool = False
         self.score: int = 0
 
+    @property
+    def voting_word(self) -> str:
+        return self.cluster if self.cluster is not None else self.word
+
 
 def count_overall_legit_score(categories) -> int:
     return sum([c.legit_score for c in categories])
 
 
+DEFAULT_CATEGORIES = ["Country", "City", "Item", "Animal", "Plant", "Name"]
+# 0 keeps answers apart unless spelled the same, deployments opt in to clustering
+MAX_EDIT_DISTANCE = int(os.getenv('ANSWER_MAX_EDIT_DISTANCE', 0))
+MIN_CLUSTERED_LENGTH = int(os.getenv('ANSWER_MIN_CLUSTERED_LENGTH', 5))
+DICTIONARY_WEIGHT = int(os.getenv('DICTIONARY_WEIGHT', 1))
+
+
 def setup_letters():
     letters = string.ascii_lowercase
     letters = letters.replace("v", "").replace("x", "").replace("q", "").replace("y", "")
@@ -122,7 +188,13 @@ def setup_letters():
 
 
 class Game:
-    def __init__(self, custom_categories=None):
+    def __init__(self, custom_categories=None, max_edit_distance: int = MAX_EDIT_DISTANCE,
+                 min_clustered_length: int = MIN_CLUSTERED_LENGTH, validator: AnswerValidator = default_validator,
+                 dictionary_weight: int = DICTIONARY_WEIGHT):
+        self.max_edit_distance = max_edit_distance
+        self.min_clustered_length = min_clustered_length
+        self.validator = validator
+        self.dictionary_weight = dictionary_weight
         self.letters = setup_letters()
         self.last_letter = None
         self.custom_categories = custom_categories
@@ -148,28 +220,29 @@ class Game:
 
     def summary_completing(self) -> dict:
         name_oriented_categories_words = {}
-        for category in self.setup_categories().categories:
-            name_oriented_categories_words[category.category_name] = \
-                list(filter(None, set(map(lambda c: c.word,
-                                          self.categories.filter_by_category(category.category_name)))))
+        for category_name in self.get_template_names():
+            name_oriented_categories_words[category_name] = \
+                list(filter(None, set(map(lambda c: c.word, self.categories.filter_by_category(category_name)))))
         return name_oriented_categories_words
 
     def summary_voting(self):
         self.categories.filter_empty()
-        print("summary voting", self.categories)
+        debug(log, "summary voting of %d answers", len(self.categories.categories))
         self.count_votes()
+        self.categories.fill_dictionary_scores(self.validator, self.dictionary_weight)
         self.categories.fill_is_unique()
         self.categories.fill_is_legit(self.letter)
         self.categories.fill_is_only_word_in_category()
         self.categories.fill_scores()
 
-    def setup_categories(self) -> Categories:
+    def get_template_names(self) -> List[str]:
         if self.custom_categories is None:
-            custom_categories = ["Country", "City", "Item", "Animal", "Plant", "Name"]
-        else:
-            custom_categories = self.custom_categories
+            return DEFAULT_CATEGORIES
+        return self.custom_categories
+
+    def setup_categories(self) -> Categories:
         categories = Categories()
-        for category in custom_categories:
+        for category in self.get_template_names():
             c = Category(category)
             categories.append(c)
         return categories
@@ -193,15 +266,28 @@ class Game:
                 pass
         return results
 
+    def submit_answers(self, player_id, answers: dict):
+        self.temporary_categories[player_id] = normalize_answers(answers)
+
+    def submit_answer_delta(self, player_id, delta: dict):
+        # only the changed fields are normalized, into a slot laid out by the round's categories
+        if not isinstance(delta, dict):
+            return
+        template_names = self.get_template_names()
+        slot = self.temporary_categories.get(player_id)
+        if slot is None:
+            slot = self.temporary_categories[player_id] = dict.fromkeys(template_names, '')
+        for category_name, answer in delta.items():
+            if category_name in template_names:
+                slot[category_name] = normalize_answer(answer)
+
     def handle_complete(self, player_id, player_move: dict):
-        for category in player_move:
-            new_category = Category(category)
-            players_word: str = player_move[category].strip(' ').strip('\u200b').strip(' ').lower()
-            try:
-                new_category.word = players_word if players_word[0] == self.letter else ""
-            except IndexError:
-                new_category.word = ""
-            new_category.word = players_word
+        self.add_answers(player_id, normalize_answers(player_move))
+
+    def add_answers(self, player_id, answers: dict):
+        for category_name, word in answers.items():
+            new_category = Category(category_name)
+            new_category.word = word
             new_category.player_id = player_id
             self.categories.append(new_category)
 
@@ -211,20 +297,21 @@ class Game:
                 for word in self.votes[player][p_category]:
                     try:
                         voting = self.votes[player][p_category][word]  # TypeError
-                        for category in self.categories.categories:
-                            if category.word == word and category.category_name == p_category:
-                                if voting is True:
-                                    category.legit_score += 1
-                                    print(word, "is legit")
-                                if voting is False:
-                                    category.legit_score -= 1
-                                    print(word, "is not legit")
+                        for category in self.categories.filter_by_category_and_word(p_category, word):
+                            if voting is True:
+                                category.legit_score += 1
+                                debug(log, "%s voted %s is legit", player, word)
+                            if voting is False:
+                                category.legit_score -= 1
+                                debug(log, "%s voted %s is not legit", player, word)
                     except (TypeError, KeyError):
                         pass
 
     def build_full_categories(self):
-        for client_id in self.temporary_categories:
-            self.handle_complete(client_id, self.temporary_categories[client_id])  # todo cut this line
+        # answers were normalized when they arrived, so this only turns them into categories
+        for client_id, answers in self.temporary_categories.items():
+            self.add_answers(client_id, answers)
+        self.categories.fill_clusters(self.max_edit_distance, self.min_clustered_length)
 
     def draw_letter(self) -> str:
         drawn_letter = random.choice(self.letters)
@@ -0,0 +1,121 @@
+import contextvars
+import json
+import logging
+import os
+import queue
+import sys
+import zlib
+from logging.handlers import QueueHandler, QueueListener
+from typing import Iterable, Optional
+
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO').upper()
+LOG_FORMAT = os.getenv('LOG_FORMAT', 'json')
+ROOM_FIELDS = ('room_id', 'game_id', 'phase')
+
+# the room being worked on by the current task, set by the room's entry points
+current_room = contextvars.ContextVar('current_room', default=None)
+
+
+class BoundRoom:
+    __slots__ = ('room', 'token')
+
+    def __init__(self, room):
+        self.room = room
+        self.token = None
+
+    def __enter__(self):
+        self.token = current_room.set(self.room)
+        return self.room
+
+    def __exit__(self, exc_type, exc, traceback):
+        current_room.reset(self.token)
+        return False
+
+
+def bind_room(room) -> BoundRoom:
+    # with bind_room(room): log records in the block carry the room, the previous one is back after it
+    return BoundRoom(room)
+
+
+class RoomTracing:
+    # rooms logged at debug level whatever LOG_LEVEL says: the listed ones and a stable sample of the others
+    def __init__(self, room_ids: Iterable[str] = (), sample_rate: float = 0.0):
+        self.room_ids = set(room_ids)
+        self.sample_rate = sample_rate
+
+    def is_traced(self, room_id: str) -> bool:
+        if room_id in self.room_ids:
+            return True
+        return self.sample_rate > 0 and zlib.crc32(room_id.encode()) % 10000 < self.sample_rate * 10000
+
+    def enable(self, room_id: str):
+        self.room_ids.add(room_id)
+
+    def disable(self, room_id: str):
+        self.room_ids.discard(room_id)
+
+
+tracing = RoomTracing([room_id for room_id in os.getenv('LOG_TRACE_ROOMS', '').split(',') if room_id],
+                      float(os.getenv('LOG_ROOM_SAMPLE_RATE', 0)))
+
+
+def debug(logger: logging.Logger, msg: str, *args):
+    # no record is created, let alone formatted, unless debug is on globally or for the current room
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug(msg, *args, stacklevel=2)
+        return
+    room = current_room.get()
+    if room is not None and tracing.is_traced(room.id):
+        # past the logger's level on purpose, so the record is made here and handed to the handlers
+        filename, lineno, function, _ = logger.findCaller(stacklevel=2)
+        logger.handle(logger.makeRecord(logger.name, logging.DEBUG, filename, lineno, msg, args, None, function))
+
+
+class RoomContextFilter(logging.Filter):
+    def filter(self, record: logging.LogRecord) -> bool:
+        room = current_room.get()
+        if room is not None and not hasattr(record, 'room_id'):
+            record.room_id = room.id
+            record.game_id = getattr(room, 'game_id', None)
+            record.phase = room.game.game_state.value
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        fields = {"time": self.formatTime(record), "level": record.levelname, "logger": record.name,
+                  "message": record.getMessage()}
+        for field in ROOM_FIELDS:
+            value = getattr(record, field, None)
+            if value is not None:
+                fields[field] = value
+        if record.exc_info:
+            fields["exc_info"] = self.formatException(record.exc_info)
+        return json.dumps(fields, default=str)
+
+
+def setup_logging(level: str = LOG_LEVEL, log_format: str = LOG_FORMAT, stream=None) -> QueueListener:
+    # records are put on a queue by the event loop and written to the stream by the listener's thread
+    handler = logging.StreamHandler(stream or sys.stderr)
+    if log_format == 'json':
+        handler.setFormatter(JsonFormatter())
+    else:
+        handler.setFormatter(logging.Formatter('%(asctime)s %(levelname)s %(name)s %(message)s'))
+    log_queue = queue.SimpleQueue()
+    queue_handler = QueueHandler(log_queue)
+    queue_handler.addFilter(RoomContextFilter())
+    root = logging.getLogger()
+    for old_handler in [h for h in root.handlers if isinstance(h, QueueHandler)]:
+        root.removeHandler(old_handler)
+    root.addHandler(queue_handler)
+    root.setLevel(level)
+    # httpx logs every request at INFO, one line per export
+    logging.getLogger('httpx').setLevel(logging.WARNING)
+    listener = QueueListener(log_queue, handler)
+    listener.start()
+    return listener
+
+
+def stop_logging(listener: Optional[QueueListener]):
+    if listener is not None:
+        listener.stop()
@@ -1,18 +1,62 @@
+import asyncio
+import hmac
 import logging
+import os
+import threading
 from datetime import datetime, timedelta
 from typing import Optional
 
 import uvicorn
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect
-from starlette.responses import JSONResponse
-
-from app.connection_manager import ConnectionManager
+from fastapi import Depends, FastAPI, HTTPException, Request, WebSocket, WebSocketDisconnect
+from starlette.responses import JSONResponse, PlainTextResponse
+
+from app.connection_manager import ConnectionManager, DRAIN_CLOSE_CODE
+from app.exporter import exporter
+from app import logs, protocol, sharding, spans, watchdog
+from app.metrics import collect_process, registry
+from app.phase_batch import phase_batcher
+from app.rate_limit import MAX_FRAME_SIZE
+from app.scheduler import scheduler
 from app.server_errors import NoRoomWithThisId, RoomIdAlreadyInUse, \
-    NoPlayerWithThisId, GameIsStarted, PlayerIdAlreadyInUse
+    NoPlayerWithThisId, GameIsStarted, PlayerIdAlreadyInUse, RoomLimitReached, ServerIsDraining, ProfilerIsBusy
 
 app = FastAPI()
+shard = sharding.setup_sharding(app)
 
 manager = ConnectionManager()
+registry.add_collector(manager.collect_metrics)
+registry.add_collector(exporter.collect_metrics)
+registry.add_collector(scheduler.collect_metrics)
+registry.add_collector(collect_process)
+# longest round (completing + voting) with some margin, keep terminationGracePeriodSeconds above it
+DRAIN_TIMEOUT = float(os.getenv('DRAIN_TIMEOUT', 110))
+# /admin/... is served to the pod itself (the preStop hook calls from 127.0.0.1) and to callers sending this token
+ADMIN_TOKEN = os.getenv('ADMIN_TOKEN', '')
+ADMIN_TOKEN_HEADER = 'x-admin-token'
+LOOPBACK_HOSTS = {'127.0.0.1', '::1'}
+
+log = logging.getLogger(__name__)
+
+
+log_listener = None
+
+
+@app.on_event("startup")
+async def startup():
+    global log_listener
+    log_listener = logs.setup_logging()
+    watchdog.watchdog.start(asyncio.get_running_loop())
+    spans.tracer.start()
+    await manager.evict_idle_rooms()
+
+
+@app.on_event("shutdown")
+async def shutdown():
+    await phase_batcher.close()
+    await exporter.close()
+    watchdog.watchdog.stop()
+    spans.tracer.stop()
+    logs.stop_logging(log_listener)
 
 
 @app.get("/")
@@ -30,7 +74,15 @@ async def get_stats(room_id: Optional[str] = None):
                 status_code=403,
                 content={"detail": f"No room with this id: {room_id}"}
             )
-    return manager.get_overall_stats()
+    stats = manager.get_overall_stats()
+    if shard is not None:
+        stats['shard'] = {**shard, **sharding.stats}
+    return stats
+
+
+@app.get("/metrics")
+async def get_metrics():
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
 
 
 @app.post("/room/new/{room_id}")
@@ -42,11 +94,23 @@ async def new_room(room_id: str):
             content={"detail": "success"}
         )
     except RoomIdAlreadyInUse:
-        logging.info(f"Theres already a room with this id: {room_id}")
+        log.log(20, "Theres already a room with this id: %s", room_id)
         return JSONResponse(
             status_code=403,
             content={"detail": "Theres already a room with this id: {room_id}"}
         )
+    except RoomLimitReached:
+        log.log(20, "Room limit reached, can not create room: %s", room_id)
+        return JSONResponse(
+            status_code=503,
+            content={"detail": "This server can not host more rooms"}
+        )
+    except ServerIsDraining:
+        log.log(20, "Server is draining, can not create room: %s", room_id)
+        return JSONResponse(
+            status_code=503,
+            content={"detail": "This server is shutting down"}
+        )
 
 
 @app.post("/room/new/{room_id}/{number_players}")
@@ -58,11 +122,73 @@ async def new_room(room_id: str, number_players: int):
             content={"detail": "success"}
         )
     except RoomIdAlreadyInUse:
-        logging.info(f"Theres already a room with this id: {room_id}")
+        log.log(20, "Theres already a room with this id: %s", room_id)
         return JSONResponse(
             status_code=403,
             content={"detail": "Theres already a room with this id: {room_id}"}
         )
+    except RoomLimitReached:
+        log.log(20, "Room limit reached, can not create room: %s", room_id)
+        return JSONResponse(
+            status_code=503,
+            content={"detail": "This server can not host more rooms"}
+        )
+    except ServerIsDraining:
+        log.log(20, "Server is draining, can not create room: %s", room_id)
+        return JSONResponse(
+            status_code=503,
+            content={"detail": "This server is shutting down"}
+        )
+
+
+def require_admin(request: Request):
+    token = request.headers.get(ADMIN_TOKEN_HEADER, '')
+    if ADMIN_TOKEN and hmac.compare_digest(token.encode(), ADMIN_TOKEN.encode()):
+        return
+    if request.client is not None and request.client.host in LOOPBACK_HOSTS:
+        return
+    raise HTTPException(status_code=403, detail="Admin calls are only taken from localhost or with the admin token")
+
+
+@app.post("/admin/drain", dependencies=[Depends(require_admin)])
+async def drain():
+    return await manager.drain(DRAIN_TIMEOUT)
+
+
+@app.post("/admin/trace/{room_id}", dependencies=[Depends(require_admin)])
+async def trace_room(room_id: str):
+    logs.tracing.enable(room_id)
+    return {"traced_rooms": sorted(logs.tracing.room_ids)}
+
+
+@app.delete("/admin/trace/{room_id}", dependencies=[Depends(require_admin)])
+async def untrace_room(room_id: str):
+    logs.tracing.disable(room_id)
+    return {"traced_rooms": sorted(logs.tracing.room_ids)}
+
+
+@app.get("/admin/watchdog", dependencies=[Depends(require_admin)])
+async def get_watchdog():
+    return watchdog.watchdog.get_stats()
+
+
+@app.post("/admin/profile", dependencies=[Depends(require_admin)])
+async def profile(seconds: float = 10):
+    # samples this worker's event loop, the result is in the collapsed format of flamegraph.pl and speedscope
+    if not watchdog.PROFILER_ENABLED:
+        return JSONResponse(
+            status_code=403,
+            content={"detail": "The profiler is disabled, start the server with PROFILER_ENABLED=1"}
+        )
+    try:
+        stacks = await asyncio.get_running_loop().run_in_executor(
+            None, watchdog.profiler.profile, threading.get_ident(), seconds)
+    except ProfilerIsBusy:
+        return JSONResponse(
+            status_code=409,
+            content={"detail": "A profile is already being recorded"}
+        )
+    return PlainTextResponse(watchdog.render_collapsed(stacks))
 
 
 @app.delete("/room/{room_id}")
@@ -74,7 +200,7 @@ async def end_game(room_id: str):
             content={"detail": "success"}
         )
     except NoRoomWithThisId:
-        logging.info(f"Theres no room with this id: {room_id}")
+        log.log(20, "Theres no room with this id: %s", room_id)
         return JSONResponse(
             status_code=403,
             content={"detail": f"Theres no room with this id: {room_id}"}
@@ -90,7 +216,7 @@ async def end_game(room_id: str):
             content={"detail": "success"}
         )
     except NoRoomWithThisId:
-        logging.info(f"Theres no room with this id: {room_id}")
+        log.log(20, "Theres no room with this id: %s", room_id)
         return JSONResponse(
             status_code=403,
             content={"detail": f"Theres no room with this id: {room_id}"}
@@ -115,7 +241,7 @@ async def start_game(room_id: str):
             content={"detail": "success"}
         )
     except NoRoomWithThisId:
-        logging.info(f"Theres no room with this id: {room_id}")
+        log.log(20, "Theres no room with this id: %s", room_id)
         return JSONResponse(
             status_code=403,
             content={"detail": f"Theres no room with this id: {room_id}"}
@@ -131,7 +257,7 @@ async def restart_game(room_id: str):
             content={"detail": "success"}
         )
     except NoRoomWithThisId:
-        logging.info(f"Theres no room with this id: {room_id}")
+        log.log(20, "Theres no room with this id: %s", room_id)
         return JSONResponse(
             status_code=403,
             content={"detail": f"Theres no room with this id: {room_id}"}
@@ -148,7 +274,7 @@ async def kick_player(room_id: str, player_id: str):
             content={"detail": f"No Player With This Id: {player_id}'"}
         )
     except NoRoomWithThisId:
-        logging.info(f"Theres no room with this id: {room_id}")
+        log.log(20, "Theres no room with this id: %s", room_id)
         return JSONResponse(
             status_code=403,
             content={"detail": f"Theres no room with this id: {room_id}"}
@@ -159,41 +285,53 @@ async def kick_player(room_id: str, player_id: str):
     )
 
 
+async def receive_frame(websocket: WebSocket) -> protocol.Frame:
+    message = await websocket.receive()
+    if message['type'] == 'websocket.disconnect':
+        raise WebSocketDisconnect(message.get('code', 1000))
+    return message['text'] if message.get('text') is not None else message['bytes']
+
+
 @app.websocket("/ws/{room_id}/{client_id}/{nick}")
 async def websocket_endpoint(websocket: WebSocket, room_id: str, client_id: str, nick: str):
     try:
-        await manager.connect(websocket, room_id, client_id, nick=nick)
-        logging.info(f"new client connected with id: {client_id}")
+        codec = protocol.negotiate(websocket.scope.get('subprotocols', []))
+        await manager.connect(websocket, room_id, client_id, nick=nick, codec=codec)
+        log.log(20, "new client connected with id: %s using %s", client_id, codec.name)
 
         try:
             while True:
-                text_message = await websocket.receive_text()
-                await manager.handle_ws_message(text_message, room_id, client_id)
+                message = await receive_frame(websocket)
+                await manager.handle_ws_message(message, room_id, client_id)
         except WebSocketDisconnect:
-            await manager.kick_player(room_id, client_id)
-            logging.info(f"ConnectionClosedOK {client_id}")
+            # the player keeps their seat for RECONNECT_GRACE seconds and resumes with the same client id
+            await manager.disconnect(websocket)
+            log.log(20, "ConnectionClosedOK %s", client_id)
 
         except Exception as e:
-            logging.log(40, e)
-            logging.log(40, e.__class__.__name__)
-            logging.log(40, "disconnected")
+            log.log(40, "connection of %s in room %s failed, disconnecting: %s %s", client_id, room_id,
+                    e.__class__.__name__, e, exc_info=True)
             await manager.disconnect(websocket)
 
     except GameIsStarted:
-        logging.info(f"Theres already game started")
+        log.log(20, "Theres already game started")
         await websocket.close()
 
     except PlayerIdAlreadyInUse:
-        logging.info(f"Theres already connection with this client id {client_id}")
+        log.log(20, "Theres already connection with this client id %s", client_id)
         await websocket.close()
 
     except NoRoomWithThisId:
-        logging.info(f"Theres no room with this id: {room_id}")
+        log.log(20, "Theres no room with this id: %s", room_id)
         await websocket.close()
 
+    except ServerIsDraining:
+        log.log(20, "Server is draining, rejected client %s", client_id)
+        await websocket.close(code=DRAIN_CLOSE_CODE)
+
     except Exception as e:
-        logging.log(40, e)
-        logging.log(40, "disconnected!")
+        log.log(40, "connecting %s to room %s failed: %s %s", client_id, room_id, e.__class__.__name__, e,
+                exc_info=True)
 
 
 @app.websocket("/test/{room_id}/{client_id}/{nick}")
@@ -296,11 +434,11 @@ async def websocket_endpoint(websocket: WebSocket):
 
             await websocket.send_json(json_to_send)
             message = await websocket.receive()
-            print(message)
+            log.log(20, "test client sent %s", message)
 
     except WebSocketDisconnect:
-        logging.info("disconnected")
+        log.log(20, "test client disconnected")
 
 
 if __name__ == "__main__":
-    uvicorn.run(app, host="0.0.0.0", port=5000, workers=1)
+    uvicorn.run(app, host="0.0.0.0", port=5000, workers=1, ws_max_size=MAX_FRAME_SIZE)
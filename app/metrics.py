@@ -0,0 +1,119 @@
+import bisect
+import resource
+from typing import Callable, Dict, Iterable, List, Tuple
+
+# samples of a collector: (metric name, type, help, [(labels, value)])
+Sample = Tuple[str, str, str, List[Tuple[Dict[str, str], float]]]
+
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256, 512)
+
+
+def format_labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ''
+    escaped = (value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for value in labels.values())
+    return '{' + ','.join(f'{name}="{value}"' for name, value in zip(labels, escaped)) + '}'
+
+
+def format_value(value: float) -> str:
+    return repr(float(value)) if value != float('inf') else '+Inf'
+
+
+class Counter:
+    # instruments are only touched from the event loop, so there is no locking
+    __slots__ = ('name', 'help', 'value')
+
+    def __init__(self, name: str, help: str):
+        self.name = name
+        self.help = help
+        self.value = 0.0
+
+    def inc(self, amount: float = 1.0):
+        self.value += amount
+
+    def render(self) -> List[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter",
+                f"{self.name} {format_value(self.value)}"]
+
+
+class Histogram:
+    __slots__ = ('name', 'help', 'buckets', 'counts', 'sum', 'count')
+
+    def __init__(self, name: str, help: str, buckets: Iterable[float] = LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float('inf'),), self.counts):
+            cumulative += count
+            lines.append(f'{self.name}_bucket{{le="{format_value(bound)}"}} {cumulative}')
+        lines.append(f"{self.name}_sum {format_value(self.sum)}")
+        lines.append(f"{self.name}_count {self.count}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self.instruments = []
+        self.collectors: List[Callable[[], Iterable[Sample]]] = []
+
+    def counter(self, name: str, help: str) -> Counter:
+        counter = Counter(name, help)
+        self.instruments.append(counter)
+        return counter
+
+    def histogram(self, name: str, help: str, buckets: Iterable[float] = LATENCY_BUCKETS) -> Histogram:
+        histogram = Histogram(name, help, buckets)
+        self.instruments.append(histogram)
+        return histogram
+
+    def add_collector(self, collector: Callable[[], Iterable[Sample]]):
+        # called on every scrape, for values that are cheaper to read than to keep up to date
+        self.collectors.append(collector)
+
+    def render(self) -> str:
+        lines = []
+        for instrument in self.instruments:
+            lines.extend(instrument.render())
+        for collector in self.collectors:
+            for name, metric_type, help, samples in collector():
+                lines.append(f"# HELP {name} {help}")
+                lines.append(f"# TYPE {name} {metric_type}")
+                lines.extend(f"{name}{format_labels(labels)} {format_value(value)}" for labels, value in samples)
+        return '\n'.join(lines) + '\n'
+
+
+def collect_process() -> List[Sample]:
+    try:
+        with open('/proc/self/statm') as statm:
+            rss = int(statm.read().split()[1]) * resource.getpagesize()
+    except OSError:
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024  # the peak where /proc is missing
+    return [('process_resident_memory_bytes', 'gauge', 'Resident memory size in bytes', [({}, rss)])]
+
+
+registry = Registry()
+
+ws_messages = registry.counter('panstwa_ws_messages_total', 'Websocket messages received from players')
+ws_message_seconds = registry.histogram('panstwa_ws_message_seconds', 'Time to check and apply one player message')
+broadcast_seconds = registry.histogram('panstwa_broadcast_seconds', 'Time to encode and queue a room broadcast')
+broadcast_recipients = registry.counter('panstwa_broadcast_recipients_total', 'Messages queued by broadcasts')
+summary_voting_seconds = registry.histogram('panstwa_summary_voting_seconds', 'Time to score a voting phase')
+timer_lag_seconds = registry.histogram('panstwa_timer_lag_seconds', 'Delay of phase timers past their deadline')
+event_loop_lag_seconds = registry.histogram('panstwa_event_loop_lag_seconds', 'Delay of the watchdog tick')
+event_loop_stalls = registry.counter('panstwa_event_loop_stalls_total', 'Event loop stalls sampled by the watchdog')
+phase_batch_rooms = registry.histogram('panstwa_phase_batch_rooms', 'Rooms due in one phase batch', SIZE_BUCKETS)
+phase_batch_pooled = registry.counter('panstwa_phase_batch_pooled_total', 'Voting phases scored in the process pool')
+phase_batch_yields = registry.counter('panstwa_phase_batch_yields_total', 'Times a batch gave the loop back')
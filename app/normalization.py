@@ -0,0 +1,47 @@
+import os
+import unicodedata
+from functools import lru_cache
+
+FOLD_DIACRITICS = os.getenv('ANSWER_FOLD_DIACRITICS', '0') == '1'
+
+ZERO_WIDTH_CHARACTERS = '\u00ad\u180e\u200b\u200c\u200d\u200e\u200f\u2060\u2061\u2062\u2063\u2064\ufeff'
+ZERO_WIDTH_TABLE = str.maketrans('', '', ZERO_WIDTH_CHARACTERS)
+
+# letters that have no canonical decomposition, so NFKD alone would keep them
+SPECIAL_DIACRITICS = {'ł': 'l', 'Ł': 'L', 'đ': 'd', 'Đ': 'D', 'ø': 'o', 'Ø': 'O', 'ħ': 'h', 'Ħ': 'H',
+                      'ß': 'ss', 'æ': 'ae', 'Æ': 'AE', 'œ': 'oe', 'Œ': 'OE', 'ı': 'i'}
+
+
+def build_diacritics_table() -> dict:
+    table = {}
+    for code_point in range(0x00c0, 0x0250):
+        character = chr(code_point)
+        base = ''.join(c for c in unicodedata.normalize('NFKD', character) if not unicodedata.combining(c))
+        if base != character and base.isascii():
+            table[code_point] = base
+    for character, base in SPECIAL_DIACRITICS.items():
+        table[ord(character)] = base
+    return table
+
+
+DIACRITICS_TABLE = build_diacritics_table()
+
+
+def normalize_answer(answer, fold_diacritics: bool = FOLD_DIACRITICS) -> str:
+    if not isinstance(answer, str):
+        return ''
+    return normalize_text(answer, fold_diacritics)
+
+
+@lru_cache(maxsize=65536)
+def normalize_text(text: str, fold_diacritics: bool) -> str:
+    text = unicodedata.normalize('NFKC', text).translate(ZERO_WIDTH_TABLE)
+    if fold_diacritics:
+        text = text.translate(DIACRITICS_TABLE)
+    return ' '.join(text.split()).lower()
+
+
+def normalize_answers(answers, fold_diacritics: bool = FOLD_DIACRITICS) -> dict:
+    if not isinstance(answers, dict):
+        return {}
+    return {category: normalize_answer(answer, fold_diacritics) for category, answer in answers.items()}
@@ -0,0 +1,200 @@
+import asyncio
+import contextvars
+import logging
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import List, Optional, Tuple
+
+from app.dictionary import validator as default_validator
+from app.game import Game
+from app.game_state import GameState
+from app.logs import bind_room
+from app.metrics import phase_batch_pooled, phase_batch_rooms, phase_batch_yields, summary_voting_seconds
+from app.spans import tracer
+
+BATCH_WINDOW = float(os.getenv('PHASE_BATCH_WINDOW', 0.02))
+BATCH_BUDGET = float(os.getenv('PHASE_BATCH_BUDGET', 0.02))
+POOL_WORKERS = int(os.getenv('PHASE_POOL_WORKERS', 0))
+POOL_MIN_BATCH = int(os.getenv('PHASE_POOL_MIN_BATCH', 32))
+
+log = logging.getLogger(__name__)
+
+
+def score_categories(categories: list, votes: dict, letter: str, dictionary_weight: int):
+    # runs in a pool worker on copies of a room's answers and votes, the worker checks its own dictionary
+    started = time.perf_counter()
+    game = Game()
+    game.categories.categories = categories
+    game.votes = votes
+    game.letter = letter
+    game.dictionary_weight = dictionary_weight
+    game.summary_voting()
+    return game.categories.categories, time.perf_counter() - started
+
+
+def is_due(room, game: Game, phase: GameState) -> bool:
+    # the room was not restarted, ended or given a new timer since its timer fired
+    return room.game is game and game.game_state is phase and room.scheduler.deadline(room.id) is None
+
+
+def same_votes(snapshot: dict, votes: dict) -> bool:
+    # a player's votes are replaced as a whole, so comparing identities is enough
+    return len(snapshot) == len(votes) and all(votes.get(player) is value for player, value in snapshot.items())
+
+
+class PhaseBatcher:
+    # rooms whose timers fire within window of each other end their phase together: the scoring of all of them
+    # first, then the broadcasts, giving the loop back whenever a slice of the batch has used up the budget
+    def __init__(self, window: float = BATCH_WINDOW, budget: float = BATCH_BUDGET, pool_workers: int = POOL_WORKERS,
+                 pool_min_batch: int = POOL_MIN_BATCH):
+        self.window = window
+        self.budget = budget
+        self.pool_workers = pool_workers
+        self.pool_min_batch = pool_min_batch
+        self.pool: Optional[ProcessPoolExecutor] = None
+        self.pending: List[Tuple] = []
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.handle: Optional[asyncio.TimerHandle] = None
+        self.tasks = set()
+        self.batches = 0
+        self.rooms = 0
+        self.pooled = 0
+        self.yields = 0
+        self.max_slice = 0.0
+
+    def submit(self, room):
+        loop = asyncio.get_running_loop()
+        if self.loop is not loop:
+            self.reset(loop)
+        self.pending.append((room, room.game, room.game.game_state))
+        if self.handle is None:
+            self.handle = loop.call_later(self.window, self.flush, context=contextvars.Context())
+
+    def reset(self, loop: asyncio.AbstractEventLoop):
+        # like the scheduler's deadlines, rooms due on a closed loop are dropped
+        if self.handle is not None:
+            self.handle.cancel()
+        self.handle = None
+        self.pending = []
+        self.tasks = set()
+        self.loop = loop
+
+    def flush(self):
+        self.handle = None
+        due, self.pending = self.pending, []
+        task = self.loop.create_task(self.run_batch(due))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    async def run_batch(self, due: List[Tuple]):
+        self.batches += 1
+        self.rooms += len(due)
+        phase_batch_rooms.observe(len(due))
+        with tracer.span("phase_batch", parent=None, rooms=len(due)):
+            scored = {}
+            voting = [(room, game, phase) for room, game, phase in due
+                      if phase is GameState.voting and game.validator is default_validator]
+            if self.pool_workers > 0 and len(voting) >= self.pool_min_batch:
+                scored = await self.score_in_pool(voting)
+            started = time.perf_counter()
+            finishing = []
+            for room, game, phase in due:
+                if not is_due(room, game, phase):
+                    continue
+                votes, categories = scored.get(id(room), (None, None))
+                if votes is not None and not same_votes(votes, game.votes):
+                    categories = None  # a vote came in while the pool was scoring
+                try:
+                    with bind_room(room), room.span("score_stage", phase=phase.value):
+                        room.score_stage(categories)
+                except Exception as e:
+                    log.log(40, "ending phase %s of room %s failed: %s %s", phase.value, room.id,
+                            e.__class__.__name__, e, exc_info=True)
+                    continue
+                finishing.append((room, phase))
+                started = await self.pace(started)
+            for room, phase in finishing:
+                try:
+                    with bind_room(room), room.span("finish_stage", phase=phase.value):
+                        await room.finish_stage(phase)
+                except Exception as e:
+                    log.log(40, "ending phase %s of room %s failed: %s %s", phase.value, room.id,
+                            e.__class__.__name__, e, exc_info=True)
+                started = await self.pace(started)
+
+    async def pace(self, started: float) -> float:
+        # gives the loop back once the running slice has used up the budget, returns when the next slice started
+        elapsed = time.perf_counter() - started
+        if elapsed < self.budget:
+            return started
+        self.max_slice = max(self.max_slice, elapsed)
+        self.yields += 1
+        phase_batch_yields.inc()
+        await asyncio.sleep(0)
+        return time.perf_counter()
+
+    async def score_in_pool(self, voting: List[Tuple]) -> dict:
+        loop = asyncio.get_running_loop()
+        if self.pool is None:
+            self.pool = ProcessPoolExecutor(self.pool_workers, mp_context=multiprocessing.get_context('spawn'))
+        jobs = []
+        with tracer.span("score_in_pool", rooms=len(voting)):
+            try:
+                for room, game, _ in voting:
+                    votes = dict(game.votes)
+                    jobs.append((room, votes, loop.run_in_executor(
+                        self.pool, score_categories, game.categories.categories, votes, game.letter,
+                        game.dictionary_weight)))
+            except (BrokenProcessPool, OSError) as e:
+                log.log(40, "phase pool can not take work, scoring on the loop: %s", e)
+                self.drop_pool()
+            results = await asyncio.gather(*(job for _, _, job in jobs), return_exceptions=True)
+        scored = {}
+        for (room, votes, _), result in zip(jobs, results):
+            if isinstance(result, BaseException):
+                log.log(30, "scoring room %s in the pool failed, scoring on the loop: %s %s", room.id,
+                        result.__class__.__name__, result)
+                if isinstance(result, BrokenProcessPool):
+                    self.drop_pool()
+                continue
+            categories, seconds = result
+            summary_voting_seconds.observe(seconds)
+            scored[id(room)] = (votes, categories)
+        self.pooled += len(scored)
+        phase_batch_pooled.inc(len(scored))
+        return scored
+
+    def drop_pool(self):
+        # a broken pool is left to exit on its own, the next large batch starts a new one
+        pool, self.pool = self.pool, None
+        if pool is not None:
+            pool.shutdown(wait=False)
+
+    async def close(self):
+        # the rooms already due end their phase and the running batches finish before the pool is shut down
+        loop = asyncio.get_running_loop()
+        if self.loop is not loop:
+            self.reset(loop)
+        while self.handle is not None or self.tasks:
+            if self.handle is not None:
+                self.handle.cancel()
+                self.flush()
+            await asyncio.gather(*self.tasks, return_exceptions=True)
+        pool, self.pool = self.pool, None
+        if pool is not None:
+            # no work is left to cancel, waiting lets the spawned workers exit
+            await loop.run_in_executor(None, pool.shutdown)
+
+    def get_stats(self) -> dict:
+        return {"batches": self.batches,
+                "rooms": self.rooms,
+                "pooled": self.pooled,
+                "yields": self.yields,
+                "max_slice": self.max_slice,
+                "running_batches": len(self.tasks)}
+
+
+phase_batcher = PhaseBatcher()
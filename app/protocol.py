@@ -0,0 +1,196 @@
+import json
+import os
+import re
+from abc import ABC, abstractmethod
+from typing import Any, Dict, List, Optional, Tuple, Union
+
+from app.server_errors import InvalidMove
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+try:
+    import msgspec
+except ImportError:
+    msgspec = None
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+MSGPACK_SUBPROTOCOL = 'msgpack'
+MOVE_STATES = ('LOBBY', 'COMPLETING', 'VOTING', 'SCORE_DISPLAY')
+JSON_OBJECT_START = re.compile(r'\s*\{')
+MSGPACK_MAP_START = frozenset(range(0x80, 0x90)) | {0xde, 0xdf}
+
+Frame = Union[str, bytes]
+
+
+class Codec(ABC):
+    name = ''
+    subprotocol: Optional[str] = None
+
+    @abstractmethod
+    def dumps(self, obj) -> Frame:
+        pass
+
+    @abstractmethod
+    def loads(self, data: Frame) -> Any:
+        pass
+
+    @abstractmethod
+    def looks_like_object(self, data: Frame) -> bool:
+        # checked before decoding, a move is always an object
+        pass
+
+    @abstractmethod
+    def message_parts(self, head: dict, tail: dict) -> Tuple[Frame, Frame]:
+        # encodes {**head, "nicks": ..., **tail} around the per-player nicks
+        pass
+
+    @abstractmethod
+    def array(self, encoded_items: List[Frame]) -> Frame:
+        pass
+
+
+class JsonCodec(Codec):
+    name = 'json'
+
+    def dumps(self, obj) -> str:
+        return json.dumps(obj)
+
+    def loads(self, data: Frame) -> Any:
+        return json.loads(data)
+
+    def looks_like_object(self, data: Frame) -> bool:
+        return isinstance(data, str) and JSON_OBJECT_START.match(data) is not None
+
+    def message_parts(self, head: dict, tail: dict) -> Tuple[str, str]:
+        prefix = '{' + ''.join(self.dumps(key) + ': ' + self.dumps(value) + ', ' for key, value in head.items())
+        suffix = ''.join(', ' + self.dumps(key) + ': ' + self.dumps(value) for key, value in tail.items())
+        return prefix + '"nicks": ', suffix + '}'
+
+    def array(self, encoded_items: List[str]) -> str:
+        return '[' + ', '.join(encoded_items) + ']'
+
+
+class OrjsonCodec(JsonCodec):
+    name = 'orjson'
+
+    def dumps(self, obj) -> str:
+        return orjson.dumps(obj).decode()
+
+    def loads(self, data: Frame) -> Any:
+        return orjson.loads(data)
+
+
+class MsgspecCodec(JsonCodec):
+    name = 'msgspec'
+
+    def __init__(self):
+        self.encoder = msgspec.json.Encoder()
+        self.decoder = msgspec.json.Decoder()
+
+    def dumps(self, obj) -> str:
+        return self.encoder.encode(obj).decode()
+
+    def loads(self, data: Frame) -> Any:
+        return self.decoder.decode(data)
+
+
+class MsgpackCodec(Codec):
+    name = 'msgpack'
+    subprotocol = MSGPACK_SUBPROTOCOL
+
+    def __init__(self):
+        self.packer = msgpack.Packer()
+
+    def dumps(self, obj) -> bytes:
+        return self.packer.pack(obj)
+
+    def loads(self, data: Frame) -> Any:
+        return msgpack.unpackb(data)
+
+    def looks_like_object(self, data: Frame) -> bool:
+        return isinstance(data, bytes) and len(data) > 0 and data[0] in MSGPACK_MAP_START
+
+    def message_parts(self, head: dict, tail: dict) -> Tuple[bytes, bytes]:
+        prefix = self.packer.pack_map_header(len(head) + 1 + len(tail))
+        prefix += b''.join(self.dumps(key) + self.dumps(value) for key, value in head.items())
+        suffix = b''.join(self.dumps(key) + self.dumps(value) for key, value in tail.items())
+        return prefix + self.dumps('nicks'), suffix
+
+    def array(self, encoded_items: List[bytes]) -> bytes:
+        return self.packer.pack_array_header(len(encoded_items)) + b''.join(encoded_items)
+
+
+def create_json_codec(name: Optional[str] = None) -> Codec:
+    # WS_JSON_CODEC=json|orjson|msgspec, by default the fastest one installed
+    available = {'orjson': orjson and OrjsonCodec, 'msgspec': msgspec and MsgspecCodec, 'json': JsonCodec}
+    if name:
+        if not available.get(name):
+            raise ValueError(f"JSON codec {name} is not available")
+        return available[name]()
+    return next(codec for codec in available.values() if codec)()
+
+
+json_codec = create_json_codec(os.getenv('WS_JSON_CODEC'))
+msgpack_codec = MsgpackCodec() if msgpack is not None else None
+
+
+def negotiate(subprotocols: List[str]) -> Codec:
+    if msgpack_codec is not None and MSGPACK_SUBPROTOCOL in subprotocols:
+        return msgpack_codec
+    return json_codec
+
+
+class PlayerMove:
+    __slots__ = ('game_state', 'results', 'delta')
+
+    def __init__(self, game_state: str, results: Optional[dict] = None, delta: Optional[Dict[str, str]] = None):
+        self.game_state = game_state
+        self.results = results
+        self.delta = delta
+
+
+def is_answers(answers) -> bool:
+    return isinstance(answers, dict) and \
+        all(isinstance(name, str) and (answer is None or isinstance(answer, str)) for name, answer in answers.items())
+
+
+def is_votes(votes) -> bool:
+    return isinstance(votes, dict) and all(
+        isinstance(name, str) and isinstance(words, dict) and
+        all(isinstance(word, str) and (vote is None or isinstance(vote, bool)) for word, vote in words.items())
+        for name, words in votes.items())
+
+
+def parse_move(message) -> PlayerMove:
+    if not isinstance(message, dict):
+        raise InvalidMove("not an object")
+    game_state = message.get('gameState')
+    if game_state not in MOVE_STATES:
+        raise InvalidMove(f"unknown gameState {game_state!r}")
+    results, delta = message.get('results'), message.get('delta')
+    if (results is None) == (delta is None):
+        raise InvalidMove("expected either results or delta")
+    if game_state == 'COMPLETING':
+        if not is_answers(results if delta is None else delta):
+            raise InvalidMove("answers must map category names to strings")
+    elif delta is not None:
+        raise InvalidMove(f"delta is not accepted in {game_state}")
+    elif game_state == 'VOTING':
+        if not is_votes(results):
+            raise InvalidMove("votes must map category names to {word: bool or null}")
+    elif not isinstance(results, dict):
+        raise InvalidMove("results must be an object")
+    return PlayerMove(game_state, results, delta)
+
+
+def decode_move(codec: Codec, data: Frame) -> PlayerMove:
+    try:
+        message = codec.loads(data)
+    except (ValueError, TypeError) as e:
+        raise InvalidMove(f"can not decode {codec.name}: {e.__class__.__name__} {e}")
+    return parse_move(message)
@@ -0,0 +1,30 @@
+import os
+import time
+from typing import Optional
+
+MESSAGE_RATE = float(os.getenv('WS_MESSAGE_RATE', 20))
+MESSAGE_BURST = float(os.getenv('WS_MESSAGE_BURST', 40))
+ROOM_MESSAGE_RATE = float(os.getenv('WS_ROOM_MESSAGE_RATE', 100))
+ROOM_MESSAGE_BURST = float(os.getenv('WS_ROOM_MESSAGE_BURST', 200))
+MAX_FRAME_SIZE = int(os.getenv('WS_MAX_FRAME_SIZE', 16384))
+# rejected messages after which a connection is kicked, an oversized frame kicks at once
+MAX_VIOLATIONS = int(os.getenv('WS_MAX_VIOLATIONS', 50))
+
+
+class TokenBucket:
+    __slots__ = ('rate', 'burst', 'tokens', 'updated')
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def allow(self, now: Optional[float] = None) -> bool:
+        now = time.monotonic() if now is None else now
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
@@ -1,42 +1,67 @@
-import asyncio
-import json
 import logging
 import os
 import random
-import threading
+import time
 import uuid
 from datetime import datetime, timedelta
-from typing import List
-from urllib.parse import urljoin
+from functools import partial
+from typing import Callable, List, Optional
 
-import requests
-
-from .connection import Connection
+from .connection import Connection, POLICY_VIOLATION_CLOSE_CODE
+from .exporter import Exporter, exporter as default_exporter
 from .game import Game, count_overall_score
 from .game_state import GameState
+from .logs import bind_room, debug
+from .metrics import broadcast_recipients, broadcast_seconds, summary_voting_seconds
+from .phase_batch import PhaseBatcher, phase_batcher as default_phase_batcher
+from .protocol import Codec, Frame, PlayerMove, json_codec
+from .rate_limit import ROOM_MESSAGE_BURST, ROOM_MESSAGE_RATE, TokenBucket
+from .scheduler import PhaseScheduler, scheduler as default_scheduler
 from .server_errors import NoPlayerWithThisId
+from .spans import tracer
+
+log = logging.getLogger(__name__)
+
+ROUND_TIMEOUT = float(os.getenv('ROUND_TIMEOUT', 69))
+RECONNECT_GRACE = float(os.getenv('RECONNECT_GRACE', 20))
 
 
 class Room:
-    def __init__(self, room_id: str, max_players: int = 8):
+    def __init__(self, room_id: str, max_players: int = 8, scheduler: PhaseScheduler = default_scheduler,
+                 exporter: Exporter = default_exporter, phase_batcher: Optional[PhaseBatcher] = default_phase_batcher):
         self.full_results = []
         self.id = room_id
         self.active_connections: List[Connection] = []
         self.game: Game = Game()
         self.number_of_players = max_players
         self.game_id: str
-        self.timeout = 69
-        self.timer = threading.Timer(self.timeout, self.handle_timeout)
-
-    def handle_timeout(self):
-        asyncio.run(self.next_stage())
+        self.timeout = ROUND_TIMEOUT
+        self.scheduler = scheduler
+        self.exporter = exporter
+        self.phase_batcher = phase_batcher
+        self.last_activity = time.monotonic()
+        self.on_connection_added: List[Callable[['Room', Connection], None]] = []
+        self.on_connection_removed: List[Callable[['Room', Connection], None]] = []
+        self.on_connection_suspended: List[Callable[['Room', Connection], None]] = []
+        self.on_connection_resumed: List[Callable[['Room', Connection], None]] = []
+        self.on_phase_change: List[Callable[['Room'], None]] = []
+        self.reconnect_grace = RECONNECT_GRACE
+        self.shared_game_state = None
+        self.draining = False
+        self.message_bucket = TokenBucket(ROOM_MESSAGE_RATE, ROOM_MESSAGE_BURST)
 
     async def append_connection(self, connection):
+        self.last_activity = time.monotonic()
         self.active_connections.append(connection)
+        self.invalidate_game_state()
+        for hook in self.on_connection_added:
+            hook(self, connection)
         self.export_room_status()
         if len(self.active_connections) >= 2 and self.game.game_state is GameState.lobby:
             await self.start_game()
-        await connection.ws.send_text(self.get_game_state(connection.player.id))
+        connection.on_send_failure = self.suspend_connection
+        if not connection.enqueue(self.get_game_state(connection.player.id, connection.codec)):
+            await self.drop_connection(connection)
 
     def get_taken_ids(self):
         taken_ids = [connection.player.id for connection in self.active_connections]
@@ -52,75 +77,181 @@ class Room:
         return taken_ids
 
     async def remove_connection(self, connection_with_given_ws):
-        self.active_connections.remove(connection_with_given_ws)
-        self.export_room_status()
-        if len(self.get_players_in_game_ids()) <= 1:
-            await self.end_game()
-            await self.broadcast_json()
+        with bind_room(self):
+            self.last_activity = time.monotonic()
+            self.active_connections.remove(connection_with_given_ws)
+            self.scheduler.cancel(self.reconnect_key(connection_with_given_ws.player.id))
+            connection_with_given_ws.close()
+            self.invalidate_game_state()
+            for hook in self.on_connection_removed:
+                hook(self, connection_with_given_ws)
+            self.export_room_status()
+            if len(self.get_players_in_game_ids()) <= 1 and not self.draining:
+                await self.end_game()
+                await self.broadcast_json()
+
+    def reconnect_key(self, player_id: str):
+        return "reconnect", self.id, player_id
+
+    async def suspend_connection(self, connection):
+        # the player and their answers stay in the room until the grace runs out, only the socket is gone
+        if connection not in self.active_connections or connection.suspended:
+            return
+        for hook in self.on_connection_suspended:
+            hook(self, connection)
+        connection.suspend()
+        self.expect_reconnect(connection)
+
+    def expect_reconnect(self, connection):
+        self.scheduler.schedule(self.reconnect_key(connection.player.id), self.reconnect_grace,
+                                partial(self.expire_connection, connection))
+
+    async def expire_connection(self, connection):
+        if connection not in self.active_connections or not connection.suspended:
+            return
+        # like a phase transition, an expired grace starts a trace of its own
+        with bind_room(self), tracer.span("expire_connection", parent=None, room_id=self.id,
+                                          game_id=getattr(self, 'game_id', None), player_id=connection.player.id):
+            log.info("player %s did not reconnect to room %s", connection.player.id, self.id)
+            await self.remove_connection(connection)
+
+    async def resume_connection(self, connection, ws):
+        self.last_activity = time.monotonic()
+        self.scheduler.cancel(self.reconnect_key(connection.player.id))
+        connection.resume(ws)
+        connection.on_send_failure = self.suspend_connection
+        for hook in self.on_connection_resumed:
+            hook(self, connection)
+        # every message carries the whole state, so the current one is all the player missed
+        if not connection.enqueue(self.get_game_state(connection.player.id, connection.codec)):
+            await self.drop_connection(connection)
 
     async def broadcast_json(self):
-        for connection in self.active_connections:
-            await connection.ws.send_text(
-                self.get_game_state(connection.player.id))
+        started = time.perf_counter()
+        connections = list(self.active_connections)
+        with self.span("broadcast_json", recipients=len(connections)):
+            messages = []
+            nicks_by_codec = {}
+            with self.span("serialize"):
+                for i, connection in enumerate(connections):
+                    codec = connection.codec
+                    prefix, suffix = self.get_shared_game_state(codec)
+                    if suffix is None:
+                        messages.append(prefix)
+                        continue
+                    nicks = nicks_by_codec.get(codec)
+                    if nicks is None:
+                        nicks = nicks_by_codec[codec] = [codec.dumps(other.player.nick) for other in connections]
+                    messages.append(prefix + codec.array(nicks[:i] + nicks[i + 1:]) + suffix)
+            # the sends are spans of their own, children of this one
+            slow_connections = [connection for connection, message in zip(connections, messages)
+                                if not connection.enqueue(message)]
+            broadcast_seconds.observe(time.perf_counter() - started)
+            broadcast_recipients.inc(len(connections))
+            for connection in slow_connections:
+                await self.drop_connection(connection)
+
+    async def drop_connection(self, connection):
+        if connection in self.active_connections:
+            log.log(30, "dropping connection %s in room %s: %s", connection.player.id, self.id, connection.get_stats())
+            websocket = connection.ws
+            await self.kick_player(connection.player.id)
+            if websocket is not None:
+                try:
+                    await websocket.close(code=POLICY_VIOLATION_CLOSE_CODE)
+                except Exception as e:
+                    log.log(30, "closing %s in room %s failed: %s", connection.player.id, self.id, e)
+
+    async def drain(self):
+        for connection in list(self.active_connections):
+            await connection.drain()
 
     async def restart_game(self):
         self.export_score()
         await self.start_game()
 
     async def start_game(self):
-        self.game = Game()
-        self.game.game_state = GameState.completing
-        self.game_id = str(uuid.uuid4().hex)
-        self.restart_timer(self.timeout)
-        await self.broadcast_json()
+        with bind_room(self), self.span("start_game") as span:
+            self.game = Game()
+            self.game.game_state = GameState.completing
+            self.game_id = str(uuid.uuid4().hex)
+            if span is not None:
+                span.set(game_id=self.game_id)
+            self.restart_timer(self.timeout)
+            self.phase_changed()
+            await self.broadcast_json()
 
     async def end_game(self):
-        try:
-            self.timer.cancel()
-        except Exception:
-            pass
-        self.export_score()
-        self.game = Game()
-        await self.broadcast_json()
+        with bind_room(self), self.span("end_game"):
+            self.scheduler.cancel(self.id)
+            self.export_score()
+            self.game = Game()
+            self.phase_changed()
+            await self.broadcast_json()
 
     async def restart_or_end_game(self):
+        if self.draining:
+            return  # the round stays in score display until the room is picked up by the next server
         if len(self.active_connections) >= 2:
             await self.restart_game()
         else:
             await self.end_game()
 
-    def handle_players_move(self, client_id:str, player_move: dict):
-        players_game_state = player_move['gameState']
-        players_results = player_move['results']
-
-        print(players_results, " ", self.game.game_state)
-        if self.game.game_state is GameState.lobby or self.game.game_state is GameState.score_display:
-            pass  # do nothing
-        elif self.game.game_state is GameState.completing and players_game_state == "COMPLETING":
-            self.game.temporary_categories[client_id] = players_results
-        elif self.game.game_state is GameState.voting and players_game_state == "VOTING":
-            self.game.votes[client_id] = players_results
+    def handle_players_move(self, client_id: str, player_move: PlayerMove):
+        self.last_activity = time.monotonic()
+        with bind_room(self):
+            players_game_state = player_move.game_state
+            debug(log, "move of %s in %s: %s", client_id, players_game_state, player_move.results or player_move.delta)
+            if self.game.game_state is GameState.lobby or self.game.game_state is GameState.score_display:
+                pass  # do nothing
+            elif self.game.game_state is GameState.completing and players_game_state == "COMPLETING":
+                if player_move.delta is not None:
+                    # {"gameState": "COMPLETING", "delta": {"City": "..."}} carries only the changed answers
+                    self.game.submit_answer_delta(client_id, player_move.delta)
+                else:
+                    self.game.submit_answers(client_id, player_move.results)
+            elif self.game.game_state is GameState.voting and players_game_state == "VOTING":
+                self.game.votes[client_id] = player_move.results
 
     def get_timestamp(self, delta=2):
         t = self.timestamp - timedelta(0, delta)
         return t.isoformat()
 
-    def get_game_state(self, client_id) -> str:
+    def invalidate_game_state(self):
+        self.shared_game_state = None
+
+    def get_shared_game_state(self, codec: Codec = json_codec):
+        # everything but the per-player nicks is encoded once per game, phase, codec and timestamp/players change
+        cache = self.shared_game_state
+        if cache is None or cache[0] is not self.game or cache[1] is not self.game.game_state:
+            cache = (self.game, self.game.game_state, {})
+            self.shared_game_state = cache
+        parts = cache[2].get(codec)
+        if parts is None:
+            parts = cache[2][codec] = self.encode_shared_game_state(codec)
+        return parts
+
+    def encode_shared_game_state(self, codec: Codec = json_codec):
+        with self.span("encode_game_state", codec=codec.name):
+            return self.encode_game_state_parts(codec)
+
+    def encode_game_state_parts(self, codec: Codec):
         if self.game.game_state is GameState.lobby:
-            game_state = dict(game_state=self.game.game_state.value)
-        elif self.game.game_state is GameState.completing:
-            game_state = dict(game_state=self.game.game_state.value, nicks=self.get_enemies_nicks(client_id),
-                              timestamp=self.get_timestamp(), game_data=self.game.get_current_state())
-        elif self.game.game_state is GameState.voting:
-            game_state = dict(game_state=self.game.game_state.value, nicks=self.get_enemies_nicks(client_id),
-                              timestamp=self.get_timestamp(), game_data=self.game.get_current_state())
+            return codec.dumps(dict(game_state=self.game.game_state.value)), None
+        elif self.game.game_state is GameState.completing or self.game.game_state is GameState.voting:
+            game_data = self.game.get_current_state()
         elif self.game.game_state is GameState.score_display:
-            game_state = dict(game_state=self.game.game_state.value, nicks=self.get_enemies_nicks(client_id),
-                              timestamp=self.get_timestamp(),
-                              game_data=self.game.get_current_state(self.get_player_nicks()))
+            game_data = self.game.get_current_state(self.get_player_nicks())
         else:
             raise ValueError
-        return json.dumps(game_state)
+        return codec.message_parts(dict(game_state=self.game.game_state.value),
+                                   dict(timestamp=self.get_timestamp(), game_data=game_data))
+
+    def get_game_state(self, client_id, codec: Codec = json_codec) -> Frame:
+        prefix, suffix = self.get_shared_game_state(codec)
+        if suffix is None:
+            return prefix
+        return prefix + codec.array([codec.dumps(nick) for nick in self.get_enemies_nicks(client_id)]) + suffix
 
     def get_enemies_nicks(self, player_id):
         return [connection.player.nick for connection in self.active_connections
@@ -141,6 +272,7 @@ class Room:
                      "number_of_players": self.number_of_players,
                      'players_ids': [self.get_players_in_game_ids()],
                      "number_of_connected_players": len(self.active_connections)}
+        stats['connections'] = [connection.get_stats() for connection in self.active_connections]
         return stats
 
     async def remove_player_by_id(self, id):
@@ -153,61 +285,75 @@ class Room:
 
     async def kick_player(self, player_id):  # probably have to leave this
         await self.remove_player_by_id(player_id)
-        self.export_room_status()
         # await self.restart_or_end_game()
         # await self.broadcast_json()
 
     def export_score(self):
         short_results = self.count_short_results()
-        logging.log(20, f"short results: {short_results}")
-        try:
-            result = requests.post(
-                url=urljoin(os.getenv('EXPORT_RESULTS_URL'), "games/handle-results/panstwa-miasta"),
-                json=dict(roomId=self.id, results=short_results))
-            if result.status_code == 200:
-                logging.log(20, "export succesfull")
-            else:
-                logging.log(30, "export failed: ", result.text, result.status_code)
-                logging.log(30, short_results)
-        except Exception:
-            logging.log(30, "failed to get EXPORT_RESULT_URL env var")
-            logging.log(30, short_results)
+        log.log(20, "short results of room %s: %s", self.id, short_results)
+        self.exporter.submit_score(self.id, short_results)
 
     def export_room_status(self):
-        try:
-            result = requests.post(
-                url=os.path.join(os.getenv('EXPORT_RESULTS_URL'), "rooms/update-room-status"),
-                json=dict(roomId=self.id, activePlayers=self.get_players_in_game_ids()))
-            if result.status_code == 200:
-                logging.log(20, "export succesfull")
-            else:
-                logging.log(30, f"export failed: {result.text}, {result.status_code}")
-        except Exception:
-            logging.log(30, "failed to get EXPORT_RESULTS_URL env var")
-            logging.log(30, f"export failed players ids: {self.get_players_in_game_ids()}")
+        if self.draining:
+            return  # players only leave to reconnect to the next server
+        self.exporter.submit_room_status(self.id, self.get_players_in_game_ids())
 
     def restart_timer(self, timeout):
-        self.timer.cancel()
-        self.timer = threading.Timer(timeout, self.handle_timeout)
-        self.timer.start()
+        self.scheduler.schedule(self.id, timeout, self.phase_due)
         self.timestamp = datetime.now() + timedelta(0, timeout)
+        self.invalidate_game_state()
+
+    def phase_changed(self):
+        for hook in self.on_phase_change:
+            hook(self)
+
+    def span(self, name: str, **attributes):
+        return tracer.span(name, room_id=self.id, game_id=getattr(self, 'game_id', None), **attributes)
 
     async def next_stage(self):
-        if self.game.game_state is GameState.lobby:
-            await self.start_game()
-        elif self.game.game_state is GameState.completing:
-            self.game.build_full_categories()
+        # a phase transition starts a trace of its own
+        with bind_room(self), tracer.span("next_stage", parent=None, room_id=self.id,
+                                          game_id=getattr(self, 'game_id', None), phase=self.game.game_state.value):
+            phase = self.game.game_state
+            self.score_stage()
+            await self.finish_stage(phase)
+
+    async def phase_due(self):
+        if self.phase_batcher is None:
+            await self.next_stage()
+        else:
+            self.phase_batcher.submit(self)
+
+    def score_stage(self, scored_categories=None):
+        # the cpu work and the state change of a transition, nothing here awaits so no player move lands in between
+        if self.game.game_state is GameState.completing:
+            with self.span("build_full_categories", players=len(self.game.temporary_categories)):
+                self.game.build_full_categories()
             self.game.summary_completing()
-            self.game.game_state = GameState.voting
-            self.restart_timer(self.timeout / 2)
-            await self.broadcast_json()
+            self.enter_phase(GameState.voting, self.timeout / 2)
         elif self.game.game_state is GameState.voting:
-            self.game.summary_voting()
-            self.game.game_state = GameState.score_display
-            self.restart_timer((self.timeout / 3) - 10)
-            await self.broadcast_json()
-        elif self.game.game_state is GameState.score_display:
+            if scored_categories is None:
+                started = time.perf_counter()
+                with self.span("summary_voting", answers=len(self.game.categories.categories)):
+                    self.game.summary_voting()
+                summary_voting_seconds.observe(time.perf_counter() - started)
+            else:
+                self.game.categories.categories = scored_categories
+            self.enter_phase(GameState.score_display, (self.timeout / 3) - 10)
+
+    def enter_phase(self, phase: GameState, timeout: float):
+        self.game.game_state = phase
+        self.restart_timer(max(timeout, 0))  # the score display gets timeout / 3 - 10, below 0 for short rounds
+        self.phase_changed()
+
+    async def finish_stage(self, phase: GameState):
+        # phase is the one that was due, score_stage has moved on from it
+        if phase is GameState.lobby:
+            await self.start_game()
+        elif phase is GameState.score_display:
             await self.restart_or_end_game()
+        else:
+            await self.broadcast_json()
 
     def count_short_results(self):
         player_oriented_categories = self.game.categories.get_player_oriented_categories()
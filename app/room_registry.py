@@ -0,0 +1,96 @@
+import time
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+from app.room import Room
+from app.server_errors import NoRoomWithThisId, RoomIdAlreadyInUse, RoomLimitReached
+
+
+class RoomRegistry:
+    def __init__(self, max_rooms: int = 0, idle_timeout: float = 0):
+        self.rooms: Dict[str, Room] = {}
+        self.pinned_ids = set()
+        self.max_rooms = max_rooms
+        self.idle_timeout = idle_timeout
+        self.on_create: List[Callable[[Room], None]] = []
+        self.on_delete: List[Callable[[Room], None]] = []
+        # rebuilt only when a room is added or removed, a tuple so callers can not change it
+        self.ids_snapshot: Optional[Tuple[str, ...]] = None
+        self.created = 0
+        self.deleted = 0
+        self.evicted = 0
+        self.rejected = 0
+
+    def __len__(self) -> int:
+        return len(self.rooms)
+
+    def __iter__(self) -> Iterator[Room]:
+        return iter(list(self.rooms.values()))
+
+    def __contains__(self, room_id) -> bool:
+        return room_id in self.rooms
+
+    def get(self, room_id: str) -> Room:
+        try:
+            return self.rooms[room_id]
+        except KeyError:
+            raise NoRoomWithThisId
+
+    def add(self, room: Room, pinned: bool = False) -> Room:
+        if room.id in self.rooms:
+            raise RoomIdAlreadyInUse
+        self.ensure_capacity()
+        self.rooms[room.id] = room
+        if pinned:
+            self.pinned_ids.add(room.id)
+        self.ids_snapshot = None
+        self.created += 1
+        for hook in self.on_create:
+            hook(room)
+        return room
+
+    def remove(self, room_id: str) -> Room:
+        room = self.get(room_id)
+        del self.rooms[room_id]
+        self.pinned_ids.discard(room_id)
+        self.ids_snapshot = None
+        self.deleted += 1
+        for hook in self.on_delete:
+            hook(room)
+        return room
+
+    def ensure_capacity(self):
+        if self.is_full():
+            self.evict_idle()
+            if self.is_full():
+                self.rejected += 1
+                raise RoomLimitReached
+
+    def is_full(self) -> bool:
+        return 0 < self.max_rooms <= len(self.rooms)
+
+    def is_idle(self, room: Room, now: float) -> bool:
+        # a timeout of 0 turns eviction off
+        return self.idle_timeout > 0 and room.id not in self.pinned_ids and not room.active_connections \
+               and now - room.last_activity >= self.idle_timeout
+
+    def evict_idle(self) -> List[str]:
+        now = time.monotonic()
+        idle_ids = [room.id for room in self.rooms.values() if self.is_idle(room, now)]
+        for room_id in idle_ids:
+            self.remove(room_id)
+        self.evicted += len(idle_ids)
+        return idle_ids
+
+    def get_ids(self) -> Tuple[str, ...]:
+        if self.ids_snapshot is None:
+            self.ids_snapshot = tuple(self.rooms)
+        return self.ids_snapshot
+
+    def get_stats(self) -> dict:
+        return {'rooms_count': len(self.rooms),
+                'rooms_ids': self.get_ids(),
+                'max_rooms': self.max_rooms,
+                'rooms_created': self.created,
+                'rooms_deleted': self.deleted,
+                'rooms_evicted': self.evicted,
+                'rooms_rejected': self.rejected}
@@ -0,0 +1,176 @@
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import zlib
+from abc import ABC, abstractmethod
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from app.connection import Connection
+from app.game import Categories, Category, Game
+from app.game_state import GameState
+from app.player import Player
+from app.room import Room
+
+SNAPSHOT_VERSION = 1
+# a room restored after its deadline gives the players this many seconds to reconnect before the phase ends
+RESTORE_GRACE = float(os.getenv('ROOM_RESTORE_GRACE', 5))
+CATEGORY_FIELDS = ('category_name', 'word', 'cluster', 'player_id', 'is_unique', 'legit_score', 'is_legit',
+                   'is_only_word_in_category', 'score')
+
+log = logging.getLogger(__name__)
+
+
+def snapshot_room(room: Room) -> bytes:
+    game = room.game
+    timestamp = getattr(room, 'timestamp', None)
+    snapshot = dict(
+        version=SNAPSHOT_VERSION,
+        room_id=room.id,
+        max_players=room.number_of_players,
+        game_id=getattr(room, 'game_id', None),
+        game_state=game.game_state.value,
+        letter=game.letter,
+        last_letter=game.last_letter,
+        custom_categories=game.custom_categories,
+        temporary_categories=game.temporary_categories,
+        votes=game.votes,
+        # one row of CATEGORY_FIELDS values per answer, field names are not repeated
+        categories=[[getattr(category, field) for field in CATEGORY_FIELDS] for category in game.categories.categories],
+        deadline=timestamp.isoformat() if timestamp is not None else None,
+        players=[[connection.player.id, connection.player.nick] for connection in room.active_connections],
+    )
+    return zlib.compress(json.dumps(snapshot, separators=(',', ':')).encode())
+
+
+def restore_game(snapshot: dict) -> Game:
+    game = Game(custom_categories=snapshot['custom_categories'])
+    game.game_state = GameState(snapshot['game_state'])
+    game.letter = snapshot['letter']
+    game.last_letter = snapshot['last_letter']
+    game.temporary_categories = snapshot['temporary_categories']
+    game.votes = snapshot['votes']
+    categories = Categories()
+    for row in snapshot['categories']:
+        category = Category(row[0])
+        for field, value in zip(CATEGORY_FIELDS[1:], row[1:]):
+            setattr(category, field, value)
+        categories.append(category)
+    game.categories = categories
+    return game
+
+
+def restore_room(data: bytes) -> Room:
+    snapshot = json.loads(zlib.decompress(data))
+    if snapshot['version'] != SNAPSHOT_VERSION:
+        raise ValueError(f"unsupported room snapshot version {snapshot['version']}")
+    room = Room(room_id=snapshot['room_id'], max_players=snapshot['max_players'])
+    room.game = restore_game(snapshot)
+    if snapshot['game_id'] is not None:
+        room.game_id = snapshot['game_id']
+    if snapshot['deadline'] is not None and room.game.game_state is not GameState.lobby:
+        deadline = datetime.fromisoformat(snapshot['deadline'])
+        room.restart_timer(max((deadline - datetime.now()).total_seconds(), RESTORE_GRACE))
+    for player_id, nick in snapshot['players']:
+        # the players keep their seats until they reconnect or the reconnect grace runs out
+        connection = Connection(None, Player(player_id, nick, True))
+        room.active_connections.append(connection)
+        room.expect_reconnect(connection)
+    return room
+
+
+class RoomStore(ABC):
+    # whether the snapshots outlive the process, rooms are only snapshotted into stores that do
+    durable = True
+
+    @abstractmethod
+    def save(self, room_id: str, snapshot: bytes):
+        pass
+
+    @abstractmethod
+    async def load(self, room_id: str) -> Optional[bytes]:
+        pass
+
+    @abstractmethod
+    def delete(self, room_id: str):
+        pass
+
+    @abstractmethod
+    def room_ids(self) -> List[str]:
+        pass
+
+    def flush(self):
+        # stores that write in the background finish their writes here
+        pass
+
+
+class MemoryRoomStore(RoomStore):
+    durable = False
+
+    def __init__(self):
+        self.snapshots: Dict[str, bytes] = {}
+
+    def save(self, room_id: str, snapshot: bytes):
+        self.snapshots[room_id] = snapshot
+
+    async def load(self, room_id: str) -> Optional[bytes]:
+        return self.snapshots.get(room_id)
+
+    def delete(self, room_id: str):
+        self.snapshots.pop(room_id, None)
+
+    def room_ids(self) -> List[str]:
+        return list(self.snapshots)
+
+
+def log_failed_write(future: Future):
+    error = future.exception()
+    if error is not None:
+        log.log(40, "room store write failed: %s %s", error.__class__.__name__, error)
+
+
+class SqliteRoomStore(RoomStore):
+    # every statement runs on one writer thread, in order: the save at every phase transition does not wait
+    # for the disk on the event loop, and loads still see the saves before them
+    def __init__(self, path: str):
+        self.connection = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS rooms (room_id TEXT PRIMARY KEY, snapshot BLOB NOT NULL, updated REAL)")
+        self.writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix='room-store')
+
+    def execute(self, sql: str, parameters: tuple = ()) -> list:
+        return self.connection.execute(sql, parameters).fetchall()
+
+    def save(self, room_id: str, snapshot: bytes):
+        self.writer.submit(self.execute, "INSERT OR REPLACE INTO rooms VALUES (?, ?, julianday('now'))",
+                           (room_id, snapshot)).add_done_callback(log_failed_write)
+
+    async def load(self, room_id: str) -> Optional[bytes]:
+        rows = await asyncio.wrap_future(
+            self.writer.submit(self.execute, "SELECT snapshot FROM rooms WHERE room_id = ?", (room_id,)))
+        return rows[0][0] if rows else None
+
+    def delete(self, room_id: str):
+        self.writer.submit(self.execute, "DELETE FROM rooms WHERE room_id = ?",
+                           (room_id,)).add_done_callback(log_failed_write)
+
+    def room_ids(self) -> List[str]:
+        return [row[0] for row in self.writer.submit(self.execute, "SELECT room_id FROM rooms").result()]
+
+    def flush(self):
+        self.writer.submit(lambda: None).result()
+
+
+def create_room_store(url: Optional[str]) -> RoomStore:
+    # ROOM_STORE=sqlite:///path/to/rooms.db, anything else keeps the snapshots in memory
+    if url and url.startswith('sqlite:///'):
+        return SqliteRoomStore(url[len('sqlite:///'):])
+    return MemoryRoomStore()
+
+
+room_store = create_room_store(os.getenv('ROOM_STORE'))
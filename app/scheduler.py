@@ -0,0 +1,137 @@
+import asyncio
+import contextvars
+import heapq
+import itertools
+import logging
+from typing import Awaitable, Callable, Dict, Hashable, List, Optional
+
+from app.metrics import timer_lag_seconds
+
+log = logging.getLogger(__name__)
+
+
+class ScheduledPhase:
+    __slots__ = ("deadline", "seq", "key", "callback", "cancelled")
+
+    def __init__(self, deadline: float, seq: int, key: Hashable, callback: Callable[[], Awaitable]):
+        self.deadline = deadline
+        self.seq = seq
+        self.key = key
+        self.callback = callback
+        self.cancelled = False
+
+    def __lt__(self, other):
+        return (self.deadline, self.seq) < (other.deadline, other.seq)
+
+
+class PhaseScheduler:
+    def __init__(self):
+        self.heap: List[ScheduledPhase] = []
+        self.entries: Dict[Hashable, ScheduledPhase] = {}
+        self.counter = itertools.count()
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.handle: Optional[asyncio.TimerHandle] = None
+        self.handle_deadline: Optional[float] = None
+        self.tasks = set()
+        self.fired = 0
+        self.last_lag = 0.0
+        self.max_lag = 0.0
+        self.total_lag = 0.0
+
+    def collect_metrics(self) -> list:
+        return [('panstwa_timers_pending', 'gauge', 'Phase timers waiting to fire', [({}, len(self.entries))])]
+
+    def schedule(self, key: Hashable, delay: float, callback: Callable[[], Awaitable]):
+        loop = asyncio.get_running_loop()
+        if self.loop is not loop:
+            self.reset(loop)
+        self.cancel(key)
+        entry = ScheduledPhase(loop.time() + delay, next(self.counter), key, callback)
+        self.entries[key] = entry
+        heapq.heappush(self.heap, entry)
+        self.arm()
+        return entry.deadline
+
+    def reschedule(self, key: Hashable, delay: float):
+        entry = self.entries.get(key)
+        if entry is None:
+            raise KeyError(key)
+        return self.schedule(key, delay, entry.callback)
+
+    def cancel(self, key: Hashable) -> bool:
+        entry = self.entries.pop(key, None)
+        if entry is None:
+            return False
+        entry.cancelled = True
+        if len(self.heap) > 2 * len(self.entries) + 64:
+            self.compact()
+        return True
+
+    def deadline(self, key: Hashable) -> Optional[float]:
+        entry = self.entries.get(key)
+        return entry.deadline if entry is not None else None
+
+    def reset(self, loop: asyncio.AbstractEventLoop):
+        # deadlines from a closed loop (e.g. between test cases) can not be honoured on a new one
+        if self.handle is not None:
+            self.handle.cancel()
+        self.heap.clear()
+        self.entries.clear()
+        self.handle = None
+        self.handle_deadline = None
+        self.loop = loop
+
+    def compact(self):
+        self.heap = [entry for entry in self.heap if not entry.cancelled]
+        heapq.heapify(self.heap)
+
+    def arm(self):
+        while self.heap and self.heap[0].cancelled:
+            heapq.heappop(self.heap)
+        if not self.heap:
+            return
+        deadline = self.heap[0].deadline
+        if self.handle is not None:
+            if self.handle_deadline <= deadline:
+                return
+            self.handle.cancel()
+        self.handle_deadline = deadline
+        # the handle is armed by whichever room scheduled first, its room and span must not leak into the others
+        self.handle = self.loop.call_at(deadline, self.fire, context=contextvars.Context())
+
+    def fire(self):
+        self.handle = None
+        self.handle_deadline = None
+        now = self.loop.time()
+        while self.heap and self.heap[0].deadline <= now:
+            entry = heapq.heappop(self.heap)
+            if entry.cancelled:
+                continue
+            del self.entries[entry.key]
+            lag = now - entry.deadline
+            self.fired += 1
+            self.last_lag = lag
+            self.total_lag += lag
+            self.max_lag = max(self.max_lag, lag)
+            timer_lag_seconds.observe(lag)
+            task = self.loop.create_task(self.run(entry))
+            self.tasks.add(task)
+            task.add_done_callback(self.tasks.discard)
+        self.arm()
+
+    async def run(self, entry: ScheduledPhase):
+        try:
+            await entry.callback()
+        except Exception as e:
+            log.log(40, "scheduled phase %s failed: %s %s", entry.key, e.__class__.__name__, e, exc_info=True)
+
+    def get_stats(self) -> dict:
+        return {"pending_deadlines": len(self.entries),
+                "running_callbacks": len(self.tasks),
+                "fired": self.fired,
+                "last_lag": self.last_lag,
+                "max_lag": self.max_lag,
+                "avg_lag": self.total_lag / self.fired if self.fired else 0.0}
+
+
+scheduler = PhaseScheduler()
@@ -36,3 +36,23 @@ class ItsNotYourTurn(WsServerError):
 class NoPlayerWithThisId(WsServerError):
     def __init__(self):
         self.message = 'No Player With ThisId'
+
+
+class RoomLimitReached(WsServerError):
+    def __init__(self):
+        self.message = 'This server can not host more rooms'
+
+
+class ServerIsDraining(WsServerError):
+    def __init__(self):
+        self.message = 'This server is shutting down, retry on another one'
+
+
+class ProfilerIsBusy(WsServerError):
+    def __init__(self):
+        self.message = 'A profile is already being recorded'
+
+
+class InvalidMove(WsServerError):
+    def __init__(self, reason: str = ''):
+        self.message = f'Malformed player move: {reason}'
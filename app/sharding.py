@@ -0,0 +1,158 @@
+import bisect
+import hashlib
+import hmac
+import json
+import logging
+import os
+import re
+import socket
+from typing import Iterable, List, Optional
+from urllib.parse import parse_qs, urlparse
+
+import httpx
+
+FORWARDED_HEADER = 'x-shard-forwarded'
+REDIRECT_CLOSE_CODE = 4307
+
+ROOM_ROUTES = [re.compile(pattern) for pattern in [
+    r'^/room/new/(?P<room_id>[^/]+)(/[^/]+)?$',
+    r'^/room/(?P<room_id>[^/]+)$',
+    r'^/game/(end|start|restart)/(?P<room_id>[^/]+)$',
+    r'^/game/kick_player/(?P<room_id>[^/]+)/[^/]+$',
+    r'^/ws/(?P<room_id>[^/]+)/[^/]+/[^/]+$',
+    r'^/admin/trace/(?P<room_id>[^/]+)$',
+]]
+HOP_BY_HOP_HEADERS = {'connection', 'keep-alive', 'transfer-encoding', 'upgrade', 'host', 'content-length',
+                      'content-encoding'}
+
+stats = {"forwarded": 0, "redirected": 0}
+log = logging.getLogger(__name__)
+
+
+def hash_key(key: str) -> int:
+    return int.from_bytes(hashlib.md5(key.encode()).digest()[:8], 'big')
+
+
+class ShardRing:
+    def __init__(self, nodes: List[str], replicas: int = 100):
+        points = sorted((hash_key(f"{node}#{replica}"), node) for node in nodes for replica in range(replicas))
+        self.nodes = list(nodes)
+        self.hashes = [point[0] for point in points]
+        self.owners = [point[1] for point in points]
+
+    def owner(self, room_id: str) -> str:
+        position = bisect.bisect(self.hashes, hash_key(room_id)) % len(self.hashes)
+        return self.owners[position]
+
+
+def get_room_id(scope) -> Optional[str]:
+    if scope['path'].rstrip('/') == '/stats':
+        room_ids = parse_qs(scope.get('query_string', b'').decode()).get('room_id')
+        return room_ids[0] if room_ids else None
+    for route in ROOM_ROUTES:
+        match = route.match(scope['path'])
+        if match:
+            return match.group('room_id')
+    return None
+
+
+def websocket_url(node: str) -> str:
+    return re.sub(r'^http', 'ws', node)
+
+
+class RoomAffinityMiddleware:
+    def __init__(self, app, ring: ShardRing, self_node: str, transport: Optional[httpx.AsyncBaseTransport] = None,
+                 secret: str = '', trusted_hosts: Iterable[str] = ()):
+        self.app = app
+        self.ring = ring
+        self.self_node = self_node
+        self.transport = transport
+        self.secret = secret
+        self.trusted_hosts = set(trusted_hosts)
+        self.client: Optional[httpx.AsyncClient] = None
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] not in ('http', 'websocket'):
+            return await self.app(scope, receive, send)
+        room_id = get_room_id(scope)
+        owner = self.ring.owner(room_id) if room_id is not None else self.self_node
+        if owner == self.self_node or self.is_forwarded(scope):
+            return await self.app(scope, receive, send)
+        if scope['type'] == 'websocket':
+            await self.redirect(scope, receive, send, owner)
+        else:
+            await self.forward(scope, receive, send, owner)
+
+    def is_forwarded(self, scope) -> bool:
+        # anyone can send the header, it is only trusted with the shared secret or, without one, from another shard
+        values = [value for name, value in scope.get('headers', []) if name.decode().lower() == FORWARDED_HEADER]
+        if not values:
+            return False
+        if self.secret:
+            return hmac.compare_digest(values[0], self.secret.encode())
+        client = scope.get('client')
+        return client is not None and client[0] in self.trusted_hosts
+
+    async def redirect(self, scope, receive, send, owner: str):
+        stats["redirected"] += 1
+        await receive()  # websocket.connect
+        await send({'type': 'websocket.accept'})
+        await send({'type': 'websocket.send',
+                    'text': json.dumps(dict(game_state="REDIRECT", url=websocket_url(owner) + scope['path']))})
+        await send({'type': 'websocket.close', 'code': REDIRECT_CLOSE_CODE})
+
+    async def forward(self, scope, receive, send, owner: str):
+        stats["forwarded"] += 1
+        body = b''
+        while True:
+            message = await receive()
+            body += message.get('body', b'')
+            if not message.get('more_body'):
+                break
+        headers = [(name.decode(), value.decode()) for name, value in scope['headers']
+                   if name.decode().lower() not in HOP_BY_HOP_HEADERS and name.decode().lower() != FORWARDED_HEADER]
+        headers.append((FORWARDED_HEADER, self.secret or self.self_node))
+        url = owner + scope.get('root_path', '') + scope['path']
+        if scope.get('query_string'):
+            url += '?' + scope['query_string'].decode()
+        try:
+            response = await self.get_client().request(scope['method'], url, headers=headers, content=body)
+            status, content = response.status_code, response.content
+            response_headers = [(name.encode(), value.encode()) for name, value in response.headers.items()
+                                if name.lower() not in HOP_BY_HOP_HEADERS]
+        except httpx.HTTPError as e:
+            log.log(40, "forwarding %s to %s failed: %s %s", scope['path'], owner, e.__class__.__name__, e)
+            status, content = 502, json.dumps({"detail": f"Room owner {owner} is unavailable"}).encode()
+            response_headers = [(b'content-type', b'application/json')]
+        response_headers.append((b'content-length', str(len(content)).encode()))
+        await send({'type': 'http.response.start', 'status': status, 'headers': response_headers})
+        await send({'type': 'http.response.body', 'body': content})
+
+    def get_client(self) -> httpx.AsyncClient:
+        if self.client is None:
+            self.client = httpx.AsyncClient(transport=self.transport, timeout=10)
+        return self.client
+
+
+def node_addresses(nodes: List[str]) -> set:
+    addresses = set()
+    for node in nodes:
+        host = urlparse(node).hostname
+        addresses.add(host)
+        try:
+            addresses.update(info[4][0] for info in socket.getaddrinfo(host, None))
+        except socket.gaierror as e:
+            log.log(30, "can not resolve shard %s: %s", node, e)
+    return addresses
+
+
+def setup_sharding(app) -> Optional[dict]:
+    nodes = [node.strip().rstrip('/') for node in os.getenv('SHARD_NODES', '').split(',') if node.strip()]
+    if len(nodes) < 2:
+        return None
+    self_node = os.getenv('SHARD_SELF', '').rstrip('/')
+    if self_node not in nodes:
+        raise ValueError(f"SHARD_SELF {self_node} is not one of SHARD_NODES {nodes}")
+    app.add_middleware(RoomAffinityMiddleware, ring=ShardRing(nodes), self_node=self_node,
+                       secret=os.getenv('SHARD_SECRET', ''), trusted_hosts=node_addresses(nodes))
+    return {"node": self_node, "nodes": nodes}
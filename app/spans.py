@@ -0,0 +1,161 @@
+import contextvars
+import json
+import os
+import queue
+import random
+import sys
+import threading
+import time
+from collections import defaultdict
+from typing import Optional
+
+SPAN_EXPORT_PATH = os.getenv('SPAN_EXPORT_PATH')
+# attributes a span takes over from its parent unless it sets them itself
+INHERITED_ATTRIBUTES = ('room_id', 'game_id')
+
+current_span = contextvars.ContextVar('current_span', default=None)
+
+
+class Span:
+    __slots__ = ('name', 'trace_id', 'span_id', 'parent_id', 'start', 'end', 'attributes', 'status', 'token')
+
+    def __init__(self, name: str, parent: Optional['Span'], attributes: dict):
+        self.name = name
+        self.trace_id = parent.trace_id if parent is not None else f"{random.getrandbits(128):032x}"
+        self.span_id = f"{random.getrandbits(64):016x}"
+        self.parent_id = parent.span_id if parent is not None else None
+        if parent is not None:
+            for key in INHERITED_ATTRIBUTES:
+                if key not in attributes and key in parent.attributes:
+                    attributes[key] = parent.attributes[key]
+        self.attributes = attributes
+        self.status = 'OK'
+        self.start = time.time_ns()
+        self.end = None
+        self.token = None
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def to_dict(self) -> dict:
+        # field names of the OTLP JSON encoding, attributes kept as a plain object
+        return {"traceId": self.trace_id, "spanId": self.span_id, "parentSpanId": self.parent_id or "",
+                "name": self.name, "startTimeUnixNano": self.start, "endTimeUnixNano": self.end,
+                "attributes": self.attributes, "status": self.status}
+
+
+class ActiveSpan:
+    __slots__ = ('tracer', 'span')
+
+    def __init__(self, tracer: 'Tracer', span: Span):
+        self.tracer = tracer
+        self.span = span
+
+    def __enter__(self) -> Span:
+        self.span.token = current_span.set(self.span)
+        return self.span
+
+    def __exit__(self, exc_type, exc, traceback):
+        span = self.span
+        span.end = time.time_ns()
+        if exc is not None:
+            span.status = 'ERROR'
+            span.attributes['exception'] = f"{exc_type.__name__}: {exc}"
+        current_span.reset(span.token)
+        span.token = None
+        self.tracer.export(span)
+        return False
+
+
+class NoSpan:
+    # what tracer.span gives while spans are off, entering it costs next to nothing
+    __slots__ = ()
+
+    def __enter__(self):
+        return None
+
+    def __exit__(self, exc_type, exc, traceback):
+        return False
+
+
+NO_SPAN = NoSpan()
+CURRENT = object()
+
+
+class FileSpanExporter:
+    # spans are put on a queue by the event loop and appended to the file by a background thread
+    def __init__(self, path: str):
+        self.path = path
+        self.queue = queue.SimpleQueue()
+        self.thread = threading.Thread(target=self.run, name='span-exporter', daemon=True)
+        self.thread.start()
+
+    def export(self, span: Span):
+        self.queue.put(span)
+
+    def run(self):
+        with open(self.path, 'a') as spans_file:
+            while True:
+                span = self.queue.get()
+                if span is None:
+                    return
+                spans_file.write(json.dumps(span.to_dict(), default=str) + '\n')
+                if self.queue.empty():
+                    spans_file.flush()
+
+    def close(self):
+        self.queue.put(None)
+        self.thread.join()
+
+
+class Tracer:
+    def __init__(self, exporter=None):
+        self.exporter = exporter
+
+    @property
+    def enabled(self) -> bool:
+        return self.exporter is not None
+
+    def span(self, name: str, parent=CURRENT, **attributes):
+        # parent is the current span unless given, None starts a new trace
+        if self.exporter is None:
+            return NO_SPAN
+        if parent is CURRENT:
+            parent = current_span.get()
+        return ActiveSpan(self, Span(name, parent, attributes))
+
+    def export(self, span: Span):
+        exporter = self.exporter
+        if exporter is not None:
+            exporter.export(span)
+
+    def start(self, path: Optional[str] = SPAN_EXPORT_PATH):
+        if path:
+            self.exporter = FileSpanExporter(path)
+
+    def stop(self):
+        exporter, self.exporter = self.exporter, None
+        if exporter is not None and hasattr(exporter, 'close'):
+            exporter.close()
+
+
+def summarize(path: str) -> dict:
+    # where the time of the recorded spans went, by span name
+    durations = defaultdict(list)
+    with open(path) as spans_file:
+        for line in spans_file:
+            span = json.loads(line)
+            durations[span["name"]].append((span["endTimeUnixNano"] - span["startTimeUnixNano"]) / 1e6)
+    summary = {}
+    for name, values in sorted(durations.items()):
+        values.sort()
+        summary[name] = {"count": len(values), "p50_ms": round(values[len(values) // 2], 3),
+                         "p99_ms": round(values[min(len(values) - 1, int(len(values) * 0.99))], 3),
+                         "max_ms": round(values[-1], 3), "total_ms": round(sum(values), 3)}
+    return summary
+
+
+tracer = Tracer()
+
+if __name__ == '__main__':
+    print(json.dumps(summarize(sys.argv[1] if len(sys.argv) > 1 else SPAN_EXPORT_PATH), indent=2))
@@ -0,0 +1,161 @@
+import asyncio
+import logging
+import os
+import sys
+import threading
+import time
+from collections import Counter, deque
+from typing import Optional
+
+from app.metrics import event_loop_lag_seconds, event_loop_stalls
+from app.server_errors import ProfilerIsBusy
+
+LAG_INTERVAL = float(os.getenv('LOOP_LAG_INTERVAL', 0.1))
+LAG_THRESHOLD = float(os.getenv('LOOP_LAG_THRESHOLD', 0.25))
+PROFILER_ENABLED = os.getenv('PROFILER_ENABLED', '0') == '1'
+PROFILE_INTERVAL = float(os.getenv('PROFILE_INTERVAL', 0.005))
+MAX_PROFILE_SECONDS = 60
+# code running on the loop that a stall is blamed on, the innermost one on the stack wins
+HANDLERS = {
+    ('app.connection_manager', 'handle_ws_message'): 'handle_ws_message',
+    ('app.room', 'broadcast_json'): 'broadcast_json',
+    ('app.room', 'next_stage'): 'next_stage',
+    ('app.room', 'score_stage'): 'next_stage',
+    ('app.room', 'finish_stage'): 'next_stage',
+    ('app.phase_batch', 'run_batch'): 'phase_batch',
+    ('app.room', 'export_score'): 'export',
+    ('app.room', 'export_room_status'): 'export',
+}
+EXPORT_MODULE = 'app.exporter'
+
+log = logging.getLogger(__name__)
+
+
+def frame_name(frame) -> str:
+    return f"{frame.f_globals.get('__name__', '?')}:{frame.f_code.co_name}"
+
+
+def walk_stack(frame) -> list:
+    # innermost frame first
+    frames = []
+    while frame is not None:
+        frames.append(frame)
+        frame = frame.f_back
+    return frames
+
+
+def find_handler(frames: list) -> Optional[str]:
+    for frame in frames:
+        module = frame.f_globals.get('__name__')
+        if module == EXPORT_MODULE:
+            return 'export'
+        handler = HANDLERS.get((module, frame.f_code.co_name))
+        if handler is not None:
+            return handler
+    return None
+
+
+def collapse(frames: list) -> str:
+    # one line of the collapsed stack format read by flamegraph.pl and speedscope, outermost frame first
+    return ';'.join(frame_name(frame) for frame in reversed(frames))
+
+
+class LoopWatchdog:
+    # the loop reschedules a tick every interval, a thread notices when a tick is late and samples the loop's stack
+    def __init__(self, interval: float = LAG_INTERVAL, threshold: float = LAG_THRESHOLD, keep: int = 20):
+        self.interval = interval
+        self.threshold = threshold
+        self.stalls = deque(maxlen=keep)
+        self.max_lag = 0.0
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.loop_thread_id: Optional[int] = None
+        self.handle: Optional[asyncio.TimerHandle] = None
+        self.thread: Optional[threading.Thread] = None
+        self.stopped = threading.Event()
+        self.last_tick = time.monotonic()
+
+    def start(self, loop: asyncio.AbstractEventLoop):
+        # called from the loop's thread
+        self.stop()
+        self.loop = loop
+        self.loop_thread_id = threading.get_ident()
+        self.last_tick = time.monotonic()
+        self.handle = loop.call_later(self.interval, self.tick, self.last_tick + self.interval)
+        self.stopped.clear()
+        self.thread = threading.Thread(target=self.watch, name='loop-watchdog', daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        if self.handle is not None:
+            self.handle.cancel()
+            self.handle = None
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def tick(self, expected: float):
+        now = time.monotonic()
+        lag = max(0.0, now - expected)
+        event_loop_lag_seconds.observe(lag)
+        self.max_lag = max(self.max_lag, lag)
+        self.last_tick = now
+        self.handle = self.loop.call_later(self.interval, self.tick, now + self.interval)
+
+    def watch(self):
+        sampled_tick = None
+        while not self.stopped.wait(self.threshold / 2):
+            last_tick = self.last_tick
+            lag = time.monotonic() - last_tick - self.interval
+            if lag > self.threshold and sampled_tick != last_tick:
+                sampled_tick = last_tick  # one sample per stall
+                self.sample_stall(lag)
+
+    def sample_stall(self, lag: float):
+        frame = sys._current_frames().get(self.loop_thread_id)
+        if frame is None:
+            return
+        frames = walk_stack(frame)
+        handler = find_handler(frames)
+        stack = [f"{frame_name(frame)}:{frame.f_lineno}" for frame in frames]
+        del frame, frames
+        self.stalls.append({"time": time.time(), "lag_seconds": round(lag, 3), "handler": handler, "stack": stack})
+        event_loop_stalls.inc()
+        log.log(30, "event loop stalled for %.3fs in %s at %s", lag, handler, ' < '.join(stack[:8]))
+
+    def get_stats(self) -> dict:
+        return {"interval": self.interval,
+                "threshold": self.threshold,
+                "max_lag": self.max_lag,
+                "stalls": list(self.stalls)}
+
+
+class SamplingProfiler:
+    def __init__(self, interval: float = PROFILE_INTERVAL):
+        self.interval = interval
+        self.lock = threading.Lock()
+
+    def profile(self, thread_id: int, seconds: float) -> Counter:
+        # run in a worker thread, samples the stack of thread_id until seconds have passed
+        if not self.lock.acquire(blocking=False):
+            raise ProfilerIsBusy
+        try:
+            stacks = Counter()
+            deadline = time.monotonic() + min(seconds, MAX_PROFILE_SECONDS)
+            while time.monotonic() < deadline:
+                frame = sys._current_frames().get(thread_id)
+                if frame is not None:
+                    stacks[collapse(walk_stack(frame))] += 1
+                del frame
+                time.sleep(self.interval)
+            return stacks
+        finally:
+            self.lock.release()
+
+
+def render_collapsed(stacks: Counter) -> str:
+    return ''.join(f"{stack} {count}\n" for stack, count in stacks.most_common())
+
+
+watchdog = LoopWatchdog()
+profiler = SamplingProfiler()
@@ -0,0 +1,8 @@
+from uvicorn.workers import UvicornWorker
+
+from app.rate_limit import MAX_FRAME_SIZE
+
+
+class Worker(UvicornWorker):
+    # the server refuses longer websocket messages before they are read, the check in the app stays as a second line
+    CONFIG_KWARGS = {**UvicornWorker.CONFIG_KWARGS, "ws_max_size": MAX_FRAME_SIZE}
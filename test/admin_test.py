@@ -0,0 +1,28 @@
+import unittest
+from unittest import mock
+
+from fastapi.testclient import TestClient
+
+from app import logs, main
+
+
+class AdminTest(unittest.TestCase):
+    def test_admin_calls_need_localhost_or_the_token(self):
+        remote = TestClient(main.app, client=("203.0.113.7", 50000))
+        self.assertEqual(403, remote.get("/admin/watchdog").status_code)
+        self.assertEqual(403, remote.post("/admin/drain").status_code)
+        self.assertFalse(main.manager.draining)
+        self.assertEqual(403, remote.get("/admin/watchdog", headers={"x-admin-token": ""}).status_code)
+
+        local = TestClient(main.app, client=("127.0.0.1", 50000))
+        self.assertEqual(200, local.get("/admin/watchdog").status_code)
+
+        with mock.patch.object(main, 'ADMIN_TOKEN', "admin-secret"):
+            self.assertEqual(403, remote.get("/admin/watchdog", headers={"x-admin-token": "wrong"}).status_code)
+            response = remote.post("/admin/trace/traced", headers={"x-admin-token": "admin-secret"})
+        self.assertEqual(200, response.status_code)
+        logs.tracing.disable("traced")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,47 @@
+import unittest
+
+from app.game import Game
+from app.game_state import GameState
+from app.protocol import PlayerMove
+from app.room import Room
+
+
+def words_of(game: Game):
+    return sorted((c.player_id, c.category_name, c.word) for c in game.categories.categories if c.player_id)
+
+
+class AnswerDeltaTest(unittest.TestCase):
+    def test_deltas_merge_into_fixed_slot(self):
+        game = Game(custom_categories=["City", "Animal", "Name"])
+        game.submit_answer_delta("player_1", {"City": "  Wars\u200bzawa "})
+        game.submit_answer_delta("player_1", {"Animal": "Wilk", "Unknown": "x"})
+        game.submit_answer_delta("player_1", {"City": "Wrocław"})
+        game.submit_answer_delta("player_1", ["not", "a", "delta"])
+        self.assertEqual({"City": "wrocław", "Animal": "wilk", "Name": ""}, game.temporary_categories["player_1"])
+        self.assertEqual(["City", "Animal", "Name"], list(game.temporary_categories["player_1"]))
+
+    def test_deltas_and_full_answers_finalize_the_same(self):
+        answers = {"City": "Warszawa", "Animal": " WILK", "Name": ""}
+        full = Game(custom_categories=["City", "Animal", "Name"])
+        full.submit_answers("player_1", answers)
+        full.build_full_categories()
+        incremental = Game(custom_categories=["City", "Animal", "Name"])
+        for category_name, answer in answers.items():
+            incremental.submit_answer_delta("player_1", {category_name: answer})
+        incremental.build_full_categories()
+        self.assertEqual(words_of(full), words_of(incremental))
+
+    def test_room_accepts_delta_moves(self):
+        room = Room(room_id="delta")
+        room.game.game_state = GameState.completing
+        room.handle_players_move("player_1", PlayerMove("COMPLETING", delta={"City": "Gdańsk"}))
+        room.handle_players_move("player_1", PlayerMove("COMPLETING", delta={"Animal": "Żubr"}))
+        self.assertEqual("gdańsk", room.game.temporary_categories["player_1"]["City"])
+        self.assertEqual("żubr", room.game.temporary_categories["player_1"]["Animal"])
+        room.game.game_state = GameState.voting
+        room.handle_players_move("player_1", PlayerMove("COMPLETING", delta={"City": "Kraków"}))
+        self.assertEqual("gdańsk", room.game.temporary_categories["player_1"]["City"])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,91 @@
+import asyncio
+import json
+import random
+import time
+import unittest
+from datetime import datetime
+
+from app.connection import Connection
+from app.game_state import GameState
+from app.player import Player
+from app.room import Room
+
+PLAYER_COUNTS = [2, 4, 8, 16, 32, 64]
+ROUNDS = 20
+
+
+class FakeWebSocket:
+    def __init__(self):
+        self.sent = []
+
+    async def send_text(self, text):
+        self.sent.append(text)
+
+
+def build_room(players_count: int, game_state: GameState) -> Room:
+    rng = random.Random(players_count)
+    room = Room(room_id="benchmark")
+    for i in range(players_count):
+        room.active_connections.append(Connection(FakeWebSocket(), Player(f"player_{i}", f"nick_{i}", True)))
+    room.game.game_state = GameState.completing
+    for connection in room.active_connections:
+        room.game.temporary_categories[connection.player.id] = {
+            name: room.game.letter + "".join(rng.choice("abcdefgh") for _ in range(6))
+            for name in room.game.categories.get_categories_names()}
+    room.game.build_full_categories()
+    if game_state is GameState.score_display:
+        room.game.summary_voting()
+    room.game.game_state = game_state
+    room.timestamp = datetime.now()
+    return room
+
+
+def per_player_game_state(room: Room, client_id: str) -> str:
+    player_nicks = room.get_player_nicks() if room.game.game_state is GameState.score_display else None
+    return json.dumps(dict(game_state=room.game.game_state.value, nicks=room.get_enemies_nicks(client_id),
+                           timestamp=room.get_timestamp(), game_data=room.game.get_current_state(player_nicks)))
+
+
+class BroadcastBenchmarkTest(unittest.TestCase):
+    def test_broadcast_matches_per_player_serialization(self):
+        for game_state in [GameState.completing, GameState.voting, GameState.score_display]:
+            room = build_room(5, game_state)
+            async def broadcast():
+                await room.broadcast_json()
+                await room.drain()
+
+            asyncio.run(broadcast())
+            for connection in room.active_connections:
+                # the codec may write the game data more compactly than json.dumps, the content is the same
+                self.assertEqual(json.loads(per_player_game_state(room, connection.player.id)),
+                                 json.loads(connection.ws.sent[-1]))
+                self.assertEqual(room.get_game_state(connection.player.id), connection.ws.sent[-1])
+
+    def test_broadcast_cost_by_player_count(self):
+        print("\nplayers  per-player json.dumps [ms]  shared blob [ms]")
+        for players_count in PLAYER_COUNTS:
+            room = build_room(players_count, GameState.score_display)
+
+            start = time.perf_counter()
+            for _ in range(ROUNDS):
+                for connection in room.active_connections:
+                    per_player_game_state(room, connection.player.id)
+            per_player = (time.perf_counter() - start) / ROUNDS
+
+            async def broadcast_rounds():
+                for _ in range(ROUNDS):
+                    room.invalidate_game_state()
+                    await room.broadcast_json()
+                await room.drain()
+
+            start = time.perf_counter()
+            asyncio.run(broadcast_rounds())
+            shared = (time.perf_counter() - start) / ROUNDS
+
+            print(f"{players_count:7d}  {per_player * 1000:25.3f}  {shared * 1000:16.3f}")
+            if players_count >= 8:
+                self.assertLess(shared, per_player)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,50 @@
+import unittest
+
+from app.clustering import cluster_words, find_leader
+from app.game import Game
+from app.game_state import GameState
+
+
+class ClusterWordsTest(unittest.TestCase):
+    def test_near_duplicates_share_a_leader(self):
+        clusters = cluster_words(["warszwa", "warszawa", "warszawa", "wrocław", ""], max_distance=1)
+        self.assertEqual({"warszawa": "warszawa", "warszwa": "warszawa", "wrocław": "wrocław"}, clusters)
+
+    def test_short_words_and_zero_distance_are_exact(self):
+        self.assertEqual({"ala": "ala", "ola": "ola"}, cluster_words(["ala", "ola"], max_distance=1, min_length=4))
+        self.assertEqual({"warszawa": "warszawa", "warszwa": "warszwa"},
+                         cluster_words(["warszawa", "warszwa"], max_distance=0))
+
+    def test_length_difference_beyond_distance_is_not_compared(self):
+        clusters = cluster_words(["abcdef", "abcdefgh"], max_distance=1)
+        self.assertEqual({"abcdef": "abcdef", "abcdefgh": "abcdefgh"}, clusters)
+
+    def test_leaders_do_not_depend_on_string_identity(self):
+        built = "".join(["kra", "kow"])  # equal to, but not the same object as, the literal below
+        clusters = cluster_words([built, built, "krakow", "krakw"], max_distance=1)
+        self.assertEqual({"krakow": "krakow", "krakw": "krakow"}, clusters)
+        self.assertIsNone(find_leader("gdansk", {6: ["krakow"]}, 1))
+
+
+class GameClusteringTest(unittest.TestCase):
+    def test_voting_and_uniqueness_work_on_clusters(self):
+        game = Game(custom_categories=["City"], max_edit_distance=1, min_clustered_length=5)
+        game.letter = "w"
+        game.game_state = GameState.completing
+        game.temporary_categories = {"player_1": {"City": "warszawa"},
+                                     "player_2": {"City": "warszwa"},
+                                     "player_3": {"City": "wrocław"}}
+        game.build_full_categories()
+        game.game_state = GameState.voting
+
+        self.assertEqual({"City": ["warszawa", "wrocław"]}, game.get_current_state()["candidates"])
+
+        game.votes = {"player_3": {"City": {"warszawa": False, "wrocław": True}}}
+        game.summary_voting()
+        scores = {c.player_id: (c.legit_score, c.is_unique, c.score) for c in game.categories.categories}
+        self.assertEqual({"player_1": (-1, False, 0), "player_2": (-1, False, 0), "player_3": (1, True, 15)},
+                         scores)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,64 @@
+import random
+import timeit
+import unittest
+from datetime import datetime
+
+from app.connection import Connection
+from app.game_state import GameState
+from app.player import Player
+from app.protocol import JsonCodec, OrjsonCodec, MsgpackCodec, decode_move, msgpack, orjson
+from app.room import Room
+
+REPEAT = 2000
+
+
+def build_room(players_count: int) -> Room:
+    rng = random.Random(players_count)
+    room = Room(room_id="codec-benchmark")
+    for i in range(players_count):
+        room.active_connections.append(Connection(None, Player(f"player_{i}", f"nick_{i}", True)))
+    room.game.game_state = GameState.completing
+    for connection in room.active_connections:
+        room.game.temporary_categories[connection.player.id] = {
+            name: room.game.letter + "".join(rng.choice("abcdefgh") for _ in range(6))
+            for name in room.game.get_template_names()}
+    room.game.build_full_categories()
+    room.game.summary_voting()
+    room.game.game_state = GameState.score_display
+    room.timestamp = datetime.now()
+    return room
+
+
+def available_codecs():
+    codecs = [JsonCodec()]
+    if orjson is not None:
+        codecs.append(OrjsonCodec())
+    if msgpack is not None:
+        codecs.append(MsgpackCodec())
+    return codecs
+
+
+class CodecBenchmarkTest(unittest.TestCase):
+    def test_encode_decode_cost(self):
+        room = build_room(8)
+        move = {"gameState": "COMPLETING",
+                "results": {name: room.game.letter + "abcdef" for name in room.game.get_template_names()}}
+        print("\ncodec     encode phase [us]  encode frame [us]  decode move [us]  frame size [B]")
+        timings = {}
+        for codec in available_codecs():
+            room.invalidate_game_state()
+            room.get_shared_game_state(codec)
+            frame = codec.dumps(move)
+            phase = timeit.timeit(lambda: room.encode_shared_game_state(codec), number=REPEAT) / REPEAT
+            encode = timeit.timeit(lambda: room.get_game_state("player_0", codec), number=REPEAT) / REPEAT
+            decode = timeit.timeit(lambda: decode_move(codec, frame), number=REPEAT) / REPEAT
+            state = room.get_game_state("player_0", codec)
+            size = len(state.encode() if isinstance(state, str) else state)
+            timings[codec.name] = phase + encode + decode
+            print(f"{codec.name:8s}  {phase * 1e6:17.2f}  {encode * 1e6:17.2f}  {decode * 1e6:16.2f}  {size:14d}")
+        if 'orjson' in timings:
+            self.assertLess(timings['orjson'], timings['json'])
+
+
+if __name__ == '__main__':
+    unittest.main()
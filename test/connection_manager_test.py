@@ -0,0 +1,74 @@
+import asyncio
+import random
+import unittest
+
+from app.connection_manager import ConnectionManager
+from app.server_errors import PlayerIdAlreadyInUse
+
+
+class FakeWebSocket:
+    def __init__(self):
+        self.sent = []
+
+    async def accept(self):
+        pass
+
+    async def send_text(self, text):
+        self.sent.append(text)
+
+
+class ConnectionManagerIndexTest(unittest.TestCase):
+    def test_lookups_use_indexes(self):
+        manager = ConnectionManager()
+
+        async def run():
+            websocket = FakeWebSocket()
+            await manager.connect(websocket, "1", "player_1", "nick")
+            connection, room = manager.get_active_connection(websocket)
+            self.assertEqual("player_1", connection.player.id)
+            self.assertIs(room, manager.get_room("1"))
+            self.assertIs(connection, manager.get_connection("1", "player_1"))
+            with self.assertRaises(PlayerIdAlreadyInUse):
+                await manager.connect(FakeWebSocket(), "1", "player_1", "nick")
+
+            await manager.disconnect(websocket)
+            self.assertIsNone(manager.get_active_connection(websocket))
+            await manager.disconnect(websocket)
+
+        asyncio.run(run())
+        self.assertEqual([], manager.check_indexes())
+
+    def test_indexes_stay_consistent_after_churn(self):
+        manager = ConnectionManager()
+        rng = random.Random(4)
+
+        async def run():
+            room_ids = [str(i) for i in range(2, 8)]
+            for room_id in room_ids:
+                await manager.create_new_room(room_id)
+            connected = []
+            for step in range(300):
+                action = rng.random()
+                if action < 0.6 or not connected:
+                    room_id, player_id = rng.choice(room_ids), f"player_{step}"
+                    websocket = FakeWebSocket()
+                    await manager.connect(websocket, room_id, player_id, player_id)
+                    connected.append((websocket, room_id, player_id))
+                elif action < 0.8:
+                    websocket, room_id, player_id = connected.pop(rng.randrange(len(connected)))
+                    await manager.kick_player(room_id, player_id)
+                else:
+                    websocket, room_id, player_id = connected.pop(rng.randrange(len(connected)))
+                    await manager.disconnect(websocket)
+                if step % 100 == 99:
+                    deleted = room_ids.pop()
+                    await manager.delete_room(deleted)
+                    connected = [c for c in connected if c[1] != deleted]
+                self.assertEqual([], manager.check_indexes())
+
+        asyncio.run(run())
+        self.assertEqual([], manager.check_indexes())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,86 @@
+import os
+import random
+import string
+import tempfile
+import time
+import unittest
+
+from app.dictionary import AnswerValidator, WordIndex, build_directory, build_index
+from app.game import Category, Game
+
+
+class WordIndexTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def test_lookup(self):
+        path = os.path.join(self.directory, "city.idx")
+        build_index(["Warszawa", "Łódź", " Gdańsk ", "warszawa", ""], path)
+        index = WordIndex(path)
+
+        self.assertEqual(3, len(index))
+        for word in ["warszawa", "lodz", "gdansk"]:
+            self.assertIn(word.encode(), index)
+        for word in ["", "a", "warszaw", "zzzz"]:
+            self.assertNotIn(word.encode(), index)
+
+    def test_validator_from_word_lists(self):
+        source = os.path.join(self.directory, "lists")
+        os.makedirs(source)
+        with open(os.path.join(source, "City.txt"), "w", encoding="utf-8") as word_list:
+            word_list.write("Warszawa\nŁódź\n")
+        build_directory(source, self.directory)
+        validator = AnswerValidator.from_directory(self.directory)
+
+        self.assertTrue(validator.check("City", "łódź"))
+        self.assertTrue(validator.check("city", "LODZ"))
+        self.assertFalse(validator.check("City", "lodzz"))
+        self.assertIsNone(validator.check("Item", "lodz"))
+        self.assertEqual({}, AnswerValidator.from_directory(os.path.join(self.directory, "missing")).indexes)
+
+    def test_dictionary_verdict_is_weighted_into_legit_score(self):
+        path = os.path.join(self.directory, "city.idx")
+        build_index(["Warszawa"], path)
+        game = Game(validator=AnswerValidator({"City": WordIndex(path)}), dictionary_weight=2)
+        game.letter = "w"
+        game.categories.categories = []
+        for player_id, name, word in [("player_1", "City", "warszawa"), ("player_2", "City", "wxyz"),
+                                      ("player_2", "Item", "wiadro")]:
+            category = Category(name)
+            category.word = word
+            category.player_id = player_id
+            game.categories.append(category)
+        game.votes = {"player_1": {"City": {"wxyz": True}}}
+
+        game.summary_voting()
+
+        legit = {(c.player_id, c.category_name): (c.legit_score, c.is_legit) for c in game.categories.categories}
+        self.assertEqual({("player_1", "City"): (2, True), ("player_2", "City"): (-1, False),
+                          ("player_2", "Item"): (0, True)}, legit)
+
+    def test_lookup_benchmark(self):
+        rng = random.Random(100000)
+        words = ["".join(rng.choice(string.ascii_lowercase) for _ in range(rng.randint(4, 12)))
+                 for _ in range(100000)]
+        path = os.path.join(self.directory, "words.idx")
+        start = time.perf_counter()
+        build_index(words, path)
+        built = time.perf_counter() - start
+        start = time.perf_counter()
+        validator = AnswerValidator({"Words": WordIndex(path)})
+        loaded = time.perf_counter() - start
+
+        queries = rng.sample(words, 5000) + ["".join(rng.choice(string.ascii_lowercase) for _ in range(8))
+                                             for _ in range(5000)]
+        start = time.perf_counter()
+        found = sum(1 for query in queries if validator.check("Words", query))
+        per_lookup = (time.perf_counter() - start) / len(queries)
+
+        print(f"\n100k words: build {built * 1000:.0f} ms, load {loaded * 1000:.2f} ms, "
+              f"lookup {per_lookup * 1e6:.1f} us")
+        self.assertGreaterEqual(found, 5000)
+        self.assertLess(per_lookup, 100e-6)
+
+
+if __name__ == '__main__':
+    unittest.main()
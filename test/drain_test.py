@@ -0,0 +1,124 @@
+import asyncio
+import json
+import multiprocessing
+import os
+import socket
+import tempfile
+import time
+import unittest
+
+import httpx
+
+try:
+    import websockets
+except ImportError:
+    websockets = None
+
+ROUND_TIMEOUT = 2
+RESTORE_GRACE = 2
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def serve(store_path, port):
+    os.environ['ROOM_STORE'] = f"sqlite:///{store_path}"
+    os.environ['ROUND_TIMEOUT'] = str(ROUND_TIMEOUT)
+    os.environ['ROOM_RESTORE_GRACE'] = str(RESTORE_GRACE)
+    import uvicorn
+    uvicorn.run("app.main:app", host="127.0.0.1", port=port, log_level="warning")
+
+
+def start_server(store_path) -> (multiprocessing.Process, int):
+    port = free_port()
+    process = multiprocessing.get_context("spawn").Process(target=serve, args=(store_path, port), daemon=True)
+    process.start()
+    return process, port
+
+
+async def wait_until_ready(port):
+    async with httpx.AsyncClient() as client:
+        for _ in range(200):
+            try:
+                if (await client.get(f"http://127.0.0.1:{port}/")).status_code == 200:
+                    return
+            except httpx.HTTPError:
+                pass
+            await asyncio.sleep(0.05)
+    raise TimeoutError(f"server on port {port} did not start")
+
+
+async def receive_until(ws, game_state, timeout=15) -> dict:
+    deadline = time.monotonic() + timeout
+    while True:
+        message = json.loads(await asyncio.wait_for(ws.recv(), deadline - time.monotonic()))
+        if message["game_state"] == game_state:
+            return message
+
+
+@unittest.skipIf(websockets is None, "websockets is not installed")
+class DrainTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.store_path = os.path.join(self.directory.name, "rooms.db")
+        self.processes = []
+
+    def tearDown(self):
+        for process in self.processes:
+            process.terminate()
+            process.join()
+        self.directory.cleanup()
+
+    def start_server(self) -> int:
+        process, port = start_server(self.store_path)
+        self.processes.append(process)
+        return port
+
+    def test_round_in_progress_moves_to_the_next_server(self):
+        async def run():
+            old_port = self.start_server()
+            await wait_until_ready(old_port)
+            async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{old_port}", timeout=30) as client:
+                self.assertEqual(200, (await client.post("/room/new/migrating")).status_code)
+                players = [await websockets.connect(f"ws://127.0.0.1:{old_port}/ws/migrating/p{i}/nick{i}")
+                           for i in range(2)]
+                for i, ws in enumerate(players):
+                    await receive_until(ws, "COMPLETING")
+                    await ws.send(json.dumps({"gameState": "COMPLETING",
+                                              "results": {"Panstwa": f"answer{i}", "Miasta": "", "Imiona": "",
+                                                          "Rzeczy": "", "Zwierzeta": "", "Rzeki": ""}}))
+
+                drain = asyncio.ensure_future(client.post("/admin/drain"))
+                await asyncio.sleep(0.2)
+                self.assertEqual(503, (await client.post("/room/new/late")).status_code)
+                report = (await drain).json()
+
+            for ws in players:
+                with self.assertRaises(websockets.ConnectionClosed) as closed:
+                    while True:
+                        await ws.recv()
+                self.assertEqual(1012, closed.exception.rcvd.code)
+            print(f"\ndrain report: {report}")
+            self.assertEqual(0, report["rounds_lost"])
+            self.assertEqual(2, report["players"])
+            self.assertLess(report["drain_seconds"], ROUND_TIMEOUT * 1.5 + 2)
+
+            new_port = self.start_server()
+            await wait_until_ready(new_port)
+            players = [await websockets.connect(f"ws://127.0.0.1:{new_port}/ws/migrating/p{i}/nick{i}")
+                       for i in range(2)]
+            score_display = await receive_until(players[0], "SCORE_DISPLAY")
+            words = [result["word"] for result in score_display["game_data"]["results"]["nick0"]["results"]]
+            self.assertIn("answer0", words)
+            for ws in players:
+                await receive_until(ws, "COMPLETING", timeout=RESTORE_GRACE + 5)
+                await ws.close()
+
+        asyncio.run(run())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,182 @@
+import gc
+import json
+import os
+import random
+import string
+import time
+import unittest
+
+from app.connection import Connection
+from app.dictionary import AnswerValidator
+from app.game import DEFAULT_CATEGORIES, Game
+from app.game_state import GameState
+from app.player import Player
+from app.room import Room
+
+PLAYER_COUNTS = (4, 8, 16)
+CATEGORY_COUNTS = (6, 12)
+VOTE_DENSITIES = (0.25, 1.0)
+CATEGORY_NAMES = DEFAULT_CATEGORIES + ["River", "Mountain", "Profession", "Food", "Sport", "Brand"]
+LETTER = "k"
+SEED = 22
+RUNS = int(os.getenv('BENCHMARK_RUNS', 31))
+RETRIES = 2
+# a case regresses when its cost relative to the calibration loop grows by more than this
+REGRESSION_THRESHOLD = float(os.getenv('BENCHMARK_REGRESSION_THRESHOLD', 0.5))
+BASELINE_PATH = os.path.join(os.path.dirname(__file__), 'engine_benchmark_baseline.json')
+UPDATE_BASELINE = os.getenv('BENCHMARK_UPDATE_BASELINE') == '1'
+
+
+def build_game(players: int, categories: int, rng: random.Random) -> Game:
+    names = CATEGORY_NAMES[:categories]
+    game = Game(custom_categories=names, validator=AnswerValidator())
+    game.letter = LETTER
+    game.game_state = GameState.completing
+    # players pick from a few words per category, so there are duplicates to cluster and score
+    pools = {name: [LETTER + "".join(rng.choices(string.ascii_lowercase, k=rng.randint(3, 8)))
+                    for _ in range(players // 2 + 1)] for name in names}
+    for i in range(players):
+        game.submit_answers(f"player_{i}", {name: rng.choice(pools[name]) if rng.random() > 0.1 else ""
+                                            for name in names})
+    return game
+
+
+def cast_votes(game: Game, players: int, density: float, rng: random.Random):
+    candidates = game.get_voting_candidates()
+    for i in range(players):
+        game.votes[f"player_{i}"] = {name: {word: rng.random() < 0.8 for word in words if rng.random() < density}
+                                     for name, words in candidates.items()}
+
+
+def completed_game(players: int, categories: int) -> Game:
+    game = build_game(players, categories, random.Random(f"{SEED}-{players}-{categories}"))
+    game.build_full_categories()
+    return game
+
+
+def voted_game(players: int, categories: int, density: float) -> Game:
+    game = completed_game(players, categories)
+    cast_votes(game, players, density, random.Random(f"{SEED}-{players}-{categories}-{density}"))
+    return game
+
+
+def scored_room(players: int, categories: int, density: float) -> Room:
+    room = Room(room_id="benchmark")
+    for i in range(players):
+        room.active_connections.append(Connection(object(), Player(f"player_{i}", f"nick_{i}", True)))
+    room.game = voted_game(players, categories, density)
+    room.game.summary_voting()
+    room.game.game_state = GameState.score_display
+    return room
+
+
+def calibration(_):
+    # fixed pure python work, the yardstick the engine cases are measured against
+    words = sorted(f"w{i * 7919 % 1009}" for i in range(2000))
+    return {word: len(word) for word in words}
+
+
+def engine_cases():
+    # name -> (setup, timed operation), setup builds fresh input for every run
+    cases = {}
+    for players in PLAYER_COUNTS:
+        for categories in CATEGORY_COUNTS:
+            size = f"players={players},categories={categories}"
+            cases[f"build_full_categories[{size}]"] = (
+                lambda p=players, c=categories: build_game(p, c, random.Random(f"{SEED}-{p}-{c}")),
+                Game.build_full_categories)
+            cases[f"summary_completing[{size}]"] = (
+                lambda p=players, c=categories: completed_game(p, c), Game.summary_completing)
+            cases[f"get_voting_candidates[{size}]"] = (
+                lambda p=players, c=categories: completed_game(p, c), Game.get_voting_candidates)
+            for density in VOTE_DENSITIES:
+                voted = f"{size},votes={density}"
+                cases[f"count_votes[{voted}]"] = (
+                    lambda p=players, c=categories, d=density: voted_game(p, c, d), Game.count_votes)
+                cases[f"summary_voting[{voted}]"] = (
+                    lambda p=players, c=categories, d=density: voted_game(p, c, d), Game.summary_voting)
+                cases[f"get_result[{voted}]"] = (
+                    lambda p=players, c=categories, d=density: scored_room(p, c, d),
+                    lambda room: room.game.get_result(room.get_player_nicks()))
+                cases[f"count_short_results[{voted}]"] = (
+                    lambda p=players, c=categories, d=density: scored_room(p, c, d), Room.count_short_results)
+    return cases
+
+
+def measure(setup, operation, runs: int = RUNS) -> float:
+    # fastest of single runs, each on fresh input and, like timeit, with the garbage collector off:
+    # slower runs measure what else the machine was doing
+    samples = []
+    gc.collect()
+    for _ in range(runs):
+        state = setup()
+        gc.disable()
+        try:
+            start = time.perf_counter()
+            operation(state)
+            samples.append(time.perf_counter() - start)
+        finally:
+            gc.enable()
+    return min(samples)
+
+
+def load_baseline() -> dict:
+    try:
+        with open(BASELINE_PATH) as baseline:
+            return json.load(baseline)
+    except FileNotFoundError:
+        return {}
+
+
+class EngineCasesTest(unittest.TestCase):
+    def test_cases_are_deterministic(self):
+        first, second = scored_room(8, 12, 0.25), scored_room(8, 12, 0.25)
+        self.assertEqual(first.game.get_result(first.get_player_nicks()),
+                         second.game.get_result(second.get_player_nicks()))
+        self.assertEqual(first.count_short_results(), second.count_short_results())
+        self.assertEqual(voted_game(4, 6, 1.0).votes, voted_game(4, 6, 1.0).votes)
+
+
+@unittest.skipUnless(os.getenv('ENGINE_BENCHMARK'), "wall clock timings, set ENGINE_BENCHMARK=1 to run")
+class EngineBaselineTest(unittest.TestCase):
+    def test_engine_against_baseline(self):
+        cases = engine_cases()
+        baseline = load_baseline().get("cases", {})
+        seconds = {}
+
+        def relative_cost(name: str) -> float:
+            # the calibration is measured next to every case, the speed of shared machines drifts during a run
+            unit = measure(lambda: None, calibration)
+            seconds[name] = measure(*cases[name])
+            return seconds[name] / unit
+
+        relative = {name: relative_cost(name) for name in cases}
+        regressions = {}
+        for name, cost in relative.items():
+            # measured up to RETRIES more times before it counts, a slow run is usually noise
+            for _ in range(RETRIES):
+                if name not in baseline or cost <= baseline[name] * (1 + REGRESSION_THRESHOLD):
+                    break
+                cost = relative[name] = min(cost, relative_cost(name))  # seconds are the ones of the rerun
+            else:
+                if name in baseline and cost > baseline[name] * (1 + REGRESSION_THRESHOLD):
+                    regressions[name] = cost / baseline[name]
+
+        print(f"\n{'case':70s} {'us':>9s} {'relative':>9s} {'vs baseline':>12s}")
+        for name, cost in relative.items():
+            versus = f"{cost / baseline[name]:11.2f}x" if name in baseline else f"{'new':>12s}"
+            print(f"{name:70s} {seconds[name] * 1e6:9.1f} {cost:9.3f} {versus}")
+
+        if UPDATE_BASELINE:
+            with open(BASELINE_PATH, "w") as baseline_file:
+                json.dump({"cases": {name: round(cost, 4) for name, cost in relative.items()}}, baseline_file,
+                          indent=2, sort_keys=True)
+                baseline_file.write("\n")
+        else:
+            self.assertEqual({}, regressions,
+                             f"slower than the baseline by more than {REGRESSION_THRESHOLD:.0%}, "
+                             f"rerun with BENCHMARK_UPDATE_BASELINE=1 if that is expected")
+
+
+if __name__ == '__main__':
+    unittest.main()
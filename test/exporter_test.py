@@ -0,0 +1,139 @@
+import asyncio
+import json
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import httpx
+
+from tools import export_stub
+from app.exporter import Exporter
+
+
+def stub_exporter(**kwargs):
+    return Exporter(base_url="http://export-stub", backoff=0.001,
+                    transport=httpx.ASGITransport(app=export_stub.app), **kwargs)
+
+
+class ExporterTest(unittest.TestCase):
+    def setUp(self):
+        export_stub.received["scores"].clear()
+        export_stub.received["room_statuses"].clear()
+        export_stub.failures["remaining"] = 0
+        self.spill_path = os.path.join(tempfile.mkdtemp(), "spill.jsonl")
+
+    def test_room_statuses_are_coalesced(self):
+        exporter = stub_exporter(spill_path=self.spill_path)
+
+        async def run():
+            exporter.submit_room_status("1", ["a"])
+            exporter.submit_room_status("1", ["a", "b"])
+            exporter.submit_room_status("2", ["c"])
+            exporter.submit_room_status("1", ["a", "b", "c"])
+            await exporter.close()
+
+        asyncio.run(run())
+        self.assertEqual([{"roomId": "1", "activePlayers": ["a", "b", "c"]},
+                          {"roomId": "2", "activePlayers": ["c"]}], export_stub.received["room_statuses"])
+        self.assertEqual(2, exporter.get_stats()["coalesced"])
+
+    def test_scores_are_sent_in_batches(self):
+        exporter = stub_exporter(spill_path=self.spill_path, batch_size=4)
+
+        async def run():
+            for room_id in range(10):
+                exporter.submit_score(str(room_id), [{"playerId": "a", "score": room_id}])
+            await exporter.close()
+
+        asyncio.run(run())
+        self.assertEqual(10, len(export_stub.received["scores"]))
+        self.assertEqual(10, exporter.get_stats()["sent"])
+        self.assertEqual(0, exporter.queue_depth)
+
+    def test_failed_post_is_retried(self):
+        exporter = stub_exporter(spill_path=self.spill_path)
+        export_stub.failures["remaining"] = 2
+
+        async def run():
+            exporter.submit_score("1", [])
+            await exporter.close()
+
+        asyncio.run(run())
+        self.assertEqual([{"roomId": "1", "results": []}], export_stub.received["scores"])
+        self.assertEqual(2, exporter.get_stats()["retried"])
+
+    def test_retry_does_not_hold_up_the_batch(self):
+        exporter = stub_exporter(spill_path=self.spill_path)
+        exporter.backoff = 0.5
+        export_stub.failures["remaining"] = 1
+
+        async def run():
+            for room_id in range(3):
+                exporter.submit_score(str(room_id), [])
+            await asyncio.sleep(0.2)
+            delivered_before_retry = len(export_stub.received["scores"])
+            await exporter.close()
+            return delivered_before_retry
+
+        self.assertEqual(2, asyncio.run(run()))
+        self.assertEqual(3, len(export_stub.received["scores"]))
+        self.assertEqual(1, exporter.get_stats()["retried"])
+
+    def test_base_url_is_read_when_the_worker_starts(self):
+        exporter = Exporter(transport=httpx.ASGITransport(app=export_stub.app), spill_path=self.spill_path)
+
+        async def run():
+            exporter.submit_score("1", [])
+            await exporter.close()
+
+        with mock.patch.dict(os.environ, {"EXPORT_RESULTS_URL": "http://export-stub"}):
+            asyncio.run(run())
+        self.assertEqual([{"roomId": "1", "results": []}], export_stub.received["scores"])
+
+    def test_overflow_and_exhausted_retries_are_spilled(self):
+        exporter = stub_exporter(spill_path=self.spill_path, max_queue=2, max_retries=0)
+
+        for room_id in range(3):
+            exporter.submit_score(str(room_id), [])
+        self.assertEqual(2, exporter.queue_depth)
+
+        export_stub.failures["remaining"] = 1
+
+        async def run():
+            await exporter.close()
+
+        asyncio.run(run())
+        with open(self.spill_path) as spill_file:
+            spilled = [json.loads(line) for line in spill_file]
+        self.assertEqual(["2", "0"], [line["payload"]["roomId"] for line in spilled])
+        self.assertEqual([{"roomId": "1", "results": []}], export_stub.received["scores"])
+
+    def test_unexpected_error_only_fails_its_own_export(self):
+        delivered = []
+
+        def handler(request):
+            payload = json.loads(request.content)
+            if payload["roomId"] == "bad":
+                raise ValueError("not an HTTP error")
+            delivered.append(payload["roomId"])
+            return httpx.Response(200, json={})
+
+        exporter = Exporter(base_url="http://results", backoff=0.001, max_retries=1, spill_path=self.spill_path,
+                            transport=httpx.MockTransport(handler))
+
+        async def run():
+            for room_id in ["1", "bad", "2"]:
+                exporter.submit_score(room_id, [])
+            await exporter.close()
+            exporter.submit_score("3", [])
+            await exporter.close()
+
+        asyncio.run(run())
+        self.assertEqual(["1", "2", "3"], delivered)
+        with open(self.spill_path) as spill_file:
+            self.assertEqual(["bad"], [json.loads(line)["payload"]["roomId"] for line in spill_file])
+
+
+if __name__ == '__main__':
+    unittest.main()
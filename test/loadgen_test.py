@@ -0,0 +1,39 @@
+import asyncio
+import random
+import unittest
+
+from tools import loadgen
+
+
+class WordPoolTest(unittest.TestCase):
+    def test_answers_start_with_the_letter_and_repeat_across_players(self):
+        words = loadgen.WordPool(seed=1)
+        players = [random.Random(i) for i in range(20)]
+        answers = [words.answer(rng, "City", "k") for rng in players]
+        self.assertTrue(all(answer == '' or answer.startswith("K") for answer in answers))
+        self.assertLess(len(set(answers)), len(answers))
+        self.assertEqual(words.words("City", "k"), loadgen.WordPool(seed=1).words("City", "k"))
+
+
+class ParseMetricsTest(unittest.TestCase):
+    def test_labelled_and_plain_samples(self):
+        samples = loadgen.parse_metrics('# TYPE panstwa_rooms gauge\n'
+                                        'panstwa_rooms{phase="VOTING"} 3.0\n'
+                                        'panstwa_ws_messages_total 12.0\n')
+        self.assertEqual({'panstwa_rooms{phase="VOTING"}': 3.0, 'panstwa_ws_messages_total': 12.0}, samples)
+
+
+@unittest.skipIf(loadgen.websockets is None, "needs the websockets package")
+class LoadTest(unittest.TestCase):
+    def test_bots_play_a_round_against_a_local_server(self):
+        report = asyncio.run(loadgen.run_local(round_timeout=3, rooms=2, players=3, rounds=1, ramp=0.1))
+        print(report)
+        self.assertEqual(6, report["rounds_played"])
+        self.assertEqual({}, report["errors"])
+        self.assertEqual(12, report["phase_transition"]["count"])
+        self.assertEqual(report["messages_sent"], report["server_messages_handled"])
+        self.assertGreater(report["rss_mb"], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,107 @@
+import asyncio
+import io
+import json
+import logging
+import unittest
+from logging.handlers import QueueHandler
+
+from app import logs
+from app.connection import Connection
+from app.game_state import GameState
+from app.player import Player
+from app.protocol import PlayerMove
+from app.room import Room
+from app.scheduler import PhaseScheduler
+
+
+class CountingArgument:
+    def __init__(self):
+        self.formatted = 0
+
+    def __str__(self):
+        self.formatted += 1
+        return "argument"
+
+
+class StructuredLoggingTest(unittest.TestCase):
+    def setUp(self):
+        self.root_level = logging.getLogger().level
+        self.stream = io.StringIO()
+        self.listener = logs.setup_logging(level='INFO', log_format='json', stream=self.stream)
+
+    def tearDown(self):
+        logs.stop_logging(self.listener)
+        root = logging.getLogger()
+        for handler in [h for h in root.handlers if isinstance(h, QueueHandler)]:
+            root.removeHandler(handler)
+        root.setLevel(self.root_level)
+        logs.tracing.disable("traced")
+
+    def records(self):
+        logs.stop_logging(self.listener)
+        self.listener = None
+        return [json.loads(line) for line in self.stream.getvalue().splitlines()]
+
+    def test_debug_is_only_emitted_for_traced_rooms(self):
+        logs.tracing.enable("traced")
+        rooms = [Room(room_id="traced"), Room(room_id="quiet")]
+        for room in rooms:
+            room.game_id = f"game-{room.id}"
+            room.game.game_state = GameState.completing
+            room.handle_players_move("player_1", PlayerMove("COMPLETING", delta={"City": "Oslo"}))
+        logging.getLogger("app.test").info("round of %s", "traced")
+
+        records = self.records()
+        self.assertEqual(2, len(records))
+        move, info = records
+        self.assertEqual(("DEBUG", "app.room", "traced", "game-traced", "COMPLETING"),
+                         (move["level"], move["logger"], move["room_id"], move["game_id"], move["phase"]))
+        self.assertIn("player_1", move["message"])
+        # the room is only bound while its move is handled
+        self.assertEqual(("INFO", "round of traced"), (info["level"], info["message"]))
+        self.assertNotIn("room_id", info)
+
+    def test_timers_do_not_carry_the_room_that_armed_them(self):
+        scheduler = PhaseScheduler()
+        first, second = Room(room_id="first", scheduler=scheduler), Room(room_id="second", scheduler=scheduler)
+        second.reconnect_grace = 0.02
+        connection = Connection(None, Player("player_1", "nick", True))
+        second.active_connections.append(connection)
+
+        async def fired():
+            logging.getLogger("app.test").info("fired")
+
+        async def run():
+            with logs.bind_room(first):
+                scheduler.schedule(("first",), 0.01, fired)
+            second.expect_reconnect(connection)
+            await asyncio.sleep(0.05)
+            await asyncio.gather(*scheduler.tasks)
+
+        asyncio.run(run())
+        records = {record["message"]: record for record in self.records()}
+        self.assertNotIn("room_id", records["fired"])
+        self.assertEqual("second", records["player player_1 did not reconnect to room second"]["room_id"])
+
+    def test_untraced_debug_is_not_formatted(self):
+        argument = CountingArgument()
+        with logs.bind_room(Room(room_id="quiet")):
+            logs.debug(logging.getLogger("app.test"), "value %s", argument)
+        self.assertEqual(0, argument.formatted)
+        logging.getLogger("app.test").warning("value %s", argument)
+        self.assertEqual(["value argument"], [record["message"] for record in self.records()])
+
+    def test_http_requests_are_not_logged_at_info(self):
+        logging.getLogger("httpx").info("HTTP Request: POST http://results/ \"HTTP/1.1 200 OK\"")
+        logging.getLogger("httpx").warning("retrying")
+        self.assertEqual(["retrying"], [record["message"] for record in self.records()])
+
+    def test_room_sample_is_stable(self):
+        tracing = logs.RoomTracing(sample_rate=0.25)
+        sampled = [room_id for room_id in map(str, range(2000)) if tracing.is_traced(room_id)]
+        self.assertAlmostEqual(500, len(sampled), delta=75)
+        self.assertEqual(sampled, [room_id for room_id in map(str, range(2000)) if tracing.is_traced(room_id)])
+
+
+if __name__ == '__main__':
+    unittest.main()
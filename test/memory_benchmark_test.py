@@ -0,0 +1,62 @@
+import os
+import random
+import sys
+import time
+import tracemalloc
+import unittest
+from datetime import datetime
+
+from app.connection import Connection
+from app.game import Category
+from app.game_state import GameState
+from app.player import Player
+from app.room import Room
+
+ROOMS = int(os.getenv('BENCHMARK_ROOMS', 5000))
+PLAYERS_PER_ROOM = int(os.getenv('BENCHMARK_PLAYERS_PER_ROOM', 4))
+
+
+def build_mid_round_room(room_id: str, rng: random.Random) -> Room:
+    room = Room(room_id=room_id)
+    for i in range(PLAYERS_PER_ROOM):
+        player_id = f"{room_id}_player_{i}"
+        room.active_connections.append(Connection(object(), Player(player_id, f"nick_{i}", True)))
+    room.game.game_state = GameState.completing
+    for connection in room.active_connections:
+        room.game.temporary_categories[connection.player.id] = {
+            name: room.game.letter + "".join(rng.choice("abcdefghijklmnop") for _ in range(rng.randint(3, 9)))
+            for name in room.game.get_template_names()}
+    room.game.build_full_categories()
+    room.game.summary_completing()
+    room.game.game_state = GameState.voting
+    room.timestamp = datetime.now()
+    return room
+
+
+class MemoryBenchmarkTest(unittest.TestCase):
+    def test_answer_objects_have_no_instance_dict(self):
+        for instance in [Category("Country"), Player("id", "nick", True), Connection(object(), None)]:
+            self.assertFalse(hasattr(instance, '__dict__'))
+
+    def test_memory_of_rooms_in_mid_round(self):
+        rng = random.Random(5000)
+        tracemalloc.start()
+        start = time.perf_counter()
+        baseline, _ = tracemalloc.get_traced_memory()
+        rooms = [build_mid_round_room(str(i), rng) for i in range(ROOMS)]
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        per_room = (current - baseline) / ROOMS
+        print(f"\n{ROOMS} rooms x {PLAYERS_PER_ROOM} players in VOTING: "
+              f"{(current - baseline) / 2 ** 20:.1f} MiB ({per_room / 1024:.1f} KiB per room, "
+              f"peak {(peak - baseline) / 2 ** 20:.1f} MiB), built in {time.perf_counter() - start:.1f}s")
+        print(f"Category {sys.getsizeof(Category('Country'))} B, "
+              f"Player {sys.getsizeof(Player('id', 'nick', True))} B, "
+              f"Connection {sys.getsizeof(Connection(object(), None))} B")
+        self.assertEqual(ROOMS, len(rooms))
+        self.assertLess(per_room, 64 * 1024)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,66 @@
+import asyncio
+import json
+import unittest
+
+from app import metrics
+from app.connection_manager import ConnectionManager
+from app.game_state import GameState
+from app.metrics import Histogram, Registry
+
+
+class FakeWebSocket:
+    async def accept(self):
+        pass
+
+    async def send_text(self, text):
+        pass
+
+    async def close(self, code=1000):
+        pass
+
+
+class HistogramTest(unittest.TestCase):
+    def test_buckets_are_cumulative(self):
+        histogram = Histogram('latency_seconds', 'Latency', buckets=(0.1, 1.0))
+        for value in (0.05, 0.1, 0.5, 3.0):
+            histogram.observe(value)
+        self.assertEqual(['# HELP latency_seconds Latency',
+                          '# TYPE latency_seconds histogram',
+                          'latency_seconds_bucket{le="0.1"} 2',
+                          'latency_seconds_bucket{le="1.0"} 3',
+                          'latency_seconds_bucket{le="+Inf"} 4',
+                          'latency_seconds_sum 3.65',
+                          'latency_seconds_count 4'], histogram.render())
+
+
+class ManagerMetricsTest(unittest.TestCase):
+    def test_rooms_players_and_messages(self):
+        manager = ConnectionManager()
+        registry = Registry()
+        registry.add_collector(manager.collect_metrics)
+        received = metrics.ws_messages.value
+        observed = metrics.ws_message_seconds.count
+
+        async def run():
+            await manager.create_new_room("metrics")
+            for player_id in ("a", "b"):
+                await manager.connect(FakeWebSocket(), "metrics", player_id, player_id)
+            manager.get_room("metrics").game.game_state = GameState.completing
+            await manager.handle_ws_message(json.dumps({"gameState": "COMPLETING", "delta": {"City": "Oslo"}}),
+                                            "metrics", "a")
+            await manager.handle_ws_message('["not", "an", "object"]', "metrics", "a")
+            await manager.disconnect(manager.get_connection("metrics", "b").ws)
+
+        asyncio.run(run())
+        lines = registry.render().splitlines()
+        self.assertIn('panstwa_rooms{phase="COMPLETING"} 1.0', lines)
+        self.assertIn('panstwa_rooms{phase="VOTING"} 0.0', lines)
+        self.assertIn('panstwa_players{state="connected"} 1.0', lines)
+        self.assertIn('panstwa_players{state="suspended"} 1.0', lines)
+        self.assertIn('panstwa_ws_messages_rejected_total{reason="malformed"} 1.0', lines)
+        self.assertEqual(received + 2, metrics.ws_messages.value)
+        self.assertEqual(observed + 2, metrics.ws_message_seconds.count)
+
+
+if __name__ == '__main__':
+    unittest.main()
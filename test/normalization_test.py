@@ -0,0 +1,71 @@
+import random
+import time
+import unittest
+
+from app.normalization import normalize_answer, normalize_answers, normalize_text
+
+ANSWERS = ["Warszawa", "Wrocław", "Łódź", "Gdańsk", "Poznań", "Żyrardów", "Zielona Góra", "Bielsko-Biała",
+           "Polska", "Niemcy", "Włochy", "Węgry", "żubr", "źrebak", "jeż", "łoś", "żółw", "pomidor", "słonecznik",
+           "Małgorzata", "Jędrzej", "Zbigniew", "Świętokrzyskie", "ogórek", "kotwica", "łódka", "śruba"]
+
+
+def previous_normalization(answer: str) -> str:
+    return answer.strip(' ').strip('\u200b').strip(' ').lower()
+
+
+def realistic_inputs(count: int, rng: random.Random):
+    inputs = []
+    for _ in range(count):
+        answer = rng.choice(ANSWERS)
+        if rng.random() < 0.3:
+            answer = answer.upper() if rng.random() < 0.5 else answer.lower()
+        if rng.random() < 0.3:
+            answer = " " + answer + "\u200b "
+        inputs.append(answer)
+    return inputs
+
+
+class NormalizationTest(unittest.TestCase):
+    def test_normalizing_answers(self):
+        self.assertEqual("zielona góra", normalize_answer(" \u200bZielona  \u200dGóra\ufeff "))
+        self.assertEqual("warszawa", normalize_answer("Ｗarszawa"))
+        self.assertEqual("zolw", normalize_answer("Żółw", fold_diacritics=True))
+        self.assertEqual("lodz", normalize_answer("ŁÓDŹ", fold_diacritics=True))
+        self.assertEqual("łódź", normalize_answer("ŁÓDŹ", fold_diacritics=False))
+        self.assertEqual("", normalize_answer(None))
+        self.assertEqual("", normalize_answer(["list"]))
+
+    def test_normalizing_players_move(self):
+        self.assertEqual({"City": "łódź", "Name": ""}, normalize_answers({"City": " Łódź", "Name": 3}))
+        self.assertEqual({}, normalize_answers(["City"]))
+
+    def test_matches_previous_chain_on_plain_answers(self):
+        for answer in realistic_inputs(1000, random.Random(10)):
+            self.assertEqual(previous_normalization(answer), normalize_answer(answer))
+
+    def test_benchmark_against_previous_chain(self):
+        inputs = realistic_inputs(20000, random.Random(11))
+        normalize_text.cache_clear()
+
+        start = time.perf_counter()
+        for answer in inputs:
+            previous_normalization(answer)
+        previous = time.perf_counter() - start
+
+        start = time.perf_counter()
+        for answer in inputs:
+            normalize_answer(answer, fold_diacritics=True)
+        cached = time.perf_counter() - start
+
+        start = time.perf_counter()
+        for answer in inputs:
+            normalize_text.__wrapped__(answer, True)
+        uncached = time.perf_counter() - start
+
+        print(f"\n{len(inputs)} answers: strip chain {previous * 1000:.2f} ms, "
+              f"pipeline uncached {uncached * 1000:.2f} ms, pipeline cached {cached * 1000:.2f} ms")
+        self.assertLess(cached, uncached)
+
+
+if __name__ == '__main__':
+    unittest.main()
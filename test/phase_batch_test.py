@@ -0,0 +1,154 @@
+import asyncio
+import gc
+import random
+import string
+import time
+import unittest
+
+from app.connection import Connection
+from app.game import Game
+from app.game_state import GameState
+from app.phase_batch import PhaseBatcher
+from app.player import Player
+from app.room import Room
+from app.scheduler import PhaseScheduler
+
+CATEGORY_NAMES = ["Panstwo", "Miasto", "Rzeka", "Zwierze", "Imie", "Rzecz", "Roslina", "Zawod"]
+PLAYERS = 8
+
+
+class FakeWebSocket:
+    def __init__(self):
+        self.sent = []
+
+    async def send_text(self, text):
+        self.sent.append(text)
+
+
+def voting_game(seed: int) -> Game:
+    rng = random.Random(seed)
+    game = Game(custom_categories=CATEGORY_NAMES)
+    game.letter = "k"
+    game.game_state = GameState.completing
+    for i in range(PLAYERS):
+        game.submit_answers(f"player_{i}", {name: "k" + "".join(rng.choices(string.ascii_lowercase[:6], k=5))
+                                            for name in CATEGORY_NAMES})
+    game.build_full_categories()
+    for i in range(PLAYERS):
+        game.votes[f"player_{i}"] = {name: {word: rng.random() < 0.7 for word in words}
+                                     for name, words in game.get_voting_candidates().items()}
+    game.game_state = GameState.voting
+    return game
+
+
+def voting_room(seed: int, scheduler: PhaseScheduler, batcher) -> Room:
+    room = Room(room_id=f"room_{seed}", scheduler=scheduler, phase_batcher=batcher)
+    room.game_id = str(seed)
+    for i in range(PLAYERS):
+        room.active_connections.append(Connection(FakeWebSocket(), Player(f"player_{i}", f"nick_{i}", True)))
+    room.game = voting_game(seed)
+    return room
+
+
+class PhaseBatcherTest(unittest.TestCase):
+    def test_rooms_due_together_end_their_phase_in_one_batch_without_stalling_the_loop(self):
+        batcher = PhaseBatcher(window=0.01, budget=0.01)
+        scheduler = PhaseScheduler()
+        gaps = []
+
+        async def run():
+            rooms = [voting_room(seed, scheduler, batcher) for seed in range(120)]
+            for room in rooms:
+                room.restart_timer(0.05)
+            last = time.perf_counter()
+            while any(room.game.game_state is GameState.voting for room in rooms) or batcher.tasks:
+                await asyncio.sleep(0)
+                now = time.perf_counter()
+                gaps.append(now - last)
+                last = now
+            for room in rooms:
+                await room.drain()
+                scheduler.cancel(room.id)
+            return rooms
+
+        gc.disable()  # a full collection of the test run's heap would show up as a gap of its own
+        try:
+            rooms = asyncio.run(run())
+        finally:
+            gc.enable()
+        self.assertTrue(all(room.game.game_state is GameState.score_display for room in rooms))
+        self.assertTrue(all(connection.ws.sent for room in rooms for connection in room.active_connections))
+        self.assertEqual((1, 120), (batcher.batches, batcher.rooms))
+        # about 0.1s of scoring and broadcasts, spread over slices of about the budget
+        self.assertGreater(batcher.yields, 4)
+        self.assertLess(max(gaps), 0.06)
+
+    def test_stale_rooms_are_skipped(self):
+        batcher = PhaseBatcher(window=0.01)
+        scheduler = PhaseScheduler()
+
+        async def run():
+            room = voting_room(1, scheduler, batcher)
+            room.restart_timer(0)
+            await asyncio.sleep(0.005)
+            room.game = Game()  # the game ended before the batch ran
+            await asyncio.sleep(0.02)
+            await asyncio.gather(*batcher.tasks)
+            return room
+
+        room = asyncio.run(run())
+        self.assertIs(GameState.lobby, room.game.game_state)
+        self.assertIsNone(scheduler.deadline(room.id))
+        self.assertEqual((1, 1), (batcher.batches, batcher.rooms))
+
+    def test_pool_scores_like_the_loop(self):
+        batcher = PhaseBatcher(window=0.01, pool_workers=1, pool_min_batch=2)
+        scheduler = PhaseScheduler()
+
+        async def run():
+            pooled = [voting_room(seed, scheduler, batcher) for seed in range(3)]
+            local = [voting_room(seed, PhaseScheduler(), None) for seed in range(3)]
+            try:
+                for room in pooled:
+                    room.restart_timer(0)
+                for room in local:
+                    await room.next_stage()
+                while any(room.game.game_state is GameState.voting for room in pooled) or batcher.tasks:
+                    await asyncio.sleep(0.01)
+            finally:
+                await batcher.close()
+            for room in pooled + local:
+                room.scheduler.cancel(room.id)
+            return pooled, local
+
+        pooled, local = asyncio.run(run())
+        self.assertIsNone(batcher.pool)
+        self.assertEqual(3, batcher.pooled)
+        for pooled_room, local_room in zip(pooled, local):
+            self.assertIs(GameState.score_display, pooled_room.game.game_state)
+            self.assertEqual(local_room.game.get_result(local_room.get_player_nicks()),
+                             pooled_room.game.get_result(pooled_room.get_player_nicks()))
+            self.assertEqual(local_room.count_short_results(), pooled_room.count_short_results())
+
+    def test_close_ends_the_phases_already_due(self):
+        batcher = PhaseBatcher(window=10)
+        scheduler = PhaseScheduler()
+
+        async def run():
+            rooms = [voting_room(seed, scheduler, batcher) for seed in range(3)]
+            for room in rooms:
+                room.restart_timer(0)
+            await asyncio.sleep(0.01)
+            await batcher.close()
+            for room in rooms:
+                await room.drain()
+                scheduler.cancel(room.id)
+            return rooms
+
+        rooms = asyncio.run(run())
+        self.assertTrue(all(room.game.game_state is GameState.score_display for room in rooms))
+        self.assertEqual((1, 3, set()), (batcher.batches, batcher.rooms, batcher.tasks))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,107 @@
+import asyncio
+import json
+import unittest
+from datetime import datetime
+
+from app.connection import Connection
+from app.game import Game
+from app.game_state import GameState
+from app.player import Player
+from app.protocol import JsonCodec, MSGPACK_SUBPROTOCOL, decode_move, json_codec, msgpack_codec, negotiate, \
+    parse_move
+from app.room import Room
+from app.server_errors import InvalidMove
+
+
+class FakeWebSocket:
+    def __init__(self):
+        self.sent = []
+
+    async def send_text(self, text):
+        self.sent.append(text)
+
+    async def send_bytes(self, data):
+        self.sent.append(data)
+
+
+class ParseMoveTest(unittest.TestCase):
+    def test_valid_moves(self):
+        move = parse_move({"gameState": "COMPLETING", "results": {"City": "Oslo", "Animal": None}})
+        self.assertEqual(("COMPLETING", {"City": "Oslo", "Animal": None}, None),
+                         (move.game_state, move.results, move.delta))
+        move = parse_move({"gameState": "COMPLETING", "delta": {"City": "Oslo"}})
+        self.assertEqual({"City": "Oslo"}, move.delta)
+        move = parse_move({"gameState": "VOTING", "results": {"City": {"oslo": True, "osl": False}}})
+        self.assertEqual({"City": {"oslo": True, "osl": False}}, move.results)
+        self.assertEqual({}, parse_move({"gameState": "LOBBY", "results": {}}).results)
+
+    def test_null_vote_does_not_reject_the_others(self):
+        game = Game(custom_categories=["City"])
+        game.letter = "o"
+        for player_id, city in [("a", "Oslo"), ("b", "Opole"), ("c", "Oslo")]:
+            game.submit_answers(player_id, {"City": city})
+        game.build_full_categories()
+        move = parse_move({"gameState": "VOTING", "results": {"City": {"oslo": True, "opole": None}}})
+        game.votes["a"] = move.results
+        game.count_votes()
+        scores = {category.word: category.legit_score for category in game.categories.filter_by_category("City")
+                  if category.player_id is not None}
+        self.assertEqual({"oslo": 1, "opole": 0}, scores)
+
+    def test_malformed_moves_are_rejected(self):
+        for message in [[], "COMPLETING", {"results": {}}, {"gameState": "PLAYING", "results": {}},
+                        {"gameState": "COMPLETING"},
+                        {"gameState": "COMPLETING", "results": {}, "delta": {}},
+                        {"gameState": "COMPLETING", "results": {"City": 5}},
+                        {"gameState": "COMPLETING", "results": ["Oslo"]},
+                        {"gameState": "VOTING", "results": {"City": {"oslo": "yes"}}},
+                        {"gameState": "VOTING", "results": {"City": True}},
+                        {"gameState": "VOTING", "delta": {"City": "oslo"}},
+                        {"gameState": "SCORE_DISPLAY", "results": None}]:
+            with self.assertRaises(InvalidMove, msg=message):
+                parse_move(message)
+        with self.assertRaises(InvalidMove):
+            decode_move(json_codec, '{"gameState": ')
+
+
+class CodecTest(unittest.TestCase):
+    def build_room(self) -> Room:
+        room = Room(room_id="codec")
+        for i, codec in enumerate([json_codec, JsonCodec(), msgpack_codec]):
+            if codec is not None:
+                room.active_connections.append(
+                    Connection(FakeWebSocket(), Player(f"player_{i}", f"nick_{i} ł", True), codec=codec))
+        room.game.game_state = GameState.completing
+        room.timestamp = datetime.now()
+        return room
+
+    def test_every_codec_encodes_the_same_state(self):
+        room = self.build_room()
+
+        async def broadcast():
+            await room.broadcast_json()
+            await room.drain()
+
+        asyncio.run(broadcast())
+        expected = None
+        for connection in room.active_connections:
+            frame = connection.ws.sent[-1]
+            self.assertEqual(room.get_game_state(connection.player.id, connection.codec), frame)
+            message = connection.codec.loads(frame)
+            self.assertEqual(["game_state", "nicks", "timestamp", "game_data"], list(message))
+            self.assertEqual(room.get_enemies_nicks(connection.player.id), message["nicks"])
+            del message["nicks"]
+            expected = expected or message
+            self.assertEqual(expected, message)
+        self.assertEqual(json.loads(JsonCodec().dumps(expected)), expected)
+
+    @unittest.skipIf(msgpack_codec is None, "msgpack is not installed")
+    def test_msgpack_is_negotiated_by_subprotocol(self):
+        self.assertIs(msgpack_codec, negotiate(["something", MSGPACK_SUBPROTOCOL]))
+        self.assertIs(json_codec, negotiate([]))
+        move = decode_move(msgpack_codec, msgpack_codec.dumps({"gameState": "COMPLETING", "delta": {"City": "Oslo"}}))
+        self.assertEqual({"City": "Oslo"}, move.delta)
+
+
+if __name__ == '__main__':
+    unittest.main()
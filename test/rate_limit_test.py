@@ -0,0 +1,82 @@
+import asyncio
+import json
+import unittest
+
+from app.connection_manager import ConnectionManager
+from app.rate_limit import MAX_FRAME_SIZE, MAX_VIOLATIONS, MESSAGE_BURST, TokenBucket
+
+
+class FakeWebSocket:
+    def __init__(self):
+        self.sent = []
+        self.close_code = None
+
+    async def accept(self):
+        pass
+
+    async def send_text(self, text):
+        self.sent.append(text)
+
+    async def close(self, code=1000):
+        self.close_code = code
+
+
+MOVE = json.dumps({"gameState": "COMPLETING", "delta": {"City": "Oslo"}})
+
+
+class TokenBucketTest(unittest.TestCase):
+    def test_burst_then_rate(self):
+        bucket = TokenBucket(rate=2, burst=3)
+        now = bucket.updated
+        self.assertEqual([True, True, True, False], [bucket.allow(now) for _ in range(4)])
+        self.assertFalse(bucket.allow(now + 0.4))
+        self.assertTrue(bucket.allow(now + 0.5))
+        self.assertEqual(3, sum(bucket.allow(now + 100) for _ in range(5)))
+
+
+class EdgeLimitTest(unittest.TestCase):
+    def setUp(self):
+        self.manager = ConnectionManager()
+
+    async def join(self, room_id: str, player_id: str) -> FakeWebSocket:
+        websocket = FakeWebSocket()
+        await self.manager.connect(websocket, room_id, player_id, player_id)
+        return websocket
+
+    def test_flooding_connection_is_kicked_without_touching_other_rooms(self):
+        async def run():
+            await self.manager.create_new_room("flooded")
+            await self.manager.create_new_room("quiet")
+            bot = await self.join("flooded", "bot")
+            await self.join("flooded", "victim")
+            await self.join("quiet", "player")
+            for _ in range(int(MESSAGE_BURST) + MAX_VIOLATIONS):
+                await self.manager.handle_ws_message(MOVE, "flooded", "bot")
+            await self.manager.handle_ws_message(MOVE, "quiet", "player")
+            return bot
+
+        bot = asyncio.run(run())
+        self.assertEqual(1008, bot.close_code)
+        self.assertEqual(["victim"], self.manager.get_room("flooded").get_players_in_game_ids())
+        self.assertEqual({"rate_limited": MAX_VIOLATIONS, "kicked": 1}, self.manager.rejected)
+        self.assertEqual([], self.manager.check_indexes())
+
+    def test_oversized_and_malformed_frames(self):
+        async def run():
+            await self.manager.create_new_room("edge")
+            player = await self.join("edge", "player")
+            await self.join("edge", "other")
+            await self.manager.handle_ws_message('["not", "an", "object"]', "edge", "player")
+            await self.manager.handle_ws_message('{"gameState": "COMPLETING", "results": []}', "edge", "player")
+            self.assertIsNone(player.close_code)
+            await self.manager.handle_ws_message(" " * (MAX_FRAME_SIZE + 1), "edge", "player")
+            return player
+
+        player = asyncio.run(run())
+        self.assertEqual(1008, player.close_code)
+        self.assertEqual({"malformed": 2, "frame_too_large": 1, "kicked": 1}, self.manager.rejected)
+        self.assertEqual(["other"], self.manager.get_room("edge").get_players_in_game_ids())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,104 @@
+import asyncio
+import unittest
+from unittest import mock
+
+from app.connection_manager import ConnectionManager, DRAIN_CLOSE_CODE
+from app.game_state import GameState
+
+
+class FakeWebSocket:
+    def __init__(self):
+        self.sent = []
+        self.close_code = None
+
+    async def accept(self):
+        pass
+
+    async def close(self, code=1000):
+        self.close_code = code
+
+    async def send_text(self, text):
+        self.sent.append(text)
+
+
+class RecordingExporter:
+    def __init__(self):
+        self.scores = []
+        self.room_statuses = []
+
+    def submit_score(self, room_id, results):
+        self.scores.append(room_id)
+
+    def submit_room_status(self, room_id, active_players):
+        self.room_statuses.append(active_players)
+
+
+class ReconnectTest(unittest.TestCase):
+    def setUp(self):
+        self.manager = ConnectionManager()
+        self.exporter = RecordingExporter()
+
+    async def start_round(self, grace: float):
+        await self.manager.create_new_room("blip")
+        room = self.manager.get_room("blip")
+        room.exporter = self.exporter
+        room.reconnect_grace = grace
+        websockets = [FakeWebSocket(), FakeWebSocket()]
+        for i, websocket in enumerate(websockets):
+            await self.manager.connect(websocket, "blip", f"player_{i}", f"nick_{i}")
+        await self.manager.handle_ws_message('{"gameState": "COMPLETING", "results": {"City": "Abc"}}',
+                                             "blip", "player_1")
+        return room, websockets
+
+    def test_player_resumes_within_grace(self):
+        async def run():
+            room, websockets = await self.start_round(grace=5)
+            game_id, exports = room.game_id, (len(self.exporter.scores), len(self.exporter.room_statuses))
+
+            await self.manager.disconnect(websockets[1])
+            self.assertEqual(GameState.completing, room.game.game_state)
+            self.assertEqual(["player_0", "player_1"], room.get_players_in_game_ids())
+            self.assertEqual([], self.manager.check_indexes())
+
+            await room.broadcast_json()
+            reconnected = FakeWebSocket()
+            await self.manager.connect(reconnected, "blip", "player_1", "nick_1")
+            await room.drain()
+
+            self.assertEqual(game_id, room.game_id)
+            self.assertEqual({"City": "abc"}, room.game.temporary_categories["player_1"])
+            self.assertIn('"game_state": "COMPLETING"', reconnected.sent[0])
+            self.assertEqual(exports, (len(self.exporter.scores), len(self.exporter.room_statuses)))
+            self.assertIsNone(room.scheduler.deadline(room.reconnect_key("player_1")))
+            self.assertEqual([], self.manager.check_indexes())
+            room.scheduler.cancel(room.id)
+
+        asyncio.run(run())
+
+    def test_player_is_removed_after_grace(self):
+        async def run():
+            room, websockets = await self.start_round(grace=0.05)
+            await self.manager.disconnect(websockets[1])
+            await asyncio.sleep(0.2)
+            self.assertEqual(["player_0"], room.get_players_in_game_ids())
+            self.assertEqual(GameState.lobby, room.game.game_state)
+            self.assertEqual([], self.manager.check_indexes())
+
+        asyncio.run(run())
+
+    def test_drain_closes_only_live_sockets(self):
+        async def run():
+            room, websockets = await self.start_round(grace=5)
+            await self.manager.disconnect(websockets[1])
+            with mock.patch('app.connection_manager.log') as log:
+                report = await self.manager.drain(timeout=0)
+            self.assertEqual(2, report["players"])
+            self.assertEqual([DRAIN_CLOSE_CODE, None], [websocket.close_code for websocket in websockets])
+            self.assertFalse([call for call in log.log.call_args_list if call.args[0] >= 30
+                              and call.args[1].startswith("closing")])
+
+        asyncio.run(run())
+
+
+if __name__ == '__main__':
+    unittest.main()
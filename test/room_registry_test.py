@@ -0,0 +1,74 @@
+import unittest
+
+from app.room import Room
+from app.room_registry import RoomRegistry
+from app.server_errors import NoRoomWithThisId, RoomIdAlreadyInUse, RoomLimitReached
+
+
+class RoomRegistryTest(unittest.TestCase):
+    def test_adding_and_removing_rooms(self):
+        registry = RoomRegistry()
+        created, deleted = [], []
+        registry.on_create.append(lambda room: created.append(room.id))
+        registry.on_delete.append(lambda room: deleted.append(room.id))
+
+        room = registry.add(Room(room_id="a"))
+        registry.add(Room(room_id="b"))
+
+        self.assertIs(room, registry.get("a"))
+        self.assertEqual(("a", "b"), registry.get_stats()["rooms_ids"])
+        self.assertRaises(RoomIdAlreadyInUse, registry.add, Room(room_id="a"))
+
+        registry.remove("a")
+        self.assertRaises(NoRoomWithThisId, registry.get, "a")
+        self.assertRaises(NoRoomWithThisId, registry.remove, "a")
+        self.assertEqual(["a", "b"], created)
+        self.assertEqual(["a"], deleted)
+        self.assertEqual({'rooms_count': 1, 'rooms_ids': ("b",), 'max_rooms': 0, 'rooms_created': 2,
+                          'rooms_deleted': 1, 'rooms_evicted': 0, 'rooms_rejected': 0}, registry.get_stats())
+
+    def test_ids_are_not_rebuilt_between_changes(self):
+        registry = RoomRegistry()
+        registry.add(Room(room_id="a"))
+        ids = registry.get_ids()
+        self.assertIs(ids, registry.get_ids())
+        registry.add(Room(room_id="b"))
+        self.assertEqual(("a", "b"), registry.get_ids())
+
+    def test_idle_rooms_are_evicted_when_full(self):
+        registry = RoomRegistry(max_rooms=2, idle_timeout=60)
+        registry.add(Room(room_id="pinned"), pinned=True).last_activity -= 60
+        registry.add(Room(room_id="idle")).last_activity -= 60
+
+        registry.add(Room(room_id="new"))
+
+        self.assertEqual(("pinned", "new"), registry.get_ids())
+        self.assertEqual(1, registry.get_stats()["rooms_evicted"])
+
+    def test_busy_rooms_are_not_evicted(self):
+        registry = RoomRegistry(max_rooms=1, idle_timeout=60)
+        room = registry.add(Room(room_id="busy"))
+        room.last_activity -= 60
+        room.active_connections.append(object())
+
+        self.assertRaises(RoomLimitReached, registry.add, Room(room_id="new"))
+        self.assertEqual(("busy",), registry.get_ids())
+        self.assertEqual(1, registry.get_stats()["rooms_rejected"])
+
+    def test_rooms_are_not_evicted_without_a_timeout(self):
+        registry = RoomRegistry(max_rooms=1)
+        registry.add(Room(room_id="idle")).last_activity -= 3600
+
+        self.assertRaises(RoomLimitReached, registry.add, Room(room_id="new"))
+        self.assertEqual(("idle",), registry.get_ids())
+
+    def test_stats_share_the_ids_without_exposing_them(self):
+        registry = RoomRegistry()
+        registry.add(Room(room_id="a"))
+        ids = registry.get_stats()["rooms_ids"]
+        self.assertIs(ids, registry.get_stats()["rooms_ids"])
+        self.assertIsInstance(ids, tuple)
+
+
+if __name__ == '__main__':
+    unittest.main()
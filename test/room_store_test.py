@@ -0,0 +1,144 @@
+import asyncio
+import os
+import tempfile
+import unittest
+from datetime import datetime, timedelta
+
+from app.connection import Connection
+from app.connection_manager import ConnectionManager
+from app.game_state import GameState
+from app.player import Player
+from app.room import Room
+from app.room_store import MemoryRoomStore, SqliteRoomStore, restore_room, snapshot_room
+from app.scheduler import scheduler
+from app.server_errors import RoomLimitReached
+
+
+class FakeWebSocket:
+    def __init__(self):
+        self.sent = []
+
+    async def accept(self):
+        pass
+
+    async def send_text(self, text):
+        self.sent.append(text)
+
+
+def mid_round_room() -> Room:
+    room = Room(room_id="snapshot")
+    for player_id in ["player_1", "player_2"]:
+        room.active_connections.append(Connection(FakeWebSocket(), Player(player_id, player_id, True)))
+    room.game_id = "game"
+    room.game.game_state = GameState.completing
+    room.game.temporary_categories = {"player_1": {"City": room.game.letter + "aaa"},
+                                      "player_2": {"City": room.game.letter + "aab"}}
+    room.game.build_full_categories()
+    room.game.game_state = GameState.voting
+    room.game.votes = {"player_1": {"City": {room.game.letter + "aab": False}}}
+    room.timestamp = datetime.now() + timedelta(seconds=30)
+    return room
+
+
+def state_of(room: Room):
+    return (room.id, room.game_id, room.game.game_state, room.game.letter, room.game.temporary_categories,
+            room.game.votes, room.game.get_voting_candidates(),
+            [(c.category_name, c.word, c.cluster, c.player_id, c.legit_score) for c in room.game.categories.categories])
+
+
+class RoomSnapshotTest(unittest.TestCase):
+    def test_snapshot_round_trip(self):
+        room = mid_round_room()
+
+        async def run():
+            restored = restore_room(snapshot_room(room))
+            self.assertAlmostEqual(30, restored.scheduler.deadline(restored.id) - asyncio.get_running_loop().time(),
+                                   delta=1)
+            restored.scheduler.cancel(restored.id)
+            return restored
+
+        restored = asyncio.run(run())
+        self.assertEqual(state_of(room), state_of(restored))
+        room.game.summary_voting()
+        restored.game.summary_voting()
+        self.assertEqual([c.score for c in room.game.categories.categories],
+                         [c.score for c in restored.game.categories.categories])
+
+    def test_stores(self):
+        path = os.path.join(tempfile.mkdtemp(), "rooms.db")
+        for store in [MemoryRoomStore(), SqliteRoomStore(path)]:
+            store.save("a", b"first")
+            store.save("a", b"second")
+            store.save("b", b"other")
+            self.assertEqual(b"second", asyncio.run(store.load("a")))
+            store.delete("b")
+            self.assertIsNone(asyncio.run(store.load("b")))
+            self.assertEqual(["a"], store.room_ids())
+        self.assertEqual(b"second", asyncio.run(SqliteRoomStore(path).load("a")))
+
+
+class LazyRestoreTest(unittest.TestCase):
+    def setUp(self):
+        self.path = os.path.join(tempfile.mkdtemp(), "rooms.db")
+
+    def persisted_room(self) -> Room:
+        old_manager = ConnectionManager(store=SqliteRoomStore(self.path))
+
+        async def run_old():
+            await old_manager.create_new_room("persisted")
+            await old_manager.connect(FakeWebSocket(), "persisted", "player_1", "one")
+            await old_manager.connect(FakeWebSocket(), "persisted", "player_2", "two")
+            old_manager.store.flush()
+            room = old_manager.get_room("persisted")
+            room.scheduler.cancel(room.id)
+            return room
+
+        return asyncio.run(run_old())
+
+    def test_memory_store_is_not_written(self):
+        store = MemoryRoomStore()
+        manager = ConnectionManager(store=store)
+
+        async def run():
+            await manager.create_new_room("volatile")
+            await manager.connect(FakeWebSocket(), "volatile", "player_1", "one")
+
+        asyncio.run(run())
+        self.assertEqual({}, store.snapshots)
+
+    def test_room_that_does_not_fit_leaves_no_timers(self):
+        self.persisted_room()
+        new_manager = ConnectionManager(store=SqliteRoomStore(self.path))
+        new_manager.rooms.max_rooms = len(new_manager.rooms) + 1
+        new_manager.rooms.add(Room(room_id="busy"))
+
+        async def run():
+            with self.assertRaises(RoomLimitReached):
+                await new_manager.connect(FakeWebSocket(), "persisted", "player_1", "one")
+
+        asyncio.run(run())
+        self.assertNotIn("persisted", new_manager.rooms)
+        self.assertIsNone(scheduler.deadline("persisted"))
+        self.assertIsNone(scheduler.deadline(("reconnect", "persisted", "player_2")))
+
+    def test_room_is_restored_when_player_reconnects(self):
+        old_room = self.persisted_room()
+        self.assertEqual(GameState.completing, old_room.game.game_state)
+
+        new_manager = ConnectionManager(store=SqliteRoomStore(self.path))
+
+        async def run_new():
+            websocket = FakeWebSocket()
+            await new_manager.connect(websocket, "persisted", "player_1", "one")
+            await new_manager.get_room("persisted").drain()
+            return websocket
+
+        websocket = asyncio.run(run_new())
+        room = new_manager.get_room("persisted")
+        self.assertEqual(old_room.game_id, room.game_id)
+        self.assertEqual(GameState.completing, room.game.game_state)
+        self.assertIn('"game_state": "COMPLETING"', websocket.sent[0])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,90 @@
+import asyncio
+import unittest
+
+from app.scheduler import PhaseScheduler
+
+
+class PhaseSchedulerTest(unittest.TestCase):
+    def test_fires_in_deadline_order(self):
+        scheduler = PhaseScheduler()
+        fired = []
+
+        def record(key):
+            async def callback():
+                fired.append(key)
+
+            return callback
+
+        async def run():
+            scheduler.schedule("b", 0.02, record("b"))
+            scheduler.schedule("a", 0.01, record("a"))
+            scheduler.schedule("c", 0.03, record("c"))
+            await asyncio.sleep(0.1)
+
+        asyncio.run(run())
+        self.assertEqual(["a", "b", "c"], fired)
+        self.assertEqual(0, scheduler.get_stats()["pending_deadlines"])
+        self.assertEqual(3, scheduler.get_stats()["fired"])
+
+    def test_cancel_and_reschedule(self):
+        scheduler = PhaseScheduler()
+        fired = []
+
+        async def callback():
+            fired.append(True)
+
+        async def run():
+            scheduler.schedule("room", 0.01, callback)
+            self.assertTrue(scheduler.cancel("room"))
+            self.assertFalse(scheduler.cancel("room"))
+            await asyncio.sleep(0.03)
+            self.assertEqual([], fired)
+
+            scheduler.schedule("room", 0.01, callback)
+            scheduler.reschedule("room", 0.05)
+            self.assertEqual(1, scheduler.get_stats()["pending_deadlines"])
+            await asyncio.sleep(0.03)
+            self.assertEqual([], fired)
+            await asyncio.sleep(0.05)
+
+        asyncio.run(run())
+        self.assertEqual([True], fired)
+
+    def test_callback_can_schedule_next_phase(self):
+        scheduler = PhaseScheduler()
+        phases = []
+
+        async def next_stage():
+            phases.append(len(phases))
+            if len(phases) < 3:
+                scheduler.schedule("room", 0.005, next_stage)
+
+        async def run():
+            scheduler.schedule("room", 0.005, next_stage)
+            await asyncio.sleep(0.1)
+
+        asyncio.run(run())
+        self.assertEqual([0, 1, 2], phases)
+        self.assertGreaterEqual(scheduler.get_stats()["max_lag"], 0)
+
+    def test_failing_callback_does_not_stop_others(self):
+        scheduler = PhaseScheduler()
+        fired = []
+
+        async def failing():
+            raise ValueError
+
+        async def ok():
+            fired.append(True)
+
+        async def run():
+            scheduler.schedule("failing", 0.01, failing)
+            scheduler.schedule("ok", 0.01, ok)
+            await asyncio.sleep(0.05)
+
+        asyncio.run(run())
+        self.assertEqual([True], fired)
+
+
+if __name__ == '__main__':
+    unittest.main()
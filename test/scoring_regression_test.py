@@ -0,0 +1,107 @@
+import copy
+import random
+import unittest
+
+from app.game import Category, Game
+
+
+def reference_count_votes(categories, votes):
+    for player in votes:
+        for p_category in votes[player]:
+            for word in votes[player][p_category]:
+                try:
+                    voting = votes[player][p_category][word]
+                    for category in categories:
+                        if category.word == word and category.category_name == p_category:
+                            if voting is True:
+                                category.legit_score += 1
+                            if voting is False:
+                                category.legit_score -= 1
+                except (TypeError, KeyError):
+                    pass
+
+
+def reference_summary_voting(categories, votes, letter):
+    categories = [c for c in categories if c.player_id]
+    reference_count_votes(categories, votes)
+    for category in categories:
+        if category.word not in [c.word for c in categories if
+                                 c.category_name == category.category_name and c.player_id != category.player_id]:
+            category.is_unique = True
+    for category in categories:
+        if category.legit_score >= 0:
+            category.is_legit = True
+            first_letter = category.word[0] if category.word else ""
+            if first_letter != letter:
+                category.is_legit = False
+    for category in categories:
+        other_legit = [c.is_legit for c in categories if
+                       c.category_name == category.category_name and c.player_id != category.player_id]
+        if not any(other_legit):
+            category.is_only_word_in_category = True
+    for category in categories:
+        if category.word == "":
+            category.score = 0
+        elif category.is_legit:
+            if category.is_only_word_in_category is True:
+                category.score = 15
+            elif category.is_unique is True:
+                category.score = 10
+            else:
+                category.score = 5
+    return categories
+
+
+def random_game(rng: random.Random):
+    names = ["Country", "City", "Item", "Animal", "Plant", "Name"][:rng.randint(1, 6)]
+    players = [f"player_{i}" for i in range(rng.randint(1, 8))]
+    letter = rng.choice("abc")
+    vocabulary = [""] + [first + rest for first in "abcd" for rest in ("", "x", "yy")]
+    categories = [Category(name) for name in names]
+    for player in players:
+        for name in names:
+            if rng.random() < 0.9:
+                category = Category(name)
+                category.word = rng.choice(vocabulary)
+                category.player_id = player
+                category.legit_score = rng.randint(-1, 1)
+                categories.append(category)
+    votes = {}
+    for player in players:
+        if rng.random() < 0.2:
+            votes[player] = rng.choice([None, ["a"], {"Country": None}, {"City": ["ax"]}])
+            continue
+        votes[player] = {name: {word: rng.choice([True, False, None, "yes"])
+                                for word in rng.sample(vocabulary, rng.randint(0, 4))}
+                         for name in names + ["Unknown"] if rng.random() < 0.8}
+    return categories, votes, letter
+
+
+def outcome(categories):
+    return [(c.player_id, c.category_name, c.word, c.legit_score, c.is_unique, c.is_legit,
+             c.is_only_word_in_category, c.score) for c in categories]
+
+
+class ScoringRegressionTest(unittest.TestCase):
+    def test_indexed_scoring_matches_reference(self):
+        rng = random.Random(2021)
+        for _ in range(500):
+            categories, votes, letter = random_game(rng)
+            game = Game()
+            game.letter = letter
+            game.categories.categories = []
+            for category in categories:
+                game.categories.append(category)
+            game.votes = votes
+            try:
+                expected = reference_summary_voting(copy.deepcopy(categories), votes, letter)
+            except TypeError:
+                self.assertRaises(TypeError, game.summary_voting)
+                continue
+            game.summary_voting()
+
+            self.assertEqual(outcome(expected), outcome(game.categories.categories))
+
+
+if __name__ == '__main__':
+    unittest.main()
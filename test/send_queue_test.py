@@ -0,0 +1,128 @@
+import asyncio
+import json
+import unittest
+from datetime import datetime
+
+from app.connection import Connection
+from app.game_state import GameState
+from app.player import Player
+from app.room import Room
+
+
+class FakeWebSocket:
+    def __init__(self):
+        self.sent = []
+
+    async def send_text(self, text):
+        self.sent.append(text)
+
+
+class StuckWebSocket(FakeWebSocket):
+    def __init__(self):
+        super().__init__()
+        self.close_code = None
+
+    async def send_text(self, text):
+        await asyncio.Event().wait()
+
+    async def close(self, code=1000):
+        self.close_code = code
+
+
+class BrokenWebSocket(FakeWebSocket):
+    async def send_text(self, text):
+        raise RuntimeError("socket closed")
+
+
+def connect(room: Room, player_id: str, ws, max_queue: int = 32) -> Connection:
+    connection = Connection(ws, Player(player_id, player_id, True), max_queue=max_queue)
+    room.active_connections.append(connection)
+    connection.on_send_failure = room.drop_connection
+    return connection
+
+
+class SendQueueTest(unittest.TestCase):
+    def test_slow_consumer_is_dropped(self):
+        room = Room(room_id="slow")
+
+        async def run():
+            fast = [connect(room, f"fast_{i}", FakeWebSocket()) for i in range(3)]
+            slow = connect(room, "slow", StuckWebSocket(), max_queue=2)
+            # two broadcasts fill the queue, the third one in a row that finds it full drops the consumer
+            for _ in range(5):
+                self.assertIn(slow, room.active_connections)
+                await room.broadcast_json()
+            await room.drain()
+            return fast, slow
+
+        fast, slow = asyncio.run(run())
+        self.assertNotIn(slow, room.active_connections)
+        self.assertEqual(1008, slow.ws.close_code)
+        self.assertEqual(3, len(room.active_connections))
+        for connection in fast:
+            self.assertEqual(5, len(connection.ws.sent))
+            self.assertEqual(0, connection.get_stats()["queue_depth"])
+            self.assertEqual(5, connection.get_stats()["sent"])
+
+    def test_consumer_that_catches_up_keeps_the_latest_state(self):
+        room = Room(room_id="lagging")
+
+        async def run():
+            for i in range(2):
+                connect(room, f"other_{i}", FakeWebSocket())
+            lagging = connect(room, "lagging", FakeWebSocket(), max_queue=1)
+            for _ in range(3):
+                await room.broadcast_json()
+            await room.drain()
+            room.game.game_state = GameState.completing
+            room.timestamp = datetime.now()
+            await room.broadcast_json()
+            await room.drain()
+            return lagging
+
+        lagging = asyncio.run(run())
+        self.assertIn(lagging, room.active_connections)
+        self.assertEqual((2, 2), (lagging.get_stats()["sent"], lagging.dropped))
+        self.assertEqual(0, lagging.overflows)
+        self.assertEqual("COMPLETING", json.loads(lagging.ws.sent[-1])["game_state"])
+
+    def test_failed_send_does_not_stop_broadcast(self):
+        room = Room(room_id="broken")
+
+        async def run():
+            first = connect(room, "first", FakeWebSocket())
+            broken = connect(room, "broken", BrokenWebSocket())
+            last = connect(room, "last", FakeWebSocket())
+            await room.broadcast_json()
+            await room.drain()
+            await broken.failure_task
+            return first, broken, last
+
+        first, broken, last = asyncio.run(run())
+        self.assertEqual(1, len(first.ws.sent))
+        self.assertEqual(1, len(last.ws.sent))
+        self.assertEqual([first, last], room.active_connections)
+
+    def test_connection_waiting_for_its_failure_handler_is_not_dropped(self):
+        room = Room(room_id="failing")
+
+        async def run():
+            connect(room, "other", FakeWebSocket())
+            failing = connect(room, "failing", BrokenWebSocket())
+            failing.on_send_failure = room.suspend_connection
+            await room.broadcast_json()
+            await asyncio.sleep(0)  # the send fails, the failure handler has not run yet
+            self.assertIsNotNone(failing.failure_task)
+            await room.broadcast_json()
+            await failing.failure_task
+            await room.drain()
+            room.scheduler.cancel(room.reconnect_key(failing.player.id))
+            return failing
+
+        failing = asyncio.run(run())
+        self.assertIn(failing, room.active_connections)
+        self.assertTrue(failing.suspended)
+
+
+if __name__ == '__main__':
+    unittest.main()
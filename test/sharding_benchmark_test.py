@@ -0,0 +1,156 @@
+import asyncio
+import json
+import multiprocessing
+import os
+import random
+import socket
+import time
+import unittest
+
+import httpx
+
+try:
+    import websockets
+except ImportError:
+    websockets = None
+
+WORKER_COUNTS = [int(w) for w in os.getenv("SHARDING_BENCHMARK_WORKERS", "1,2,4").split(",")]
+# the same client processes drive every worker count, so only the servers scale
+DRIVERS = int(os.getenv('SHARDING_BENCHMARK_DRIVERS', 4))
+ROOMS_PER_DRIVER = int(os.getenv('SHARDING_BENCHMARK_ROOMS', 48))
+CONCURRENT_ROOMS = 8
+PLAYERS = 4
+MOVES = 10
+SESSION_TIMEOUT = 30
+# rounds do not end while measured, the players' moves are not rate limited and the unsent exports not logged
+SERVER_ENV = {'ROUND_TIMEOUT': '600', 'WS_MESSAGE_RATE': '100000', 'WS_MESSAGE_BURST': '100000',
+              'WS_ROOM_MESSAGE_RATE': '100000', 'WS_ROOM_MESSAGE_BURST': '100000', 'LOG_LEVEL': 'ERROR'}
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def serve(nodes, node, port):
+    os.environ.update(SERVER_ENV)
+    os.environ['SHARD_NODES'] = ",".join(nodes)
+    os.environ['SHARD_SELF'] = node
+    import uvicorn
+    uvicorn.run("app.main:app", host="127.0.0.1", port=port, log_level="warning")
+
+
+async def wait_until_ready(nodes):
+    async with httpx.AsyncClient() as client:
+        for node in nodes:
+            for _ in range(200):
+                try:
+                    if (await client.get(node + "/")).status_code == 200:
+                        break
+                except httpx.HTTPError:
+                    pass
+                await asyncio.sleep(0.05)
+
+
+async def receive_until(ws, game_state: str, message: dict) -> dict:
+    while message["game_state"] != game_state:
+        message = json.loads(await ws.recv())
+    return message
+
+
+async def join(url: str):
+    # a shard that does not own the room answers with a single REDIRECT message
+    ws = await websockets.connect(url)
+    message = json.loads(await ws.recv())
+    if message["game_state"] == "REDIRECT":
+        await ws.close()
+        ws = await websockets.connect(message["url"])
+        message = json.loads(await ws.recv())
+    return ws, message
+
+
+async def play(rng: random.Random, nodes, room_id: str, player: str, moved: asyncio.Semaphore,
+               ended: asyncio.Event):
+    ws, message = await join(f"{rng.choice(nodes).replace('http', 'ws', 1)}/ws/{room_id}/{player}/{player}")
+    try:
+        game_data = (await receive_until(ws, "COMPLETING", message))["game_data"]
+        categories, letter = game_data["categories"], game_data["letter"]
+        for move in range(MOVES):
+            answer = {categories[move % len(categories)]: f"{letter}{player}{move}"}
+            await ws.send(json.dumps({"gameState": "COMPLETING", "delta": answer}))
+        moved.release()
+        await ended.wait()
+        await receive_until(ws, "LOBBY", json.loads(await ws.recv()))
+    finally:
+        await ws.close()
+
+
+async def room_session(client: httpx.AsyncClient, rng: random.Random, nodes, room_id: str):
+    # the REST calls go to a random shard and are forwarded to the room's owner, the players join through any shard
+    response = await client.post(f"{rng.choice(nodes)}/room/new/{room_id}")
+    assert response.status_code == 200, response.text
+    moved, ended = asyncio.Semaphore(0), asyncio.Event()
+    players = asyncio.gather(*(play(rng, nodes, room_id, f"p{i}", moved, ended) for i in range(PLAYERS)))
+    try:
+        for _ in range(PLAYERS):
+            await asyncio.wait_for(moved.acquire(), SESSION_TIMEOUT)
+        response = await client.post(f"{rng.choice(nodes)}/game/end/{room_id}")
+        assert response.status_code == 200, response.text
+        ended.set()
+        await asyncio.wait_for(players, SESSION_TIMEOUT)
+    finally:
+        players.cancel()
+    await client.delete(f"{rng.choice(nodes)}/room/{room_id}")
+
+
+def drive(nodes, seed) -> int:
+    async def run():
+        rng = random.Random(seed)
+        slots = asyncio.Semaphore(CONCURRENT_ROOMS)
+        async with httpx.AsyncClient(timeout=SESSION_TIMEOUT) as client:
+            async def session(room_id):
+                async with slots:
+                    await room_session(client, rng, nodes, room_id)
+
+            await asyncio.gather(*(session(f"bench-{len(nodes)}-{seed}-{i}") for i in range(ROOMS_PER_DRIVER)))
+        return ROOMS_PER_DRIVER
+
+    return asyncio.run(run())
+
+
+def measure(workers: int) -> float:
+    ports = [free_port() for _ in range(workers)]
+    nodes = [f"http://127.0.0.1:{port}" for port in ports]
+    context = multiprocessing.get_context("spawn")
+    processes = [context.Process(target=serve, args=(nodes if workers > 1 else [], node, port), daemon=True)
+                 for node, port in zip(nodes, ports)]
+    for process in processes:
+        process.start()
+    try:
+        asyncio.run(wait_until_ready(nodes))
+        with context.Pool(DRIVERS) as pool:
+            start = time.perf_counter()
+            rooms = sum(pool.starmap(drive, [(nodes, seed) for seed in range(DRIVERS)]))
+            return rooms / (time.perf_counter() - start)
+    finally:
+        for process in processes:
+            process.terminate()
+            process.join()
+
+
+@unittest.skipUnless(os.getenv('SHARDING_BENCHMARK'), "spawns uvicorn workers, set SHARDING_BENCHMARK=1 to run")
+@unittest.skipIf(websockets is None, "websockets is not installed")
+class ShardingBenchmarkTest(unittest.TestCase):
+    def test_throughput_scales_with_workers(self):
+        throughput = {}
+        for workers in WORKER_COUNTS:
+            throughput[workers] = measure(workers)
+            print(f"\n{workers} workers: {throughput[workers]:.1f} rooms/s, "
+                  f"{throughput[workers] * PLAYERS * MOVES:.0f} moves/s")
+        if (os.cpu_count() or 1) >= 2 * max(WORKER_COUNTS) + DRIVERS:
+            self.assertGreater(throughput[max(WORKER_COUNTS)], 1.5 * throughput[1])
+
+
+if __name__ == '__main__':
+    unittest.main()
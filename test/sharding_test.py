@@ -0,0 +1,112 @@
+import unittest
+from collections import Counter
+
+import httpx
+from fastapi import FastAPI, WebSocket
+from fastapi.testclient import TestClient
+
+from app.sharding import RoomAffinityMiddleware, ShardRing
+
+NODES = ["http://node-0", "http://node-1", "http://node-2"]
+SECRET = "shard-secret"
+
+
+class NodesTransport(httpx.AsyncBaseTransport):
+    def __init__(self, apps: dict):
+        self.apps = apps
+
+    async def handle_async_request(self, request):
+        app = self.apps[f"{request.url.scheme}://{request.url.host}"]
+        return await httpx.ASGITransport(app=app).handle_async_request(request)
+
+
+def build_node(node: str, ring: ShardRing, transport) -> FastAPI:
+    app = FastAPI()
+
+    @app.post("/game/start/{room_id}")
+    async def start_game(room_id: str):
+        return {"node": node, "room_id": room_id}
+
+    @app.get("/stats/")
+    async def stats(room_id: str = None):
+        return {"node": node, "room_id": room_id}
+
+    @app.websocket("/ws/{room_id}/{client_id}/{nick}")
+    async def websocket_endpoint(websocket: WebSocket, room_id: str, client_id: str, nick: str):
+        await websocket.accept()
+        await websocket.send_json({"node": node})
+        await websocket.close()
+
+    app.add_middleware(RoomAffinityMiddleware, ring=ring, self_node=node, transport=transport, secret=SECRET)
+    return app
+
+
+class ShardRingTest(unittest.TestCase):
+    def test_rooms_are_spread_and_stable(self):
+        ring = ShardRing(NODES)
+        owners = Counter(ring.owner(str(room_id)) for room_id in range(3000))
+        self.assertEqual(set(NODES), set(owners))
+        self.assertGreater(min(owners.values()), 600)
+
+        grown = ShardRing(NODES + ["http://node-3"])
+        moved = [room_id for room_id in range(3000) if ring.owner(str(room_id)) != grown.owner(str(room_id))]
+        self.assertTrue(all(grown.owner(str(room_id)) == "http://node-3" for room_id in moved))
+        self.assertLess(len(moved), 1200)
+
+
+class RoomAffinityMiddlewareTest(unittest.TestCase):
+    def setUp(self):
+        self.ring = ShardRing(NODES)
+        apps = {}
+        transport = NodesTransport(apps)
+        for node in NODES:
+            apps[node] = build_node(node, self.ring, transport)
+        self.apps = apps
+
+    def test_rest_calls_are_forwarded_to_owner(self):
+        client = TestClient(self.apps["http://node-0"])
+        for room_id in map(str, range(20)):
+            owner = self.ring.owner(room_id)
+            self.assertEqual({"node": owner, "room_id": room_id}, client.post(f"/game/start/{room_id}").json())
+            self.assertEqual({"node": owner, "room_id": room_id}, client.get(f"/stats/?room_id={room_id}").json())
+        self.assertEqual({"node": "http://node-0", "room_id": None}, client.get("/stats/").json())
+
+    def test_forwarded_header_needs_the_secret(self):
+        room_id = next(str(i) for i in range(100) if self.ring.owner(str(i)) != "http://node-0")
+        owner = self.ring.owner(room_id)
+        client = TestClient(self.apps["http://node-0"])
+        for value in ["http://node-1", "wrong-secret"]:
+            response = client.post(f"/game/start/{room_id}", headers={"x-shard-forwarded": value})
+            self.assertEqual({"node": owner, "room_id": room_id}, response.json())
+        response = client.post(f"/game/start/{room_id}", headers={"x-shard-forwarded": SECRET})
+        self.assertEqual({"node": "http://node-0", "room_id": room_id}, response.json())
+
+    def test_forwarded_header_without_secret_is_trusted_from_shards_only(self):
+        room_id = next(str(i) for i in range(100) if self.ring.owner(str(i)) != "http://node-0")
+        app = FastAPI()
+
+        @app.post("/game/start/{room_id}")
+        async def start_game(room_id: str):
+            return {"node": "local"}
+
+        app.add_middleware(RoomAffinityMiddleware, ring=self.ring, self_node="http://node-0",
+                           transport=NodesTransport(self.apps), trusted_hosts={"testclient"})
+        response = TestClient(app).post(f"/game/start/{room_id}", headers={"x-shard-forwarded": "http://node-1"})
+        self.assertEqual({"node": "local"}, response.json())
+
+    def test_websocket_is_redirected_to_owner(self):
+        room_id = next(str(i) for i in range(100) if self.ring.owner(str(i)) != "http://node-0")
+        owner = self.ring.owner(room_id)
+        client = TestClient(self.apps["http://node-0"])
+        with client.websocket_connect(f"/ws/{room_id}/player/nick") as websocket:
+            message = websocket.receive_json()
+            self.assertEqual({"game_state": "REDIRECT", "url": owner.replace("http", "ws") + f"/ws/{room_id}/player/nick"},
+                             message)
+
+        owner_client = TestClient(self.apps[owner])
+        with owner_client.websocket_connect(f"/ws/{room_id}/player/nick") as websocket:
+            self.assertEqual({"node": owner}, websocket.receive_json())
+
+
+if __name__ == '__main__':
+    unittest.main()
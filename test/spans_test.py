@@ -0,0 +1,150 @@
+import asyncio
+import json
+import os
+import tempfile
+import unittest
+
+import httpx
+
+from app import spans
+from app.connection import Connection
+from app.exporter import Exporter
+from app.game_state import GameState
+from app.player import Player
+from app.protocol import PlayerMove
+from app.room import Room
+from app.scheduler import PhaseScheduler
+
+
+class FakeWebSocket:
+    async def send_text(self, text):
+        pass
+
+
+class ListExporter:
+    def __init__(self):
+        self.spans = []
+
+    def export(self, span):
+        self.spans.append(span.to_dict())
+
+
+class RoomSpansTest(unittest.TestCase):
+    def setUp(self):
+        self.recorded = ListExporter()
+        spans.tracer.exporter = self.recorded
+
+    def tearDown(self):
+        spans.tracer.exporter = None
+
+    def play_round(self) -> Room:
+        exporter = Exporter(base_url="http://results",
+                            transport=httpx.MockTransport(lambda request: httpx.Response(200, json={})))
+        room = Room(room_id="traced", scheduler=PhaseScheduler(), exporter=exporter)
+
+        async def run():
+            for player_id in ("a", "b"):
+                room.active_connections.append(Connection(FakeWebSocket(), Player(player_id, player_id, True)))
+            await room.start_game()
+            room.handle_players_move("a", PlayerMove("COMPLETING", results={"City": "Oslo"}))
+            for _ in range(3):  # voting, score display, next round
+                await room.next_stage()
+            await room.drain()
+            await exporter.close()
+            room.scheduler.cancel(room.id)
+
+        asyncio.run(run())
+        return room
+
+    def test_phase_transitions_are_traced_down_to_sends_and_exports(self):
+        room = self.play_round()
+        roots = [span for span in self.recorded.spans if not span["parentSpanId"]]
+        self.assertEqual(["start_game", "next_stage", "next_stage", "next_stage"], [span["name"] for span in roots])
+        self.assertEqual(["COMPLETING", "VOTING", "SCORE_DISPLAY"], [span["attributes"]["phase"] for span in roots[1:]])
+
+        def trace(root):
+            return [span for span in self.recorded.spans if span["traceId"] == root["traceId"]]
+
+        voting = [span["name"] for span in trace(roots[1])]
+        self.assertIn("build_full_categories", voting)
+        self.assertEqual(["send", "send"], [name for name in voting if name == "send"])
+        scoring = [span["name"] for span in trace(roots[2])]
+        self.assertLess(scoring.index("summary_voting"), scoring.index("broadcast_json"))
+        self.assertIn("encode_game_state", scoring)
+        self.assertIn("serialize", scoring)
+
+        restart = trace(roots[3])
+        self.assertIn("export", [span["name"] for span in restart])
+        first_game = roots[1]["attributes"]["game_id"]
+        self.assertTrue(all(span["attributes"]["room_id"] == "traced" for span in self.recorded.spans))
+        self.assertTrue(all(span["attributes"]["game_id"] == first_game for span in trace(roots[2])))
+        new_game = next(span for span in restart if span["name"] == "start_game")["attributes"]["game_id"]
+        self.assertNotEqual(first_game, new_game)
+        self.assertEqual(room.game_id, new_game)
+
+        by_id = {span["spanId"]: span for span in self.recorded.spans}
+        for span in self.recorded.spans:
+            if span["parentSpanId"]:
+                self.assertEqual(span["traceId"], by_id[span["parentSpanId"]]["traceId"])
+            self.assertLessEqual(span["startTimeUnixNano"], span["endTimeUnixNano"])
+
+    def test_grace_expiry_starts_a_trace_of_its_own(self):
+        scheduler = PhaseScheduler()
+        first, second = Room(room_id="first", scheduler=scheduler), Room(room_id="second", scheduler=scheduler)
+        second.reconnect_grace = 0.02
+        for player_id in ("a", "b"):
+            second.active_connections.append(Connection(FakeWebSocket(), Player(player_id, player_id, True)))
+        second.game.game_state = GameState.completing
+
+        async def run():
+            with first.span("start_game"):
+                scheduler.schedule(("first",), 0.01, first.drain)
+            connection = second.active_connections[1]
+            connection.suspend()
+            second.expect_reconnect(connection)
+            await asyncio.sleep(0.05)
+            await asyncio.gather(*scheduler.tasks)
+            await second.drain()
+
+        asyncio.run(run())
+        by_id = {span["spanId"]: span for span in self.recorded.spans}
+        expiry = next(span for span in self.recorded.spans if span["name"] == "expire_connection")
+        self.assertEqual(("", "second"), (expiry["parentSpanId"], expiry["attributes"]["room_id"]))
+        end_game = next(span for span in self.recorded.spans if span["name"] == "end_game")
+        self.assertEqual(expiry["spanId"], end_game["parentSpanId"])
+        for span in self.recorded.spans:
+            if span["attributes"].get("room_id") == "second" and span["parentSpanId"]:
+                self.assertEqual("second", by_id[span["parentSpanId"]]["attributes"]["room_id"])
+
+    def test_spans_are_off_without_an_exporter(self):
+        spans.tracer.exporter = None
+        self.assertIs(spans.NO_SPAN, spans.tracer.span("next_stage"))
+        with spans.tracer.span("next_stage") as span:
+            self.assertIsNone(span)
+
+
+class FileSpanExporterTest(unittest.TestCase):
+    def test_spans_are_written_as_json_lines_and_summarized(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "spans.jsonl")
+            tracer = spans.Tracer()
+            tracer.start(path)
+            with tracer.span("next_stage", parent=None, room_id="1"):
+                with tracer.span("summary_voting"):
+                    pass
+            with self.assertRaises(ValueError):
+                with tracer.span("export", parent=None):
+                    raise ValueError("backend down")
+            tracer.stop()
+
+            with open(path) as spans_file:
+                written = [json.loads(line) for line in spans_file]
+            self.assertEqual(["summary_voting", "next_stage", "export"], [span["name"] for span in written])
+            self.assertEqual({"room_id": "1"}, written[0]["attributes"])
+            self.assertEqual(("ERROR", "ValueError: backend down"),
+                             (written[2]["status"], written[2]["attributes"]["exception"]))
+            self.assertEqual({"export", "next_stage", "summary_voting"}, set(spans.summarize(path)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,92 @@
+import asyncio
+import threading
+import time
+import unittest
+
+from app.connection import Connection
+from app.game_state import GameState
+from app.player import Player
+from app.protocol import JsonCodec
+from app.room import Room
+from app.server_errors import ProfilerIsBusy
+from app.watchdog import LoopWatchdog, SamplingProfiler, render_collapsed
+
+
+class FakeWebSocket:
+    async def send_text(self, text):
+        pass
+
+
+class SlowCodec(JsonCodec):
+    # stands in for an expensive encode on the event loop
+    def dumps(self, obj) -> str:
+        time.sleep(0.3)
+        return super().dumps(obj)
+
+
+def spin(seconds: float):
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        pass
+
+
+class LoopWatchdogTest(unittest.TestCase):
+    def test_stall_is_sampled_and_blamed_on_the_handler(self):
+        watchdog = LoopWatchdog(interval=0.02, threshold=0.1)
+        room = Room(room_id="stalled")
+        room.active_connections.append(Connection(FakeWebSocket(), Player("player", "nick", True), codec=SlowCodec()))
+        room.game.game_state = GameState.lobby
+
+        async def run():
+            watchdog.start(asyncio.get_running_loop())
+            await asyncio.sleep(0.1)
+            await room.broadcast_json()
+            await asyncio.sleep(0.1)
+            await room.drain()
+            watchdog.stop()
+
+        asyncio.run(run())
+        self.assertEqual(1, len(watchdog.stalls))
+        stall = watchdog.stalls[0]
+        self.assertEqual("broadcast_json", stall["handler"])
+        self.assertGreater(stall["lag_seconds"], 0.1)
+        self.assertTrue(any(frame.startswith("app.room:broadcast_json:") for frame in stall["stack"]))
+        self.assertGreater(watchdog.max_lag, 0.2)
+
+    def test_quiet_loop_has_no_stalls(self):
+        watchdog = LoopWatchdog(interval=0.02, threshold=0.1)
+
+        async def run():
+            watchdog.start(asyncio.get_running_loop())
+            await asyncio.sleep(0.3)
+            watchdog.stop()
+
+        asyncio.run(run())
+        self.assertEqual([], list(watchdog.stalls))
+
+
+class SamplingProfilerTest(unittest.TestCase):
+    def test_collapsed_stacks_of_another_thread(self):
+        profiler = SamplingProfiler(interval=0.002)
+        target = threading.get_ident()
+        result = {}
+        sampler = threading.Thread(target=lambda: result.update(stacks=profiler.profile(target, 0.2)))
+        sampler.start()
+        spin(0.3)
+        sampler.join()
+
+        collapsed = render_collapsed(result["stacks"])
+        self.assertIn("watchdog_test:spin", collapsed)
+        stack, count = collapsed.splitlines()[0].rsplit(" ", 1)
+        self.assertGreater(int(count), 0)
+        self.assertTrue(stack.endswith("watchdog_test:spin"))
+
+    def test_one_profile_at_a_time(self):
+        profiler = SamplingProfiler()
+        profiler.lock.acquire()
+        with self.assertRaises(ProfilerIsBusy):
+            profiler.profile(threading.get_ident(), 0.1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,49 @@
+import uvicorn
+from fastapi import FastAPI, Request
+from starlette.responses import JSONResponse
+
+app = FastAPI()
+
+received = {"scores": [], "room_statuses": []}
+failures = {"remaining": 0}
+
+
+async def record(kind: str, request: Request):
+    if failures["remaining"] > 0:
+        failures["remaining"] -= 1
+        return JSONResponse(status_code=503, content={"detail": "injected failure"})
+    received[kind].append(await request.json())
+    return JSONResponse(status_code=200, content={"detail": "success"})
+
+
+@app.post("/games/handle-results/panstwa-miasta")
+async def handle_results(request: Request):
+    return await record("scores", request)
+
+
+@app.post("/rooms/update-room-status")
+async def update_room_status(request: Request):
+    return await record("room_statuses", request)
+
+
+@app.get("/stub/received")
+async def get_received():
+    return received
+
+
+@app.post("/stub/fail/{count}")
+async def fail_next(count: int):
+    failures["remaining"] = count
+    return {"detail": "success"}
+
+
+@app.delete("/stub/received")
+async def reset():
+    received["scores"].clear()
+    received["room_statuses"].clear()
+    failures["remaining"] = 0
+    return {"detail": "success"}
+
+
+if __name__ == "__main__":
+    uvicorn.run(app, host="0.0.0.0", port=5001, workers=1)
@@ -0,0 +1,313 @@
+import argparse
+import asyncio
+import json
+import os
+import random
+import re
+import socket
+import string
+import subprocess
+import sys
+import time
+from collections import Counter, defaultdict
+from datetime import datetime
+from typing import Dict, List, Optional
+
+import httpx
+
+from app.protocol import MSGPACK_SUBPROTOCOL, msgpack_codec
+
+try:
+    import websockets
+except ImportError:
+    websockets = None
+
+# the server sends the round deadline minus this many seconds as the timestamp
+TIMESTAMP_LEAD = 2
+# share of the players that leave a category blank, and of the votes that reject a word
+BLANK_ANSWER_RATE = 0.15
+REJECT_VOTE_RATE = 0.2
+METRIC_LINE = re.compile(r'^(?P<name>[a-zA-Z_:][a-zA-Z0-9_:]*)(?P<labels>\{[^}]*\})? (?P<value>\S+)$')
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def percentile(values: List[float], fraction: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def summarize(values: List[float]) -> dict:
+    return {"count": len(values),
+            "p50_ms": round(percentile(values, 0.5) * 1000, 2) if values else None,
+            "p99_ms": round(percentile(values, 0.99) * 1000, 2) if values else None,
+            "max_ms": round(max(values) * 1000, 2) if values else None}
+
+
+def parse_metrics(text: str) -> Dict[str, float]:
+    samples = {}
+    for line in text.splitlines():
+        match = METRIC_LINE.match(line)
+        if match:
+            samples[match['name'] + (match['labels'] or '')] = float(match['value'])
+    return samples
+
+
+class WordPool:
+    # a few answers per category and letter, shared by all bots so that rooms get duplicates and near misses
+    def __init__(self, seed: int = 0, size: int = 4):
+        self.seed = seed
+        self.size = size
+        self.pools = {}
+
+    def words(self, category: str, letter: str) -> List[str]:
+        key = (category, letter)
+        if key not in self.pools:
+            rng = random.Random(f"{self.seed}-{category}-{letter}")
+            self.pools[key] = [letter.upper() + ''.join(rng.choices(string.ascii_lowercase, k=rng.randint(3, 9)))
+                               for _ in range(self.size)]
+        return self.pools[key]
+
+    def answer(self, rng: random.Random, category: str, letter: str) -> str:
+        if rng.random() < BLANK_ANSWER_RATE:
+            return ''
+        words = self.words(category, letter)
+        # the first words of a pool are the popular ones
+        word = rng.choices(words, weights=[2 ** (self.size - i) for i in range(self.size)])[0]
+        if len(word) > 4 and rng.random() < 0.1:
+            typo = rng.randrange(1, len(word))
+            word = word[:typo] + rng.choice(string.ascii_lowercase) + word[typo + 1:]
+        return word
+
+
+class Stats:
+    def __init__(self):
+        self.transitions = defaultdict(list)
+        self.sent = 0
+        self.received = 0
+        self.rounds = 0
+        self.errors = Counter()
+
+
+class Bot:
+    def __init__(self, base_url: str, room_id: str, client_id: str, rounds: int, stats: Stats, words: WordPool,
+                 use_msgpack: bool = False, seed: int = 0):
+        self.url = f"{base_url.replace('http', 'ws', 1)}/ws/{room_id}/{client_id}/{client_id}"
+        self.rounds = rounds
+        self.stats = stats
+        self.words = words
+        self.use_msgpack = use_msgpack
+        self.rng = random.Random(f"{seed}-{room_id}-{client_id}")
+        self.game_state = None
+        # wall clock time the current phase is due to end and the time it started here
+        self.deadline = None
+        self.phase_received = None
+        self.player_task = None
+
+    def encode(self, message: dict):
+        return msgpack_codec.dumps(message) if self.use_msgpack else json.dumps(message)
+
+    def decode(self, frame) -> dict:
+        return msgpack_codec.loads(frame) if self.use_msgpack else json.loads(frame)
+
+    async def run(self):
+        subprotocols = [MSGPACK_SUBPROTOCOL] if self.use_msgpack else None
+        try:
+            async with websockets.connect(self.url, subprotocols=subprotocols, max_size=None) as ws:
+                async for frame in ws:
+                    self.stats.received += 1
+                    if self.on_message(ws, self.decode(frame), time.time()):
+                        break
+        except (OSError, websockets.WebSocketException) as e:
+            self.stats.errors[e.__class__.__name__] += 1
+        finally:
+            if self.player_task is not None:
+                self.player_task.cancel()
+
+    def on_message(self, ws, message: dict, received: float) -> bool:
+        game_state = message["game_state"]
+        if game_state == self.game_state:
+            return False  # players joining or leaving, same phase
+        if self.deadline is not None:
+            # the phase ends at its deadline, or at once if it was already due when it reached us
+            self.stats.transitions[game_state].append(received - max(self.deadline, self.phase_received))
+        self.game_state = game_state
+        self.phase_received = received
+        self.deadline = None
+        if "timestamp" in message:
+            self.deadline = datetime.fromisoformat(message["timestamp"]).timestamp() + TIMESTAMP_LEAD
+        if self.player_task is not None:
+            self.player_task.cancel()
+            self.player_task = None
+        game_data = message.get("game_data", {})
+        if game_state == "COMPLETING":
+            self.player_task = asyncio.create_task(self.complete(ws, game_data["categories"], game_data["letter"]))
+        elif game_state == "VOTING":
+            self.player_task = asyncio.create_task(self.vote(ws, game_data["candidates"]))
+        elif game_state == "SCORE_DISPLAY":
+            self.stats.rounds += 1
+            self.rounds -= 1
+            return self.rounds <= 0
+        return False
+
+    def time_left(self) -> float:
+        return max(0.0, (self.deadline or time.time()) - time.time())
+
+    async def send(self, ws, message: dict):
+        await ws.send(self.encode(message))
+        self.stats.sent += 1
+
+    async def complete(self, ws, categories: List[str], letter: str):
+        # answers are typed one by one over most of the round, then submitted in full
+        answers = {category: self.words.answer(self.rng, category, letter) for category in categories}
+        pause = self.time_left() * self.rng.uniform(0.3, 0.8) / max(1, len(categories))
+        for category, answer in answers.items():
+            await asyncio.sleep(pause)
+            if answer:
+                await self.send(ws, {"gameState": "COMPLETING", "delta": {category: answer}})
+        await asyncio.sleep(self.time_left() * self.rng.uniform(0.1, 0.5))
+        await self.send(ws, {"gameState": "COMPLETING", "results": answers})
+
+    async def vote(self, ws, candidates: Dict[str, List[str]]):
+        await asyncio.sleep(self.time_left() * self.rng.uniform(0.2, 0.7))
+        votes = {category: {word: self.rng.random() >= REJECT_VOTE_RATE for word in words}
+                 for category, words in candidates.items()}
+        await self.send(ws, {"gameState": "VOTING", "results": votes})
+
+
+async def probe_loop_lag(client: httpx.AsyncClient, base_url: str, samples: List[float], interval: float = 0.1):
+    # the round trip of a trivial request is mostly time spent waiting for the server's event loop
+    while True:
+        started = time.perf_counter()
+        try:
+            await client.get(f"{base_url}/")
+            samples.append(time.perf_counter() - started)
+        except httpx.HTTPError:
+            pass
+        await asyncio.sleep(interval)
+
+
+async def create_rooms(client: httpx.AsyncClient, base_url: str, room_ids: List[str], players: int):
+    for room_id in room_ids:
+        path = f"/room/new/{room_id}" if players <= 8 else f"/room/new/{room_id}/{players}"
+        response = await client.post(f"{base_url}{path}")
+        if response.status_code != 200:
+            raise RuntimeError(f"could not create room {room_id}: {response.status_code} {response.text}")
+
+
+async def run_load(base_url: str, rooms: int = 10, players: int = 6, rounds: int = 1, ramp: float = 1.0,
+                   use_msgpack: bool = False, seed: int = 0) -> dict:
+    stats = Stats()
+    words = WordPool(seed)
+    loop_lag = []
+    run_id = f"load{seed}-{random.randrange(16 ** 6):06x}"
+    room_ids = [f"{run_id}-{i}" for i in range(rooms)]
+    async with httpx.AsyncClient(timeout=30) as client:
+        before = parse_metrics((await client.get(f"{base_url}/metrics")).text)
+        await create_rooms(client, base_url, room_ids, players)
+        prober = asyncio.create_task(probe_loop_lag(client, base_url, loop_lag))
+        started = time.perf_counter()
+        bots = []
+        for i, room_id in enumerate(room_ids):
+            for player in range(players):
+                bot = Bot(base_url, room_id, f"p{player}", rounds, stats, words, use_msgpack, seed)
+                bots.append(asyncio.create_task(bot.run()))
+            await asyncio.sleep(ramp / rooms)
+        await asyncio.gather(*bots)
+        duration = time.perf_counter() - started
+        prober.cancel()
+        after = parse_metrics((await client.get(f"{base_url}/metrics")).text)
+        for room_id in room_ids:
+            await client.delete(f"{base_url}/room/{room_id}")
+
+    def delta(name: str) -> float:
+        return after.get(name, 0) - before.get(name, 0)
+
+    all_transitions = [latency for latencies in stats.transitions.values() for latency in latencies]
+    timer_fired, timer_lag = delta('panstwa_timer_lag_seconds_count'), delta('panstwa_timer_lag_seconds_sum')
+    return {
+        "rooms": rooms,
+        "players": rooms * players,
+        "rounds_played": stats.rounds,
+        "duration_seconds": round(duration, 2),
+        "phase_transition": summarize(all_transitions),
+        "phase_transition_by_phase": {phase: summarize(latencies) for phase, latencies in stats.transitions.items()},
+        "messages_sent": stats.sent,
+        "messages_received": stats.received,
+        "messages_per_second": round((stats.sent + stats.received) / duration, 1),
+        "server_messages_handled": delta('panstwa_ws_messages_total'),
+        "event_loop_lag": summarize(loop_lag),
+        "timer_lag_mean_ms": round(timer_lag / timer_fired * 1000, 2) if timer_fired else None,
+        "rss_mb": round(after['process_resident_memory_bytes'] / 2 ** 20, 1)
+        if 'process_resident_memory_bytes' in after else None,
+        "errors": dict(stats.errors),
+    }
+
+
+def start_process(args: List[str], env: dict) -> subprocess.Popen:
+    return subprocess.Popen([sys.executable, "-m", "uvicorn", *args, "--log-level", "warning"],
+                            env={**os.environ, **env})
+
+
+async def wait_until_ready(base_url: str, timeout: float = 20):
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient() as client:
+        while time.monotonic() < deadline:
+            try:
+                await client.get(f"{base_url}/")
+                return
+            except httpx.HTTPError:
+                await asyncio.sleep(0.05)
+    raise TimeoutError(f"{base_url} did not start")
+
+
+async def run_local(round_timeout: float = 36, **load) -> dict:
+    # a local server with its exports going to the stub in tools.export_stub
+    stub_port, server_port = free_port(), free_port()
+    stub = start_process(["tools.export_stub:app", "--port", str(stub_port)], {})
+    server = start_process(["app.main:app", "--port", str(server_port)],
+                           {"EXPORT_RESULTS_URL": f"http://127.0.0.1:{stub_port}",
+                            "ROUND_TIMEOUT": str(round_timeout), "LOG_LEVEL": "WARNING"})
+    try:
+        await wait_until_ready(f"http://127.0.0.1:{stub_port}")
+        await wait_until_ready(f"http://127.0.0.1:{server_port}")
+        return await run_load(f"http://127.0.0.1:{server_port}", **load)
+    finally:
+        for process in (server, stub):
+            process.terminate()
+            process.wait()
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Play rounds with websocket bots and report how the server copes.")
+    parser.add_argument("--url", help="server to load, by default a local one is started with a stub exporter")
+    parser.add_argument("--rooms", type=int, default=10)
+    parser.add_argument("--players", type=int, default=6, help="bots per room")
+    parser.add_argument("--rounds", type=int, default=1, help="rounds every bot plays before leaving")
+    parser.add_argument("--ramp", type=float, default=1.0, help="seconds over which the rooms are filled")
+    # below 30 seconds the score display timer is already due when it is set
+    parser.add_argument("--round-timeout", type=float, default=36, help="ROUND_TIMEOUT of the local server")
+    parser.add_argument("--msgpack", action="store_true", help="use the msgpack subprotocol")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+    if websockets is None:
+        parser.error("the load generator needs the websockets package")
+    if args.msgpack and msgpack_codec is None:
+        parser.error("--msgpack needs the msgpack package")
+    load = dict(rooms=args.rooms, players=args.players, rounds=args.rounds, ramp=args.ramp,
+                use_msgpack=args.msgpack, seed=args.seed)
+    if args.url:
+        report = asyncio.run(run_load(args.url.rstrip('/'), **load))
+    else:
+        report = asyncio.run(run_local(args.round_timeout, **load))
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()